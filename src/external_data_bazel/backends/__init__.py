@@ -1,11 +1,11 @@
 from external_data_bazel.backends.general import UrlBackend, UrlTemplatesBackend
 from external_data_bazel.backends.mock import MockBackend
+from external_data_bazel.backends.cas import CasBackend
+from external_data_bazel.backends.git_lfs import GitLfsBackend
+from external_data_bazel.backends.bazel_remote_cache import BazelRemoteCacheBackend
 
 # Do not import specific backends automagically.
 
-# TODO(eric.cousineau): Consider implementing Git LFS protocol as a backend for pure
-# Hash files (for migration, if needed).
-
 # TODO(eric.cousineau): Given that Backend supports a `project_relpath`, consider adding
 # git-lfs or git-annex clients as potential backends.
 
@@ -14,6 +14,9 @@ def _get_core_backends():
         "mock": MockBackend,
         "url": UrlBackend,
         "url_templates": UrlTemplatesBackend,
+        "cas": CasBackend,
+        "git_lfs": GitLfsBackend,
+        "bazel_remote_cache": BazelRemoteCacheBackend,
     }
 
 
@@ -0,0 +1,90 @@
+import pipes
+
+from external_data_bazel import util, hashes, futures
+from external_data_bazel.core import Backend
+
+# Bazel HTTP remote caches (e.g. bazel-remote, or nginx with WebDAV), via the content-addressed
+# store of the HTTP caching protocol:
+# https://bazel.build/remote/caching#http-caching
+#
+# Blobs live at `{url}/cas/{sha256}`, and are queried (HEAD), downloaded (GET), and uploaded (PUT)
+# there; files must use `sha256` hash files. The cache's own replication and eviction apply, so
+# only use a cache which does not evict data that must be kept (or overlay a durable remote).
+
+
+def _parse_head_code(url, output):
+    code = int(output)
+    if code == 200:
+        return True
+    elif code == 404:
+        return False
+    raise util.DownloadError("Unexpected response from remote cache (HTTP {}): {}".format(code, url))
+
+
+class BazelRemoteCacheBackend(Backend):
+    """ Bazel HTTP remote cache (`cas/` only). """
+    shareable = True
+    can_stream = True
+    hash_type = hashes.sha256
+
+    def __init__(self, config, package):
+        Backend.__init__(self, config, package, can_upload=not config.get('disable_upload', False))
+        # Base URL, including any instance prefix (e.g. "http://cache.example.com:8080/instance").
+        self._url = config['url'].rstrip('/')
+        # Headers (e.g. for authentication).
+        url_config_node = util.get_chain(
+            self.project.user.config, ['bazel_remote_cache', 'url', self._url])
+        headers = util.get_chain(url_config_node, ['headers'], {}) or {}
+        self._header_args = " ".join(pipes.quote(arg) for arg in util.header_args(headers))
+
+    def _cas_url(self, hash):
+        return "{}/cas/{}".format(self._url, hash.get_value())
+
+    def _args(self, url):
+        return "{} {}".format(self._header_args, pipes.quote(url))
+
+    def _head_args(self, url):
+        return '-s -I -o /dev/null --write-out "%{{http_code}}" {}'.format(self._args(url))
+
+    def has_file(self, hash, project_relpath):
+        if not self._is_supported(hash):
+            return False
+        url = self._cas_url(hash)
+        return _parse_head_code(url, util.curl(self._head_args(url)))
+
+    def download_file(self, hash, project_relpath, output_file):
+        self._check_hash_type(hash)
+        util.curl('-L --fail -s -o {} {}'.format(pipes.quote(output_file), self._args(self._cas_url(hash))))
+
+    def download_stream(self, hash, project_relpath, write):
+        self._check_hash_type(hash)
+        util.curl_stream(self._args(self._cas_url(hash)), write)
+
+    def _upload_args(self, hash, filepath):
+        # The cache checks the digest of `cas/` uploads itself.
+        return '-s --fail -X PUT -T {} -H "Content-Type: application/octet-stream" {}'.format(
+            pipes.quote(filepath), self._args(self._cas_url(hash)))
+
+    def upload_file(self, hash, project_relpath, filepath):
+        self._check_hash_type(hash)
+        util.curl(self._upload_args(hash, filepath))
+
+    def has_file_async(self, hash, project_relpath):
+        if not self._is_supported(hash):
+            return futures.completed(False)
+        url = self._cas_url(hash)
+        return futures.then(
+            util.curl_async(self._head_args(url)), lambda f: _parse_head_code(url, f.result()))
+
+    def download_file_async(self, hash, project_relpath, output_file):
+        if not self._is_supported(hash):
+            return futures.submit(self._check_hash_type, hash)
+        return util.curl_async('-L --fail -s -o {} {}'.format(
+            pipes.quote(output_file), self._args(self._cas_url(hash))))
+
+    def upload_file_async(self, hash, project_relpath, filepath):
+        if not self._is_supported(hash):
+            return futures.submit(self._check_hash_type, hash)
+        def on_upload(f):
+            f.result()
+        return futures.then(util.curl_async(self._upload_args(hash, filepath)), on_upload)
@@ -0,0 +1,207 @@
+import os
+import sys
+
+from external_data_bazel import util, core, chunking, metrics
+from external_data_bazel.core import Backend
+
+
+def _copy(src, dest):
+    if sys.platform.startswith('linux'):
+        # Use a copy-on-write clone if the filesystem supports it (e.g. btrfs, XFS), otherwise copy.
+        util.subshell(['cp', '--reflink=auto', src, dest])
+    else:
+        util.subshell(['cp', src, dest])
+
+
+def _get_tmp_path(tmp_dir, name):
+    # Named as `util.get_publish_tmp_path`, so that stale files from interrupted writes are
+    # recognized (e.g. by `cache verify`).
+    return util.get_publish_tmp_path(os.path.join(tmp_dir, name))
+
+
+def _write_atomic(tmp_dir, dest, write):
+    """ Write a file via `write(f)` to a temporary file, then publish it (read-only) at `dest`. """
+    util.makedirs(os.path.dirname(dest))
+    tmp_file = _get_tmp_path(tmp_dir, os.path.basename(dest))
+    try:
+        with open(tmp_file, 'wb') as f:
+            write(f)
+        util.publish_file(tmp_file, dest)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def _is_child_path(child, parent):
+    return os.path.abspath(child).startswith(os.path.abspath(parent) + os.sep)
+
+
+class CasBackend(Backend):
+    """ Stores files in a content-addressed directory tree, on a local disk or shared mount.
+    Layout: {dir}/{algo}/{hash[0:2]}/{hash[2:4]}/{hash} (the same as the user cache).
+
+    Configuration:
+        dir: Root directory. May be absolute, or relative to the project root.
+        hardlink_cache: (default: true) Hardlink files into the (read-only) user cache if on
+            the same filesystem. Other outputs are always copied (or reflinked), so that editing
+            them cannot corrupt the store.
+        chunked: (default: false) Upload files as content-defined chunks (see `chunking.py`),
+            plus a manifest at {dir}/manifests/{algo}/.../{hash}. Only chunks that the store
+            lacks are uploaded, and only chunks missing from the local chunk cache
+            ({cache_dir}/chunks/) are downloaded, so a revised file only transfers what changed.
+            Whole files (e.g. uploaded without `chunked`) can still be downloaded.
+    """
+    shareable = True
+    can_range = True
+
+    def __init__(self, config, package):
+        Backend.__init__(self, config, package, can_upload=True)
+        self._dir = os.path.join(self.project.root, os.path.expanduser(config['dir']))
+        self._hardlink_cache = config.get('hardlink_cache', True)
+        self._chunked = config.get('chunked', False)
+        self._tmp_dir = os.path.join(self._dir, 'tmp')
+
+    def _get_path(self, hash):
+        return core.get_cas_path(self._dir, hash.get_algo(), hash.get_value())
+
+    def _get_manifest_path(self, hash):
+        return core.get_cas_path(
+            os.path.join(self._dir, 'manifests'), hash.get_algo(), hash.get_value())
+
+    def _get_chunk_path(self, root_dir, value):
+        return core.get_cas_path(os.path.join(root_dir, 'chunks'), chunking.CHUNK_ALGO, value)
+
+    def has_file(self, hash, project_relpath):
+        return (os.path.isfile(self._get_path(hash)) or
+                os.path.isfile(self._get_manifest_path(hash)))
+
+    def download_file(self, hash, project_relpath, output_file):
+        filepath = self._get_path(hash)
+        if not os.path.isfile(filepath):
+            manifest_path = self._get_manifest_path(hash)
+            if os.path.isfile(manifest_path):
+                self._download_chunked(manifest_path, output_file)
+                return
+            raise util.DownloadError("Unknown hash: {}".format(hash))
+        if self._hardlink_cache and _is_child_path(output_file, self.project.user.cache_dir):
+            try:
+                os.link(filepath, output_file)
+                return
+            except OSError:
+                # E.g. on a different filesystem.
+                pass
+        _copy(filepath, output_file)
+
+    def _read_manifest(self, manifest_path):
+        with open(manifest_path) as f:
+            return chunking.Manifest.from_json(f.read())
+
+    def _fetch_chunks(self, chunks):
+        """ Fetch missing chunks into the local chunk cache, checking each. """
+        cache_dir = self.project.user.cache_dir
+        chunk_tmp_dir = os.path.join(cache_dir, 'chunks', 'tmp')
+        util.makedirs(chunk_tmp_dir)
+        for value, size in chunks:
+            cache_path = self._get_chunk_path(cache_dir, value)
+            if os.path.isfile(cache_path):
+                metrics.add("chunks_reused")
+                continue
+            with open(self._get_chunk_path(self._dir, value), 'rb') as f:
+                chunk = f.read()
+            if chunking.hash_chunk(chunk) != value:
+                raise util.DownloadError("Corrupt chunk in store: {}".format(value))
+            _write_atomic(chunk_tmp_dir, cache_path, lambda out: out.write(chunk))
+            metrics.add("chunks_fetched")
+            metrics.add("chunk_bytes_fetched", size)
+
+    def _download_chunked(self, manifest_path, output_file):
+        manifest = self._read_manifest(manifest_path)
+        self._fetch_chunks(manifest.chunks)
+        # Reassemble. The caller checks the hash of the whole file.
+        cache_dir = self.project.user.cache_dir
+        with open(output_file, 'wb') as out:
+            for value, size in manifest.chunks:
+                with open(self._get_chunk_path(cache_dir, value), 'rb') as f:
+                    out.write(f.read())
+
+    def get_size(self, hash, project_relpath):
+        filepath = self._get_path(hash)
+        if os.path.isfile(filepath):
+            return os.path.getsize(filepath)
+        manifest_path = self._get_manifest_path(hash)
+        if os.path.isfile(manifest_path):
+            return self._read_manifest(manifest_path).size
+        return None
+
+    def download_range(self, hash, project_relpath, offset, size):
+        filepath = self._get_path(hash)
+        if os.path.isfile(filepath):
+            with open(filepath, 'rb') as f:
+                f.seek(offset)
+                return f.read(size)
+        manifest_path = self._get_manifest_path(hash)
+        if not os.path.isfile(manifest_path):
+            raise util.DownloadError("Unknown hash: {}".format(hash))
+        # Only fetch the chunks overlapping the range.
+        end = offset + size
+        overlapping = []
+        chunk_start = 0
+        for value, chunk_size in self._read_manifest(manifest_path).chunks:
+            chunk_end = chunk_start + chunk_size
+            if chunk_end > offset and chunk_start < end:
+                overlapping.append((value, chunk_size, chunk_start))
+            chunk_start = chunk_end
+        self._fetch_chunks([(value, chunk_size) for value, chunk_size, _ in overlapping])
+        pieces = []
+        for value, chunk_size, chunk_start in overlapping:
+            with open(self._get_chunk_path(self.project.user.cache_dir, value), 'rb') as f:
+                chunk = f.read()
+            pieces.append(chunk[max(offset - chunk_start, 0):end - chunk_start])
+        return b''.join(pieces)
+
+    def _upload_chunked(self, hash, filepath):
+        chunks = []
+        size = 0
+        with open(filepath, 'rb') as f:
+            for chunk in chunking.iter_chunks(f):
+                value = chunking.hash_chunk(chunk)
+                chunk_path = self._get_chunk_path(self._dir, value)
+                if os.path.isfile(chunk_path):
+                    metrics.add("chunks_reused")
+                else:
+                    _write_atomic(self._tmp_dir, chunk_path, lambda out: out.write(chunk))
+                    metrics.add("chunks_uploaded")
+                    metrics.add("chunk_bytes_uploaded", len(chunk))
+                chunks.append((value, len(chunk)))
+                size += len(chunk)
+        # Check that the file did not change while uploading.
+        hash.check_file(filepath)
+        manifest = chunking.Manifest(size, chunks)
+        # Publish the manifest last, so that `has_file` implies all chunks are present.
+        _write_atomic(self._tmp_dir, self._get_manifest_path(hash),
+                      lambda out: out.write(manifest.to_json().encode('utf-8')))
+
+    def upload_file(self, hash, project_relpath, filepath):
+        util.makedirs(self._tmp_dir)
+        if self._chunked:
+            self._upload_chunked(hash, filepath)
+            return
+        dest = self._get_path(hash)
+        util.makedirs(os.path.dirname(dest))
+        # Publish atomically: copy to a temporary file on the same filesystem, check it, then
+        # rename, so that readers never see a partial file.
+        tmp_file = _get_tmp_path(self._tmp_dir, hash.get_value())
+        try:
+            _copy(filepath, tmp_file)
+            hash.check_file(tmp_file)
+            os.chmod(tmp_file, 0o444)
+            fd = os.open(tmp_file, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            # If this file was published concurrently, this replaces it with identical contents.
+            os.rename(tmp_file, dest)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
@@ -1,7 +1,9 @@
 import json
 import os
+import re
+import tempfile
 
-from external_data_bazel import util
+from external_data_bazel import util, futures
 from external_data_bazel.core import Backend
 
 
@@ -13,7 +15,10 @@ def _check_hash(url, hash_expected):
         tmp_path = tmp_file.get_path()
         util.subshell('curl -s -o {} {}'.format(tmp_path, url))
         hash = hash_expected.compute(tmp_path)
-        good = (hash_expected == hash)
+    return _compare_hash(url, hash_expected, hash)
+
+def _compare_hash(url, hash_expected, hash):
+    good = (hash_expected == hash)
     if not good:
         util.eprint("WARNING: Hash mismatch for url: {}".format(url))
         util.eprint("  expected:\n    {}".format(hash_expected))
@@ -27,7 +32,7 @@ def _has_file(url, hash, trusted=False):
     else:
         # Just check header.
         first_line = util.subshell('curl -s --head {url} | head -n 1'.format(url=url))
-        code = int(re.match(r"^HTTP/1\.1 (\d+) .*$", first_line).group(1))
+        code = int(re.match(r"^HTTP/[\d.]+ (\d+).*$", first_line).group(1))
         if code >= 400:
             return False
         elif code >= 200:
@@ -37,7 +42,85 @@ def _has_file(url, hash, trusted=False):
 
 
 def _download_file(url, output_file):
-    util.curl('-L -o {output_file} {url}'.format(url=url, output_file=output_file))
+    # Use `--fail` so that HTTP errors (e.g. 404) are raised as `DownloadError`s.
+    util.curl('-L --fail -o {output_file} {url}'.format(url=url, output_file=output_file))
+
+
+def _download_stream(url, write):
+    """ Stream from `url`, with `write` only receiving data from a single response.
+    @returns Number of bytes written. """
+    written = [0]
+    def write_counted(data):
+        written[0] += len(data)
+        write(data)
+    try:
+        util.curl_stream(url, write_counted)
+    except util.DownloadError as e:
+        # Annotate with whether anything was written, so callers know if they may retry.
+        e.bytes_written = written[0]
+        raise
+    return written[0]
+
+
+def _get_size(url):
+    # Only use servers that advertise range support; others would send the whole file.
+    code, headers = util.curl_head(url)
+    if code != 200 or headers.get('accept-ranges') != 'bytes' or 'content-length' not in headers:
+        return None
+    return int(headers['content-length'])
+
+
+def _download_range(url, offset, size):
+    data = []
+    code = util.curl_stream('-r {}-{} {}'.format(offset, offset + size - 1, url), data.append)
+    if code != 206:
+        raise util.DownloadError("Range request not supported (HTTP {}): {}".format(code, url))
+    return b''.join(data)
+
+
+def _parse_http_code(output):
+    code = int(output)
+    if code >= 400:
+        return False
+    elif code >= 200:
+        return True
+    else:
+        raise RuntimeError("Unknown response code: {}".format(code))
+
+
+def _has_file_async(url, hash, trusted=False):
+    if not trusted:
+        # Download the full file, and check the hash (off of the completing thread).
+        fd, tmp_path = tempfile.mkstemp()
+        os.close(fd)
+        def on_download(f):
+            f.result()
+            return futures.submit(hash.compute, tmp_path)
+        def on_hash(f):
+            os.remove(tmp_path)
+            return _compare_hash(url, hash, f.result())
+        downloaded = util.curl_async('-s -o {} {}'.format(tmp_path, url))
+        return futures.then(futures.then(downloaded, on_download), on_hash)
+    else:
+        # Just check header.
+        code = util.curl_async('-s --head -o /dev/null --write-out "%{{http_code}}" {url}'.format(url=url))
+        return futures.then(code, lambda f: _parse_http_code(f.result()))
+
+
+def _download_file_async(url, output_file):
+    return util.curl_async('-L --fail -s -o {output_file} {url}'.format(url=url, output_file=output_file))
+
+
+def _first_async(items, func, error):
+    """ Try `func(item)` (returning a Future) for each item in turn, until one succeeds.
+    @returns Future of the first successful result; raises `error` if none succeed. """
+    if not items:
+        return futures.failed(error)
+    def on_done(f):
+        if f.exception() is None:
+            return f.result()
+        return _first_async(items[1:], func, error)
+    return futures.then(func(items[0]), on_done)
 
 
 def _parse_trusted(config):
@@ -51,6 +134,10 @@ def _parse_trusted(config):
 
 class UrlBackend(Backend):
     """ For direct URLs. """
+    shareable = True
+    can_stream = True
+    can_range = True
+
     def __init__(self, config, package):
         Backend.__init__(self, config, package, can_upload=False)
         self._url = config['url']
@@ -63,16 +150,42 @@ class UrlBackend(Backend):
         # Ignore the SHA. Just download. Everything else will validate.
         _download_file(self._url, output_file)
 
+    def download_stream(self, hash, project_relpath, write):
+        _download_stream(self._url, write)
+
+    def get_size(self, hash, project_relpath):
+        return _get_size(self._url)
+
+    def download_range(self, hash, project_relpath, offset, size):
+        return _download_range(self._url, offset, size)
+
+    def has_file_async(self, hash, project_relpath):
+        return _has_file_async(self._url, hash, self._trusted)
+
+    def download_file_async(self, hash, project_relpath, output_file):
+        return _download_file_async(self._url, output_file)
+
 
 class UrlTemplatesBackend(Backend):
     """ For formatted or direct URL downloads.
     This supports CMake/ExternalData-like URL templates, but using Python formatting '{algo}' and '{hash}'
     rather than '%(algo)' and '%(hash)'.
     """
+    shareable = True
+    can_stream = True
+    can_range = True
+
     def __init__(self, config, package):
         Backend.__init__(self, config, package, can_upload=False)
         self._urls = config['url_templates']
         self._trusted = _parse_trusted(config)
+        # Hash value -> URL which reported the size, for subsequent range requests.
+        self._range_urls = {}
+
+    def get_host(self):
+        # URLs are tried in order, so most transfers go to the first.
+        from urlparse import urlparse
+        return urlparse(self._urls[0]).netloc or None
 
     def _format(self, url, hash):
         return url.format(hash=hash.get_value(), algo=hash.get_algo())
@@ -86,9 +199,52 @@ class UrlTemplatesBackend(Backend):
     def download_file(self, hash, project_relpath, output_file):
         for url in self._urls:
             try:
-                _download_file(self._format(url, hash))
+                _download_file(self._format(url, hash), output_file)
                 return
             except util.DownloadError:
                 pass
-        algo = 'sha512'
-        raise util.DownloadError("Could not download {}:{} from:\n{}".format(algo, hash, "\n".join(self._urls)))
+        raise self._download_error(hash)
+
+    def download_stream(self, hash, project_relpath, write):
+        for url in self._urls:
+            try:
+                _download_stream(self._format(url, hash), write)
+                return
+            except util.DownloadError as e:
+                if e.bytes_written > 0:
+                    # Cannot fall back to another URL once data has been passed on.
+                    raise
+        raise self._download_error(hash)
+
+    def get_size(self, hash, project_relpath):
+        for url in self._urls:
+            url = self._format(url, hash)
+            size = _get_size(url)
+            if size is not None:
+                self._range_urls[hash.get_value()] = url
+                return size
+        return None
+
+    def download_range(self, hash, project_relpath, offset, size):
+        url = self._range_urls.get(hash.get_value())
+        if url is None:
+            raise util.DownloadError("No URL with range support for {}".format(hash))
+        return _download_range(url, offset, size)
+
+    def _download_error(self, hash):
+        return util.DownloadError("Could not download {} from:\n{}".format(hash, "\n".join(self._urls)))
+
+    def has_file_async(self, hash, project_relpath):
+        def has_file(url):
+            def check(f):
+                if not f.result():
+                    raise util.DownloadError("Not found: {}".format(url))
+                return True
+            return futures.then(_has_file_async(self._format(url, hash), hash, self._trusted), check)
+        found = _first_async(self._urls, has_file, util.DownloadError("Not found"))
+        return futures.then(found, lambda f: f.exception() is None)
+
+    def download_file_async(self, hash, project_relpath, output_file):
+        return _first_async(
+            self._urls, lambda url: _download_file_async(self._format(url, hash), output_file),
+            self._download_error(hash))
@@ -1,10 +1,13 @@
+import hashlib
 import json
 import os
-import re
+import threading
+import time
+import uuid
 import yaml
 from datetime import datetime
 
-from external_data_bazel import util, hashes
+from external_data_bazel import util, hashes, profiling, futures
 from external_data_bazel.core import Backend
 
 # TODO(eric.cousineau): Split this into a common base backend.
@@ -17,6 +20,10 @@ from external_data_bazel.core import Backend
 # to allow specific configuruation to be specified.
 # Possibly permit still leveraging the original URL authentication?
 
+# Maximum age of an authentication token cached in the user's cache directory, in seconds.
+# (A rejected token is also discarded, so this only needs to be shorter than Girder's lifetime.)
+TOKEN_MAX_AGE = 12 * 60 * 60
+
 
 def action(api_url, endpoint_in, query = None, token = None, args = [], method = "GET"):
     """ Lightweight REST call """
@@ -40,6 +47,20 @@ def action(api_url, endpoint_in, query = None, token = None, args = [], method =
     return json.loads(response)
 
 
+def _parse_http_code(code):
+    if code >= 400:
+        return False
+    elif code >= 200:
+        return True
+    else:
+        raise RuntimeError("Unknown response code: {}".format(code))
+
+
+def _remove_if_exists(filepath):
+    if os.path.exists(filepath):
+        os.remove(filepath)
+
+
 def format_qs(url, query):
     from urllib import urlencode
     if query:
@@ -56,6 +77,12 @@ def format_qs(url, query):
 
 class GirderHashsumBackend(Backend):
     """ Supports Girder servers where authentication may be needed (e.g. for uploading, possibly downloading). """
+    shareable = True
+    can_stream = True
+    can_range = True
+    # The hashsum plugin only indexes files by hashes that Girder computes itself.
+    hash_type = hashes.sha512
+
     def __init__(self, config, package):
         # Until there is a Girder plugin that can discriminate based on folder_id,
         # have configuration disable uploading on "master".
@@ -69,7 +96,11 @@ class GirderHashsumBackend(Backend):
         url_config_node = util.get_chain(self.project.user.config, ['girder', 'url', self._url])
         self._api_key = util.get_chain(url_config_node, ['api_key'])
         self._token = None
+        self._token_from_cache = False
+        self._auth_lock = threading.Lock()
         self._girder_client = None
+        # Shared by all remotes using this backend (see `Project.load_backend`).
+        self._folder_id = None
         # Cache configuration.
         self._config_cache_file = os.path.join(self.project.user.cache_dir, 'config', 'girder.yml')
 
@@ -87,10 +118,16 @@ class GirderHashsumBackend(Backend):
         tgt_dir = os.path.dirname(self._config_cache_file)
         if not os.path.isdir(tgt_dir):
             os.makedirs(tgt_dir)
-        with open(self._config_cache_file, 'w') as f:
+        # Write atomically (other processes may be reading), and keep private since it may
+        # contain tokens.
+        tmp_file = "{}.{}".format(self._config_cache_file, uuid.uuid4().hex)
+        with os.fdopen(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as f:
             yaml.dump(config_cache, f, default_flow_style=False)
+        os.rename(tmp_file, self._config_cache_file)
 
     def _get_folder_id(self):
+        if self._folder_id is not None:
+            return self._folder_id
         config_cache = self._read_config_cache()
         key_chain = ['url', self._url, 'folder_ids', self._folder_path]
         folder_id = util.get_chain(config_cache, key_chain)
@@ -103,12 +140,53 @@ class GirderHashsumBackend(Backend):
             folder_id = str(response["_id"])
             util.set_chain(config_cache, key_chain, folder_id)
             self._write_config_cache(config_cache)
+        self._folder_id = folder_id
         return folder_id
 
-    def _authenticate_if_needed(self):
-        if self._api_key is not None and self._token is None:
-            response = self._action("/api_key/token", method = "POST", query = {"key": self._api_key})
-            self._token = response["authToken"]["token"]
+    def _get_token_key_chain(self):
+        key_id = hashlib.sha1(self._api_key).hexdigest()[:16]
+        return ['url', self._url, 'tokens', key_id]
+
+    def _authenticate_if_needed(self, force=False):
+        """ Get a token, if an API key is configured.
+        Tokens are cached in the user's cache directory, so that each invocation (e.g. per file
+        in Bazel) does not need to authenticate.
+        @param force
+            Discard the current token (e.g. if it was rejected). """
+        if self._api_key is None:
+            return
+        with self._auth_lock:
+            if self._token is not None and not force:
+                return
+            key_chain = self._get_token_key_chain()
+            if not force:
+                cached = util.get_chain(self._read_config_cache(), key_chain)
+                if cached is not None and time.time() - cached['time'] < TOKEN_MAX_AGE:
+                    self._token = cached['token']
+                    self._token_from_cache = True
+                    return
+            self._token = None
+            with profiling.span("girder.authenticate", url=self._url):
+                response = self._action("/api_key/token", method = "POST", query = {"key": self._api_key})
+            self._token = str(response["authToken"]["token"])
+            self._token_from_cache = False
+            config_cache = self._read_config_cache()
+            util.set_chain(config_cache, key_chain, {'token': self._token, 'time': time.time()})
+            self._write_config_cache(config_cache)
+
+    def _should_retry(self, code, token):
+        """ Returns true if a request made with `token` should be retried with a new token. """
+        if code not in [401, 403] or token is None:
+            return False
+        with self._auth_lock:
+            if self._token != token:
+                # Already refreshed (e.g. by a concurrent request).
+                return True
+            from_cache = self._token_from_cache
+        if from_cache:
+            self._authenticate_if_needed(force=True)
+            return True
+        return False
 
     def _download_url(self, hash):
         return "{api_url}/file/hashsum/{algo}/{hash}/download".format(algo=hash.get_algo(), hash=hash.get_value(), api_url=self._api_url)
@@ -122,29 +200,125 @@ class GirderHashsumBackend(Backend):
             args = url
         return args
 
+    def _head_cmd(self, hash):
+        """ @returns (curl arguments, token used) """
+        args = self._download_args(hash)
+        return ('-s --head -o /dev/null --write-out "%{{http_code}}" {args}'.format(args=args),
+                self._token)
+
+    def _get_cmd(self, hash, output_file, progress=True):
+        """ @returns (curl arguments, token used) """
+        # Use a single GET (no HEAD beforehand); the status code determines whether the
+        # file is available, so that a 404 or 403 falls back to the overlay directly.
+        args = self._download_args(hash)
+        return ('-L {progress} -o {output_file} --write-out "%{{http_code}}" {args}'.format(
+                    progress="--progress-bar" if progress else "-s", output_file=output_file,
+                    args=args),
+                self._token)
+
+    def _check_get_code(self, code, hash, project_relpath, output_file):
+        if code >= 400:
+            # Remove the error response.
+            _remove_if_exists(output_file)
+            raise util.DownloadError("File not available on Girder server: {} (hash: {}, HTTP {})".format(project_relpath, hash, code))
+
     def has_file(self, hash, project_relpath):
         """ Returns true if the given hash exists on the given server. """
-        # TODO(eric.cousineau): Is there a quicker way to do this???
         # TODO(eric.cousineau): Check `folder_id` and ensure it lives in the same place?
         # This is necessary if we have users with the same file?
         # What about authentication? Optional authentication / public access?
-        args = self._download_args(hash)
-        first_line = util.subshell('curl -s --head {args} | head -n 1'.format(args=args))
-        code = int(re.match(r"^HTTP/1\.1 (\d+) .*$", first_line).group(1))
-        if code >= 400:
+        if not self._is_supported(hash):
             return False
-        elif code >= 200:
-            return True
-        else:
-            raise RuntimeError("Unknown response: {}".format(first_line))
+        cmd, token = self._head_cmd(hash)
+        code = int(util.curl(cmd))
+        if self._should_retry(code, token):
+            cmd, _ = self._head_cmd(hash)
+            code = int(util.curl(cmd))
+        return _parse_http_code(code)
 
     def download_file(self, hash, project_relpath, output_file):
-        args = self._download_args(hash)
-        # Unfortunately, not having authentication does not yield user-friendly errors.
-        # Should fix this later.
-        if not self.has_file(hash, project_relpath):
-            raise util.DownloadError("File not available on Girder server: {} (hash: {})".format(project_relpath, hash))
-        util.curl("-L --progress-bar -o {output_file} {args}".format(args=args, output_file=output_file))
+        self._check_hash_type(hash)
+        cmd, token = self._get_cmd(hash, output_file)
+        code = int(util.curl(cmd))
+        if self._should_retry(code, token):
+            _remove_if_exists(output_file)
+            cmd, _ = self._get_cmd(hash, output_file)
+            code = int(util.curl(cmd))
+        self._check_get_code(code, hash, project_relpath, output_file)
+
+    def download_stream(self, hash, project_relpath, write):
+        self._check_hash_type(hash)
+        for retry in [True, False]:
+            args = self._download_args(hash)
+            token = self._token
+            try:
+                util.curl_stream(args, write)
+                return
+            except util.HttpError as e:
+                # Nothing has been written for an HTTP error.
+                if retry and self._should_retry(e.code, token):
+                    continue
+                raise util.DownloadError("File not available on Girder server: {} (hash: {}, HTTP {})".format(project_relpath, hash, e.code))
+
+    def get_size(self, hash, project_relpath):
+        if not self._is_supported(hash):
+            return None
+        for retry in [True, False]:
+            args = self._download_args(hash)
+            token = self._token
+            code, headers = util.curl_head(args)
+            if retry and self._should_retry(code, token):
+                continue
+            break
+        if code != 200 or headers.get('accept-ranges') != 'bytes' or 'content-length' not in headers:
+            return None
+        return int(headers['content-length'])
+
+    def download_range(self, hash, project_relpath, offset, size):
+        self._check_hash_type(hash)
+        for retry in [True, False]:
+            args = self._download_args(hash)
+            token = self._token
+            data = []
+            try:
+                code = util.curl_stream('-r {}-{} {}'.format(offset, offset + size - 1, args), data.append)
+            except util.HttpError as e:
+                if retry and self._should_retry(e.code, token):
+                    continue
+                raise util.DownloadError("File not available on Girder server: {} (hash: {}, HTTP {})".format(project_relpath, hash, e.code))
+            if code != 206:
+                raise util.DownloadError("Range request not supported by Girder server (HTTP {})".format(code))
+            return b''.join(data)
+
+    def has_file_async(self, hash, project_relpath):
+        if not self._is_supported(hash):
+            return futures.completed(False)
+        # @note Authentication (if needed) happens synchronously, once.
+        def head(retry):
+            cmd, token = self._head_cmd(hash)
+            def on_done(f):
+                code = int(f.result())
+                if retry and self._should_retry(code, token):
+                    return head(retry=False)
+                return _parse_http_code(code)
+            return futures.then(util.curl_async(cmd), on_done)
+        return head(retry=True)
+
+    def download_file_async(self, hash, project_relpath, output_file):
+        try:
+            self._check_hash_type(hash)
+        except util.DownloadError as e:
+            return futures.failed(e)
+        def get(retry):
+            cmd, token = self._get_cmd(hash, output_file, progress=False)
+            def on_done(f):
+                code = int(f.result())
+                if retry and self._should_retry(code, token):
+                    _remove_if_exists(output_file)
+                    return get(retry=False)
+                self._check_get_code(code, hash, project_relpath, output_file)
+            return futures.then(util.curl_async(cmd), on_done)
+        return get(retry=True)
 
     def _get_girder_client(self):
         # @note We import girder_client here, as only uploading requires it at present.
@@ -157,6 +331,7 @@ class GirderHashsumBackend(Backend):
         return self._girder_client
 
     def upload_file(self, hash, project_relpath, filepath):
+        self._check_hash_type(hash)
         item_name = "%s %s" % (os.path.basename(filepath), datetime.utcnow().isoformat())
         folder_id = self._get_folder_id()
 
@@ -0,0 +1,220 @@
+import json
+import os
+import pipes
+import threading
+
+from external_data_bazel import util, hashes, futures
+from external_data_bazel.core import Backend
+
+# Git LFS servers, via the batch API:
+# https://github.com/git-lfs/git-lfs/blob/main/docs/api/batch.md
+#
+# Object ids are SHA-256 digests, so files must use `sha256` hash files.
+# Concurrent queries, downloads and uploads (e.g. from `check`, `download --jobs`, or `prefetch`)
+# are coalesced into batch requests of up to `batch_size` objects, which return direct transfer
+# URLs; transfers then go straight to those URLs.
+
+MEDIA_TYPE = 'application/vnd.git-lfs+json'
+# Time to wait for more requests before sending a partial batch, in seconds.
+BATCH_DELAY = 0.01
+BATCH_SIZE_DEFAULT = 100
+
+
+def _oid(hash):
+    return hash.get_value()
+
+
+def _shell_args(args):
+    return " ".join(pipes.quote(arg) for arg in args)
+
+
+class _Batcher(object):
+    """ Coalesces concurrent requests for objects into batch requests. """
+    def __init__(self, func, batch_size, delay=BATCH_DELAY):
+        """
+        @param func
+            `func(objects)` returns a dictionary of object id to response object, for a list of
+            request objects (each with `oid` and `size`).
+        """
+        self._func = func
+        self._batch_size = batch_size
+        self._delay = delay
+        self._lock = threading.Lock()
+        self._pending = []
+
+    def submit(self, obj):
+        """ @returns Future of the response object for `obj`. """
+        future = futures.Future()
+        batch = None
+        with self._lock:
+            self._pending.append((obj, future))
+            if len(self._pending) >= self._batch_size:
+                batch = self._pending
+                self._pending = []
+            elif len(self._pending) == 1:
+                # Wait briefly for more requests (without holding a worker thread).
+                timer = threading.Timer(self._delay, self._flush)
+                timer.daemon = True
+                timer.start()
+        if batch:
+            # Not on the shared thread pool, whose workers may be blocked on these results.
+            thread = threading.Thread(target=self._run, args=(batch,))
+            thread.daemon = True
+            thread.start()
+        return future
+
+    def _flush(self):
+        with self._lock:
+            batch = self._pending
+            self._pending = []
+        if batch:
+            self._run(batch)
+
+    def _run(self, batch):
+        # Skip requests which were cancelled while pending.
+        batch = [(obj, future) for obj, future in batch if not future.done()]
+        if not batch:
+            return
+        try:
+            responses = self._func([obj for obj, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for obj, future in batch:
+            response = responses.get(obj['oid'])
+            if response is None:
+                future.set_exception(util.DownloadError(
+                    "Git LFS server did not return object: {}".format(obj['oid'])))
+            else:
+                future.set_result(response)
+
+
+class GitLfsBackend(Backend):
+    """ Git LFS server (e.g. the LFS endpoint of a hosted repository). """
+    shareable = True
+    can_stream = True
+    hash_type = hashes.sha256
+
+    def __init__(self, config, package):
+        Backend.__init__(self, config, package, can_upload=not config.get('disable_upload', False))
+        # LFS endpoint, e.g. "https://git.example.com/org/repo.git/info/lfs".
+        self._url = config['url'].rstrip('/')
+        self._ref = config.get('ref')
+        batch_size = config.get('batch_size', BATCH_SIZE_DEFAULT)
+        # Headers (e.g. for authentication) for batch requests.
+        url_config_node = util.get_chain(self.project.user.config, ['git_lfs', 'url', self._url])
+        self._headers = dict(util.get_chain(url_config_node, ['headers'], {}) or {})
+        self._download_batcher = _Batcher(
+            lambda objects: self._batch('download', objects), batch_size)
+        self._upload_batcher = _Batcher(
+            lambda objects: self._batch('upload', objects), batch_size)
+
+    def _batch(self, operation, objects):
+        """ Sends a batch request.
+        @returns Dictionary of object id to response object. """
+        request = {
+            "operation": operation,
+            "transfers": ["basic"],
+            "objects": objects,
+            "hash_algo": "sha256",
+        }
+        if self._ref is not None:
+            request["ref"] = {"name": self._ref}
+        headers = dict(self._headers)
+        headers.update({"Accept": MEDIA_TYPE, "Content-Type": MEDIA_TYPE})
+        cmd = (["curl", "-s", "-X", "POST", "--data-binary", "@-", "--write-out", "\n%{http_code}"] +
+               util.header_args(headers) + ["{}/objects/batch".format(self._url)])
+        returncode, output, _ = util.runc(cmd, json.dumps(request))
+        if returncode != 0:
+            raise util.DownloadError("Git LFS batch request failed ({}): {}".format(returncode, self._url))
+        lines = output.splitlines()
+        body = "\n".join(lines[:-1])
+        code = int(lines[-1])
+        if code >= 400:
+            raise util.DownloadError("Git LFS batch request failed (HTTP {}): {}\n  {}".format(code, self._url, body))
+        response = json.loads(body)
+        if response.get("transfer", "basic") != "basic":
+            raise util.DownloadError("Unsupported Git LFS transfer: {}".format(response["transfer"]))
+        return dict((obj["oid"], obj) for obj in response.get("objects", []))
+
+    def _request(self, hash, size=0):
+        # @note The size of a file is not known before downloading it; servers which check it
+        # against the stored object on download are not supported.
+        return {"oid": _oid(hash), "size": size}
+
+    def _parse_has_file(self, obj):
+        if "download" in obj.get("actions", {}):
+            return True
+        error = obj.get("error")
+        if error is not None and error.get("code") != 404:
+            raise util.DownloadError("Git LFS error for {}: {}".format(obj["oid"], error))
+        return False
+
+    def _get_download_action(self, obj, project_relpath):
+        action = obj.get("actions", {}).get("download")
+        if action is None:
+            raise util.DownloadError("File not available on Git LFS server: {} (oid: {}, {})".format(
+                project_relpath, obj["oid"], obj.get("error")))
+        return action
+
+    def _action_args(self, action):
+        return util.header_args(action.get("header", {})) + [action["href"]]
+
+    def has_file(self, hash, project_relpath):
+        return self.has_file_async(hash, project_relpath).result()
+
+    def has_file_async(self, hash, project_relpath):
+        if not self._is_supported(hash):
+            return futures.completed(False)
+        return futures.then(self._download_batcher.submit(self._request(hash)),
+                            lambda f: self._parse_has_file(f.result()))
+
+    def download_file(self, hash, project_relpath, output_file):
+        with open(output_file, 'wb') as f:
+            self.download_stream(hash, project_relpath, f.write)
+
+    def download_stream(self, hash, project_relpath, write):
+        self._check_hash_type(hash)
+        obj = self._download_batcher.submit(self._request(hash)).result()
+        action = self._get_download_action(obj, project_relpath)
+        util.curl_stream(_shell_args(self._action_args(action)), write)
+
+    def download_file_async(self, hash, project_relpath, output_file):
+        if not self._is_supported(hash):
+            return futures.submit(self._check_hash_type, hash)
+        def on_planned(f):
+            action = self._get_download_action(f.result(), project_relpath)
+            return util.curl_async('-L --fail -s -o {} {}'.format(
+                pipes.quote(output_file), _shell_args(self._action_args(action))))
+        return futures.then(self._download_batcher.submit(self._request(hash)), on_planned)
+
+    def _transfer_upload(self, obj, filepath):
+        # Blocking; `obj` is the response object from an upload batch request.
+        actions = obj.get("actions", {})
+        if "upload" not in actions:
+            if obj.get("error") is not None:
+                raise RuntimeError("Git LFS upload rejected for {}: {}".format(obj["oid"], obj["error"]))
+            # Already present on the server.
+            return
+        util.curl('-s --fail -X PUT -T {} -H "Content-Type: application/octet-stream" {}'.format(
+            pipes.quote(filepath), _shell_args(self._action_args(actions["upload"]))))
+        verify = actions.get("verify")
+        if verify is not None:
+            headers = dict(verify.get("header", {}))
+            headers.update({"Accept": MEDIA_TYPE, "Content-Type": MEDIA_TYPE})
+            data = json.dumps({"oid": obj["oid"], "size": os.path.getsize(filepath)})
+            util.curl('-s --fail -X POST -d {} {}'.format(
+                pipes.quote(data), _shell_args(util.header_args(headers) + [verify["href"]])))
+
+    def upload_file(self, hash, project_relpath, filepath):
+        self._check_hash_type(hash)
+        request = self._request(hash, os.path.getsize(filepath))
+        self._transfer_upload(self._upload_batcher.submit(request).result(), filepath)
+
+    def upload_file_async(self, hash, project_relpath, filepath):
+        if not self._is_supported(hash):
+            return futures.submit(self._check_hash_type, hash)
+        request = self._request(hash, os.path.getsize(filepath))
+        return futures.then(self._upload_batcher.submit(request),
+                            lambda f: futures.submit(self._transfer_upload, f.result(), filepath))
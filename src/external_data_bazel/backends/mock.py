@@ -6,43 +6,74 @@ from external_data_bazel.core import Backend
 
 class MockBackend(Backend):
     """ A mock backend for testing. """
+    shareable = True
+    can_stream = True
+    can_range = True
+
     def __init__(self, config, package):
         Backend.__init__(self, config, package, can_upload=True)
         self._dir = os.path.join(self.project.root, config['dir'])
         # TODO(eric.cousineau): Enable ${PWD} for testing?
         self._upload_dir = os.path.join(self.project.root, config['upload_dir'])
-        self._hash_type = hashes.sha512
 
-        # Crawl through files and compute hashes.
-        self._map = {}
+        # Hashes are computed on demand for each hash type, as files are crawled.
+        self._files = []
         def crawl(cur_dir):
             for file in os.listdir(cur_dir):
                 filepath = os.path.join(cur_dir, file)
                 if os.path.isfile(filepath):
-                    hash = self._hash_type.compute(filepath)
-                    self._map[hash] = filepath
+                    self._files.append(filepath)
         crawl(self._dir)
         if os.path.exists(self._upload_dir):
             crawl(self._upload_dir)
+        self._maps = {}
 
-    def _check_hash_type(self, hash):
-        if hash.hash_type != self._hash_type:
-            raise RuntimeError("Mock backend only supports {}, not {}".format(self._hash_type, hash.hash_type))
+    def _get_map(self, hash_type):
+        hash_map = self._maps.get(hash_type.name)
+        if hash_map is None:
+            hash_map = {}
+            for filepath in self._files:
+                hash_map[hash_type.compute(filepath)] = filepath
+            self._maps[hash_type.name] = hash_map
+        return hash_map
 
     def has_file(self, hash, project_relpath):
-        self._check_hash_type(hash)
-        return hash in self._map
+        return hash in self._get_map(hash.hash_type)
 
     def download_file(self, hash, project_relpath, output_file):
-        self._check_hash_type(hash)
-        filepath = self._map.get(hash)
+        filepath = self._get_map(hash.hash_type).get(hash)
         if filepath is None:
             raise util.DownloadError("Unknown hash: {}".format(hash))
         util.subshell(['cp', filepath, output_file])
 
+    def download_stream(self, hash, project_relpath, write):
+        filepath = self._get_map(hash.hash_type).get(hash)
+        if filepath is None:
+            raise util.DownloadError("Unknown hash: {}".format(hash))
+        with open(filepath, 'rb') as f:
+            while True:
+                data = f.read(util.STREAM_CHUNK_SIZE)
+                if not data:
+                    break
+                write(data)
+
+    def get_size(self, hash, project_relpath):
+        filepath = self._get_map(hash.hash_type).get(hash)
+        if filepath is None:
+            return None
+        return os.path.getsize(filepath)
+
+    def download_range(self, hash, project_relpath, offset, size):
+        filepath = self._get_map(hash.hash_type).get(hash)
+        if filepath is None:
+            raise util.DownloadError("Unknown hash: {}".format(hash))
+        with open(filepath, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
     def upload_file(self, hash, project_relpath, filepath):
-        self._check_hash_type(hash)
-        assert hash not in self._map
+        hash_map = self._get_map(hash.hash_type)
+        assert hash not in hash_map
         dest = os.path.join(self._upload_dir, hash.get_value())
         assert not os.path.exists(dest)
         dest_dir = os.path.dirname(dest)
@@ -50,5 +81,7 @@ class MockBackend(Backend):
             os.makedirs(dest_dir)
         # Copy the file.
         util.subshell(['cp', filepath, dest])
-        # Store the SHA.
-        self._map[hash] = dest
+        # Store the hash, and invalidate maps for other hash types.
+        self._files.append(dest)
+        self._maps = {hash.hash_type.name: hash_map}
+        hash_map[hash] = dest
@@ -0,0 +1,85 @@
+import os
+import stat
+import uuid
+
+from external_data_bazel import util
+
+# Bazel's own content-addressed (SHA-256) caches, so that files which also pass through Bazel need
+# not be fetched again:
+# * Repository cache (`--repository_cache`): {dir}/content_addressable/sha256/{hash}/file
+# * Disk cache (`--disk_cache`): {dir}/cas/{hash[0:2]}/{hash} (or {dir}/cas/{hash} for older
+#   versions of Bazel)
+# Files are found by a SHA-256 digest: that of `sha256` hash files, or the secondary digest of
+# other hash files (see `hashes.Hash.secondary`). Bazel verifies neither cache on read, so files are
+# always checked against their primary hash before use.
+
+
+def get_repository_cache_path(root_dir, value):
+    return os.path.join(root_dir, 'content_addressable', 'sha256', value, 'file')
+
+
+def get_disk_cache_paths(root_dir, value):
+    """ @returns Candidate paths, with the current layout first. """
+    return [
+        os.path.join(root_dir, 'cas', value[0:2], value),
+        os.path.join(root_dir, 'cas', value),
+    ]
+
+
+def _is_read_only(filepath):
+    return not (os.stat(filepath).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def link_or_copy(src, dest):
+    """ Hardlink `src` to `dest` if it is read-only and on the same filesystem (so that it cannot be
+    modified through `dest`, nor made read-only by publishing `dest`), or copy it otherwise. """
+    if _is_read_only(src):
+        try:
+            os.link(src, dest)
+            return
+        except OSError:
+            # E.g. on a different filesystem.
+            pass
+    util.subshell(['cp', src, dest])
+
+
+class BazelCaches(object):
+    """ Configured Bazel cache directories (see `USER_CONFIG_DEFAULT`). """
+    def __init__(self, repository_caches, disk_caches):
+        self.repository_caches = [os.path.expanduser(path) for path in repository_caches or []]
+        self.disk_caches = [os.path.expanduser(path) for path in disk_caches or []]
+
+    def is_empty(self):
+        return not self.repository_caches and not self.disk_caches
+
+    def find(self, value):
+        """ @returns The path of a file with SHA-256 `value` in any configured cache, or None. """
+        candidates = [get_repository_cache_path(root_dir, value) for root_dir in self.repository_caches]
+        for root_dir in self.disk_caches:
+            candidates += get_disk_cache_paths(root_dir, value)
+        for path in candidates:
+            if os.path.isfile(path):
+                return path
+        return None
+
+
+def publish(src, dest, write=None):
+    """ Atomically place a file at `dest` (if not already present), from the file `src` (see
+    `link_or_copy`), or by `write(f)` if `src` is None.
+    @returns True if the file was published. """
+    if os.path.exists(dest):
+        return False
+    util.makedirs(os.path.dirname(dest))
+    tmp_file = "{}.tmp.{}".format(dest, uuid.uuid4().hex)
+    try:
+        if src is not None:
+            link_or_copy(src, tmp_file)
+        else:
+            with open(tmp_file, 'wb') as f:
+                write(f)
+            os.chmod(tmp_file, 0o444)
+        os.rename(tmp_file, dest)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return True
@@ -0,0 +1,268 @@
+"""
+Maintains the user cache.
+
+`verify` re-hashes every cache entry (including packed files and the chunk cache), so that corruption is found ahead
+of time rather than when a build happens to re-check an entry. Mismatching entries are moved to
+`{cache_dir}/quarantine/` (keeping their layout), and may be re-fetched for the hash files under
+a set of paths with `--refetch`.
+
+`export` publishes every cache entry (including packed files) into Bazel's repository cache and
+disk cache layouts, so that Bazel finds files which it would otherwise download.
+"""
+
+from __future__ import absolute_import, print_function
+
+import errno
+import hashlib
+import multiprocessing
+import os
+import re
+import time
+import uuid
+
+from external_data_bazel import core, hashes, chunking, metrics, util, bazel_caches
+
+QUARANTINE_RELPATH = 'quarantine'
+# Temporary downloads (see `util.get_publish_tmp_path`) older than this are from interrupted
+# processes, and are removed.
+STALE_TMP_AGE = 24 * 60 * 60
+
+_VALUE_REGEX = re.compile(r"^[0-9a-f]+$")
+_READ_SIZE = 1024 * 1024
+
+
+def add_arguments(parser):
+    parser.add_argument('action', choices=['verify', 'export'])
+    parser.add_argument('--limit_rate', type=str, default=None,
+                        help='Total read bandwidth cap (e.g. 20M), shared across --jobs, so that verification can run in the background.')
+    parser.add_argument('--refetch', type=str, nargs='*', default=None, metavar='PATH',
+                        help='Re-download quarantined entries referenced by hash files under these files or directories (defaults to the current directory).')
+    parser.add_argument('--repository_cache', type=str, action='append', default=None, metavar='DIR',
+                        help="For `export`: Bazel `--repository_cache` directory to publish to (may be repeated). Defaults to `bazel_caches` in the user config.")
+    parser.add_argument('--disk_cache', type=str, action='append', default=None, metavar='DIR',
+                        help="For `export`: Bazel `--disk_cache` directory to publish to (may be repeated). Defaults to `bazel_caches` in the user config.")
+
+
+def needs_project(args):
+    return args.refetch is not None
+
+
+def _iter_entries(cache_dir):
+    """ @returns Generator of (filepath, hash type, value) for each content-addressed file. """
+    roots = [(cache_dir, hash_type) for hash_type in hashes.hash_types]
+    # Chunks are content-addressed by `chunking.CHUNK_ALGO` (plain sha512).
+    assert chunking.CHUNK_ALGO == hashes.sha512.name
+    roots.append((os.path.join(cache_dir, 'chunks'), hashes.sha512))
+    for root_dir, hash_type in roots:
+        algo_dir = os.path.join(root_dir, hash_type.name)
+        for cur_dir, dirs, files in os.walk(algo_dir):
+            dirs.sort()
+            for file in sorted(files):
+                if not _VALUE_REGEX.match(file):
+                    continue
+                filepath = os.path.join(cur_dir, file)
+                if filepath == core.get_cas_path(root_dir, hash_type.name, file):
+                    yield (filepath, hash_type, file)
+
+
+def _remove_stale_tmp_files(cache_dir):
+    count = 0
+    now = time.time()
+    for cur_dir, dirs, files in os.walk(cache_dir):
+        if cur_dir == cache_dir and QUARANTINE_RELPATH in dirs:
+            dirs.remove(QUARANTINE_RELPATH)
+        for file in files:
+            filepath = os.path.join(cur_dir, file)
+            if file.endswith('.tmp') and now - os.path.getmtime(filepath) > STALE_TMP_AGE:
+                os.remove(filepath)
+                count += 1
+    return count
+
+
+def _read_entry(filepath, offset, remaining):
+    """ @returns Generator of the data of an entry, in pieces.
+    `offset` and `remaining` are (0, None) for a whole file, or locate a blob in a pack. """
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        while remaining != 0:
+            data = f.read(_READ_SIZE if remaining is None else min(_READ_SIZE, remaining))
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            yield data
+
+
+def _verify_entry(item):
+    # Run in a worker process.
+    # Returns whether the entry matches, or None if it was removed (e.g. by a concurrent process)
+    # since it was listed.
+    filepath, offset, remaining, algo, value, rate = item
+    hasher = dict((hash_type.name, hash_type) for hash_type in hashes.hash_types)[algo].create_hasher()
+    size = 0
+    start = time.time()
+    try:
+        for data in _read_entry(filepath, offset, remaining):
+            hasher.update(data)
+            size += len(data)
+            if rate is not None:
+                # Stay at or below `rate` (bytes / sec), on average.
+                delay = float(size) / rate - (time.time() - start)
+                if delay > 0:
+                    time.sleep(delay)
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return (item, None, size)
+        raise
+    return (item, hasher.hexdigest() == value, size)
+
+
+def _sha256_entry(item):
+    # Run in a worker process.
+    filepath, offset, remaining, algo, value, _ = item
+    if algo == hashes.sha256.name:
+        return (item, value)
+    hasher = hashlib.sha256()
+    for data in _read_entry(filepath, offset, remaining):
+        hasher.update(data)
+    return (item, hasher.hexdigest())
+
+
+def _export(args, user, items):
+    """ Publishes cache entries into Bazel's repository and disk cache layouts (see
+    `bazel_caches.py`), hardlinking where possible. Entries of other hash types are hashed with
+    SHA-256 first. """
+    repository_caches = [os.path.abspath(os.path.expanduser(path))
+                         for path in args.repository_cache or user.bazel_caches.repository_caches]
+    disk_caches = [os.path.abspath(os.path.expanduser(path))
+                   for path in args.disk_cache or user.bazel_caches.disk_caches]
+    if not repository_caches and not disk_caches:
+        raise RuntimeError("No Bazel caches to export to: pass --repository_cache or --disk_cache, or set `bazel_caches` in the user config")
+    count = 0
+    pool = multiprocessing.Pool(max(1, args.jobs))
+    try:
+        for item, value in pool.imap_unordered(_sha256_entry, items, chunksize=4):
+            filepath, offset, size = item[0:3]
+            dests = [bazel_caches.get_repository_cache_path(root_dir, value)
+                     for root_dir in repository_caches]
+            dests += [bazel_caches.get_disk_cache_paths(root_dir, value)[0] for root_dir in disk_caches]
+            for dest in dests:
+                if size is None:
+                    published = bazel_caches.publish(filepath, dest)
+                else:
+                    # Packed; write out.
+                    def write(f):
+                        for data in _read_entry(filepath, offset, size):
+                            f.write(data)
+                    published = bazel_caches.publish(None, dest, write)
+                if published:
+                    count += 1
+                    metrics.add("bazel_cache_exports")
+    finally:
+        pool.close()
+        pool.join()
+    print("Exported {} entries ({} files written) to {} Bazel cache(s)".format(
+        len(items), count, len(repository_caches) + len(disk_caches)))
+    return True
+
+
+def _get_quarantine_path(cache_dir, relpath):
+    dest = os.path.join(cache_dir, QUARANTINE_RELPATH, relpath)
+    if os.path.exists(dest):
+        dest = "{}.{}".format(dest, uuid.uuid4().hex)
+    dest_dir = os.path.dirname(dest)
+    if not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir)
+    return dest
+
+
+def _quarantine(user, item):
+    filepath, offset, size, algo, value, _ = item
+    if size is None:
+        dest = _get_quarantine_path(user.cache_dir, os.path.relpath(filepath, user.cache_dir))
+        os.rename(filepath, dest)
+    else:
+        # Copy out of the pack, and remove it from the index.
+        dest = _get_quarantine_path(user.cache_dir, os.path.join('packs', algo, value))
+        with open(filepath, 'rb') as f:
+            f.seek(offset)
+            data = f.read(size)
+        with open(dest, 'wb') as f:
+            f.write(data)
+        user.packs.remove(algo, value)
+    return dest
+
+
+def _refetch(args, project, bad_values):
+    good = True
+    count = 0
+    infos = {}
+    for hash_file in project.find_hash_files(args.refetch or ['.']):
+        def resolve():
+            info = project.get_file_info(hash_file)
+            if info.hash.get_value() in bad_values:
+                infos.setdefault(info.hash, info)
+        good = util.keep_going(args.keep_going, resolve) and good
+    fetches = [info.remote.download_to_cache_async(info.hash, info.project_relpath)
+               for info in infos.values()]
+    for fetch in fetches:
+        if util.keep_going(args.keep_going, fetch.result):
+            count += 1
+        else:
+            good = False
+    print("Re-fetched {} of {} quarantined entries".format(count, len(bad_values)))
+    return good and count == len(bad_values)
+
+
+def run(args, user, project=None):
+    cache_dir = user.cache_dir
+    rate = None
+    if args.limit_rate is not None:
+        rate = max(1, util.parse_size(args.limit_rate) // max(1, args.jobs))
+    items = [(filepath, 0, None, hash_type.name, value, rate)
+             for filepath, hash_type, value in _iter_entries(cache_dir)]
+    items += [(pack_file, offset, size, algo, value, rate)
+              for algo, value, pack_file, offset, size in user.packs.iter_entries()]
+    if args.action == 'export':
+        # Chunks are not files that Bazel would look up.
+        chunks_dir = os.path.join(cache_dir, 'chunks')
+        return _export(args, user, [item for item in items
+                                    if not util.is_child_path(item[0], chunks_dir, require_abs=False)])
+    bad = []
+    removed = 0
+    total_size = 0
+    start = time.time()
+    pool = multiprocessing.Pool(max(1, args.jobs))
+    try:
+        for item, ok, size in pool.imap_unordered(_verify_entry, items, chunksize=4):
+            if ok is None:
+                removed += 1
+                continue
+            total_size += size
+            metrics.add("cache_entries_verified")
+            if not ok:
+                dest = _quarantine(user, item)
+                metrics.add("cache_entries_quarantined")
+                util.eprint("Hash mismatch, quarantined: {}".format(dest))
+                bad.append(item)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+    print("Verified {} entries ({:.1f} MiB) in {:.1f}s: {} quarantined".format(
+        len(items) - removed, total_size / 1024. / 1024, elapsed, len(bad)))
+    if removed:
+        print("Skipped {} entries removed during verification".format(removed))
+    stale = _remove_stale_tmp_files(cache_dir)
+    if stale:
+        print("Removed {} stale temporary files".format(stale))
+    # Chunks are re-fetched on demand by their backend.
+    chunks_dir = os.path.join(cache_dir, 'chunks')
+    bad_chunks = [item for item in bad if util.is_child_path(item[0], chunks_dir, require_abs=False)]
+    bad_values = set(item[4] for item in bad if item not in bad_chunks)
+    if not bad:
+        return True
+    # Fail (e.g. so that a scheduled scrub alerts), unless every entry has been repaired.
+    if bad_values and needs_project(args):
+        return _refetch(args, project, bad_values) and not bad_chunks
+    return False
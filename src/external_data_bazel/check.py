@@ -15,24 +15,20 @@ def add_arguments(parser):
 
 def run(args, project):
     good = True
+    # Query all files concurrently (so that backends may batch queries), then report in order.
+    checks = []
     for input_file in args.input_files:
-        def action():
-            do_check(args, project, input_file)
-        if args.keep_going:
-            try:
-                action()
-            except RuntimeError as e:
-                good = False
-                util.eprint(e)
-                util.eprint("Continuing (--keep_going).")
-        else:
-            action()
+        def start():
+            info = project.get_file_info(os.path.abspath(input_file))
+            checks.append((info, info.remote.has_file_async(info.hash, info.project_relpath)))
+        good = util.keep_going(args.keep_going, start) and good
+    for info, query in checks:
+        good = util.keep_going(
+            args.keep_going, lambda: do_check(args, project, info, query.result())) and good
     return good
 
 
-def do_check(args, project, filepath_in):
-    filepath = os.path.abspath(filepath_in)
-    info = project.get_file_info(filepath)
+def do_check(args, project, info, has_file):
     remote = info.remote
     project_relpath = info.project_relpath
     hash = info.hash
@@ -44,7 +40,7 @@ def do_check(args, project, filepath_in):
         }]
         yaml.dump(dump, sys.stdout, default_flow_style=False)
 
-    if not remote.has_file(hash, project_relpath):
+    if not has_file:
         if not args.verbose:
             dump_remote_config()
         raise RuntimeError("Remote does not have '{}' ({})".format(project_relpath, hash))
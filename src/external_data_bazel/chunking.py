@@ -0,0 +1,109 @@
+import hashlib
+import json
+import random
+import re
+
+# Content-defined chunking, so that a local edit to a large file only changes the chunks around
+# the edit (rather than shifting every fixed-size block after it).
+#
+# A boundary is placed after any 5-byte window where each byte belongs to a (pseudo-random, fixed)
+# set of 16 byte values, i.e. with probability 2^-20 per position, for an average of ~1 MiB
+# between boundaries. Chunks are constrained to [MIN_SIZE, MAX_SIZE].
+# Matching is done with a compiled regular expression, so that scanning runs in C rather than a
+# per-byte Python loop (as a rolling hash would require).
+#
+# WARNING: Changing any of these parameters changes chunk boundaries, and thus prevents
+# deduplication against existing chunks. Bump `VERSION` if they ever change.
+
+VERSION = 1
+MIN_SIZE = 256 * 1024
+MAX_SIZE = 4 * 1024 * 1024
+READ_SIZE = 8 * 1024 * 1024
+CHUNK_ALGO = 'sha512'
+
+_WINDOW = 5
+_SET_SIZE = 16
+
+
+def _make_boundary_regex(seed=0x6368756e6b):
+    rng = random.Random(seed)
+    classes = []
+    for i in range(_WINDOW):
+        values = sorted(rng.sample(range(256), _SET_SIZE))
+        classes.append("[" + "".join("\\x{:02x}".format(v) for v in values) + "]")
+    return re.compile("".join(classes).encode('ascii'))
+
+_BOUNDARY_REGEX = _make_boundary_regex()
+
+
+def iter_chunks(f):
+    """ Split the contents of a binary file object into content-defined chunks.
+    @returns Generator of chunk contents. """
+    buf = b''
+    eof = False
+    while not eof:
+        data = f.read(READ_SIZE)
+        eof = not data
+        buf += data
+        while buf:
+            m = _BOUNDARY_REGEX.search(buf, MIN_SIZE, min(len(buf), MAX_SIZE))
+            if m:
+                cut = m.end()
+            elif len(buf) >= MAX_SIZE:
+                cut = MAX_SIZE
+            elif eof:
+                cut = len(buf)
+            else:
+                # Need more data to find a boundary.
+                break
+            yield buf[:cut]
+            buf = buf[cut:]
+
+
+def hash_chunk(chunk):
+    return hashlib.new(CHUNK_ALGO, chunk).hexdigest()
+
+
+class Manifest(object):
+    """ Describes a file as an ordered list of chunks. """
+    def __init__(self, size, chunks):
+        self.size = size
+        # List of (hash value, size).
+        self.chunks = chunks
+
+    def to_json(self):
+        return json.dumps({
+            "version": VERSION,
+            "chunk_algo": CHUNK_ALGO,
+            "size": self.size,
+            "chunks": [list(chunk) for chunk in self.chunks],
+        }, sort_keys=True)
+
+    @staticmethod
+    def from_json(text):
+        data = json.loads(text)
+        if data["version"] != VERSION or data["chunk_algo"] != CHUNK_ALGO:
+            raise RuntimeError("Unsupported chunk manifest: version {}, algo {}".format(
+                data["version"], data["chunk_algo"]))
+        return Manifest(data["size"], [tuple(chunk) for chunk in data["chunks"]])
+
+
+if __name__ == '__main__':
+    import io
+    import os
+
+    data = os.urandom(20 * 1024 * 1024)
+    chunks = list(iter_chunks(io.BytesIO(data)))
+    assert b''.join(chunks) == data
+    assert all(len(chunk) <= MAX_SIZE for chunk in chunks)
+    assert all(len(chunk) >= MIN_SIZE for chunk in chunks[:-1])
+    # An insertion near the start should only change the chunk(s) around it.
+    edited = data[:1000] + b'inserted' + data[1000:]
+    edited_chunks = list(iter_chunks(io.BytesIO(edited)))
+    common = set(map(hash_chunk, chunks)) & set(map(hash_chunk, edited_chunks))
+    assert len(common) >= len(chunks) - 2, (len(common), len(chunks))
+    # Low-entropy data is cut at the maximum size.
+    assert [len(chunk) for chunk in iter_chunks(io.BytesIO(b'\0' * (MAX_SIZE + 1)))] == [MAX_SIZE, 1]
+    manifest = Manifest(len(data), [(hash_chunk(chunk), len(chunk)) for chunk in chunks])
+    assert Manifest.from_json(manifest.to_json()).chunks == manifest.chunks
+    print("[ Done ]")
@@ -4,9 +4,11 @@ import sys
 import os
 import yaml
 import argparse
+import atexit
+import time
 
-from external_data_bazel import core, util, config_helpers
-from external_data_bazel import download, upload, check
+from external_data_bazel import core, util, config_helpers, profiling, futures
+from external_data_bazel import download, upload, check, status, prefetch, stats, serve, cache, fetch
 
 assert __name__ == '__main__'
 
@@ -23,6 +25,10 @@ parser.add_argument('--user_config', type=str, default=None,
                     help='Override user configuration (useful for testing).')
 parser.add_argument('-k', '--keep_going', action='store_true',
                     help='Attempt to keep going.')
+parser.add_argument('-j', '--jobs', type=int, default=8,
+                    help='Number of concurrent jobs (hashing, querying remotes) for commands that support it.')
+parser.add_argument('--profile', type=str, default=None,
+                    help='Record timed spans (project loading, remote queries, transfers, hashing, etc.) and write them to this file in Chrome trace-event format.')
 parser.add_argument('-v', '--verbose', action='store_true',
                     help='Dump configuration and show command-line arguments. WARNING: Will print out information in user configuration (e.g. keys) as well!')
 
@@ -38,7 +44,35 @@ upload.add_arguments(upload_parser)
 check_parser = subparsers.add_parser("check")
 check.add_arguments(check_parser)
 
+status_parser = subparsers.add_parser("status")
+status.add_arguments(status_parser)
+
+prefetch_parser = subparsers.add_parser("prefetch")
+prefetch.add_arguments(prefetch_parser)
+
+fetch_parser = subparsers.add_parser("fetch")
+fetch.add_arguments(fetch_parser)
+
+stats_parser = subparsers.add_parser("stats")
+stats.add_arguments(stats_parser)
+
+serve_parser = subparsers.add_parser("serve")
+serve.add_arguments(serve_parser)
+
+cache_parser = subparsers.add_parser("cache")
+cache.add_arguments(cache_parser)
+
 args = parser.parse_args()
+start_time = time.time()
+# Bound asynchronous operations (threads for synchronous backends and hashing, and processes for
+# native asynchronous transfers).
+futures.set_max_workers(args.jobs)
+futures.set_max_processes(args.jobs)
+
+if args.profile:
+    profiling.enable()
+    # Write the trace even if the command fails.
+    atexit.register(profiling.write, os.path.abspath(args.profile))
 
 # Do not allow running under Bazel unless we have a guess for the project root from an input file.
 if util.in_bazel_runfiles() and not args.project_root_guess:
@@ -56,6 +90,20 @@ user_config = None
 if args.user_config is not None:
     user_config = config_helpers.parse_config_file(args.user_config)
 
+# Commands which only need user configuration.
+if args.command in ("stats", "serve") or (args.command == "cache" and not cache.needs_project(args)):
+    user = core.load_user(user_config)
+    if args.command == "stats":
+        result = stats.run(args, user)
+    elif args.command == "serve":
+        result = serve.run(args, user)
+    elif args.command == "cache":
+        user.record_metrics_at_exit(args.command, start_time)
+        result = cache.run(args, user)
+    if result is not True:
+        exit(1)
+    exit(0)
+
 project = core.load_project(
     os.path.abspath(args.project_root_guess),
     user_config_in=user_config,
@@ -64,14 +112,24 @@ if args.verbose:
     yaml.dump({"user_config": project.debug_dump_user_config()}, sys.stdout, default_flow_style=False)
     yaml.dump({"project_config": project.debug_dump_config()}, sys.stdout, default_flow_style=False)
 
+project.user.record_metrics_at_exit(args.command, start_time)
+
 # Execute command.
 if args.command == 'download':
-    status = download.run(args, project)
+    result = download.run(args, project)
 elif args.command == 'upload':
-    status = upload.run(args, project)
+    result = upload.run(args, project)
 elif args.command == "check":
-    status = check.run(args, project)
+    result = check.run(args, project)
+elif args.command == "status":
+    result = status.run(args, project)
+elif args.command == "prefetch":
+    result = prefetch.run(args, project)
+elif args.command == "fetch":
+    result = fetch.run(args, project)
+elif args.command == "cache":
+    result = cache.run(args, project.user, project)
 
-if status is not None and status is not True:
+if result is not None and result is not True:
     util.eprint("Encountered error")
     exit(1)
@@ -2,7 +2,7 @@ import os
 import yaml
 import copy
 
-from external_data_bazel import util
+from external_data_bazel import util, profiling
 
 # Helpers for configuration finding, specific to (a) general `external_data_bazel` configuration
 # and (b) Bazel path obfuscation reversal within `external_data_bazel`.
@@ -65,7 +65,7 @@ def find_package_config_files(project_root, start_dir, config_file):
     This excludes the project-root config. """
     assert os.path.isabs(start_dir)
     assert os.path.isabs(project_root)
-    assert util.is_child_path(start_dir, project_root)
+    assert start_dir == project_root or util.is_child_path(start_dir, project_root)
     config_files = []
     cur_dir = start_dir
     while cur_dir != project_root:
@@ -84,8 +84,9 @@ def parse_config_file(config_file, add_filepath = True):
     """ Parse a configuration file.
     @param add_filepath
         Adds `config_file` to the root level for debugging purposes. """
-    with open(config_file) as f:
-        config = yaml.load(f)
+    with profiling.span("parse_config_file", config_file=config_file):
+        with open(config_file) as f:
+            config = yaml.load(f)
     if config is None:
         config = {}
     if add_filepath:
@@ -1,30 +1,100 @@
+import atexit
+import io
+import json
 import os
+import threading
+import time
 
-from external_data_bazel import util, config_helpers, hashes
+from external_data_bazel import util, config_helpers, hashes, profiling, metrics, futures, packs
+from external_data_bazel import remote_file, transfers, bazel_caches
 
 ROOT_PACKAGE = '//'  # Blech... Need to get a better mechanism.
 PACKAGE_CONFIG_FILE = ".external_data.yml"
 PROJECT_CONFIG_FILE = ".external_data.project.yml"
 USER_CONFIG_FILE_DEFAULT = os.path.expanduser("~/.config/external_data_bazel/config.yml")
 CACHE_DIR_DEFAULT = "~/.cache/external_data_bazel"
+# Remote settings which do not affect its backend; remotes whose configurations differ only in
+# these share one backend instance (see `Project.load_backend`).
+REMOTE_ONLY_CONFIG_KEYS = ('overlay', 'check_always', 'probe')
 USER_CONFIG_DEFAULT = {
     "core": {
         "cache_dir": CACHE_DIR_DEFAULT,
+        # Append counters of each CLI invocation to `{cache_dir}/metrics/` (see `cli.py stats`).
+        "record_metrics": False,
+        # Size (e.g. "10M") past which the metrics file is rotated (keeping one older file).
+        # Unbounded if null.
+        "metrics_max_size": "10M",
+        # Store downloaded files of at most this size (e.g. "64K") in pack files under
+        # `{cache_dir}/packs/` rather than one file each (see `packs.py`). Disabled if null.
+        "pack_threshold": None,
+    },
+    # Limits on transfers, across all remotes (see `transfers.py`).
+    "transfers": {
+        # Maximum concurrent transfers to one host. Unlimited (besides `--jobs`) if null.
+        "max_connections_per_host": 16,
+        # Total bandwidth cap for transfers (e.g. "20M", in bytes / sec). Unlimited if null.
+        "limit_rate": None,
+    },
+    # Bazel's content-addressed caches, checked for files (by SHA-256) before downloading them
+    # (see `bazel_caches.py`), and targets for `cache export`.
+    "bazel_caches": {
+        # Bazel `--repository_cache` directories.
+        "repository_cache": [],
+        # Bazel `--disk_cache` directories.
+        "disk_cache": [],
     },
 }
 
 
+def get_cas_path(root_dir, algo, value):
+    """ Get the path of a blob in a content-addressed directory tree (e.g. the user cache).
+    Layout: {root_dir}/{algo}/{value[0:2]}/{value[2:4]}/{value} """
+    return os.path.join(root_dir, algo, value[0:2], value[2:4], value)
+
+
 class Backend(object):
     """ Downloads or uploads a file from a given storage mechanism given the hash file.
     This also has access to the package (and indirectly, the project) to determine the
     file path relative to the package as well. The project can be used to retrieve the
     (if applicable), etc. """
+    # Whether one instance may serve every remote with an equivalent configuration (see
+    # `Project.load_backend`), i.e. the backend does not depend on `self.package`.
+    shareable = False
+    # Whether `download_stream` is supported, so that downloads can be hashed as they arrive.
+    can_stream = False
+    # Whether `get_size` and `download_range` are supported, for partial reads (see
+    # `Remote.open_file`).
+    can_range = False
+    # The only hash type which the storage can address files by (e.g. `hashes.sha256` for stores
+    # keyed by SHA-256), or None for any. See `_is_supported`.
+    hash_type = None
+
     def __init__(self, config, package, can_upload):
         self.package = package
         self.project = self.package.project
         self.config = config
         self.can_upload = can_upload
 
+    def _is_supported(self, hash):
+        """ Returns whether `hash` is of a type that this backend can store. Backends should report
+        other hashes as missing. """
+        return self.hash_type is None or hash.hash_type == self.hash_type
+
+    def _check_hash_type(self, hash):
+        """ @raises util.DownloadError if `hash` is not supported (see `_is_supported`). """
+        if not self._is_supported(hash):
+            raise util.DownloadError("Backend '{}' only supports {}, not {}".format(
+                self.config['backend'], self.hash_type, hash.hash_type))
+
+    def get_host(self):
+        """ Returns the host that transfers connect to, for per-host limits (see `transfers.py`),
+        or None (e.g. for local storage). """
+        from urlparse import urlparse
+        url = self.config.get('url')
+        if url is None:
+            return None
+        return urlparse(url).netloc or None
+
     def has_file(self, hash, project_relpath):
         """ Determines if the storage mechanism has a given SHA.
         @note It is IMPORTANT that the 'hash' be prioritized.
@@ -39,6 +109,23 @@ class Backend(object):
             how this is used (e.g. via CMake/ExternalData). """
         raise RuntimeError("Downloading not supported for this backend")
 
+    def download_stream(self, hash, project_relpath, write):
+        """ Downloads a file, passing its contents (in order) to `write(data)`.
+        Only used if `can_stream`.
+        @raises util.DownloadError if the file is not available. """
+        raise RuntimeError("Streaming not supported for this backend")
+
+    def get_size(self, hash, project_relpath):
+        """ Returns the size of a file in bytes, or None if it is not available (or ranges cannot be
+        read for it). Only used if `can_range`. """
+        raise RuntimeError("Ranges not supported for this backend")
+
+    def download_range(self, hash, project_relpath, offset, size):
+        """ Returns `size` bytes of a file, starting at `offset` (which must be within the file).
+        Only used if `can_range`.
+        @raises util.DownloadError on failure. """
+        raise RuntimeError("Ranges not supported for this backend")
+
     def upload_file(self, hash, project_relpath, filepath):
         """ Uploads a file from an output path given a SHA.
         @param project_relpath
@@ -46,6 +133,25 @@ class Backend(object):
         @note This hash should be assumed to be valid. """
         raise RuntimeError("Uploading not supported for this backend")
 
+    # Asynchronous variants, returning a `futures.Future`.
+    # By default, these run the synchronous methods on a thread pool; backends may override them
+    # with native implementations (e.g. via `util.curl_async`).
+
+    def has_file_async(self, hash, project_relpath):
+        """ @see has_file
+        @returns Future of bool """
+        return futures.submit(self.has_file, hash, project_relpath)
+
+    def download_file_async(self, hash, project_relpath, output_path):
+        """ @see download_file
+        @returns Future of None """
+        return futures.submit(self.download_file, hash, project_relpath, output_path)
+
+    def upload_file_async(self, hash, project_relpath, filepath):
+        """ @see upload_file
+        @returns Future of None """
+        return futures.submit(self.upload_file, hash, project_relpath, filepath)
+
 
 class Remote(object):
     """ Provides a cache-friendly and hierarchy-friendly access to a given remote. """
@@ -57,6 +163,14 @@ class Remote(object):
         self._backend = self.package.load_backend(backend_type, config)
 
         self._check_always = config.get('check_always', False)
+        # If 'parallel', query this remote and all of its overlays concurrently, rather than
+        # walking the overlay chain one round trip at a time.
+        self._probe = config.get('probe', 'sequential')
+        if self._probe not in ['sequential', 'parallel']:
+            raise RuntimeError("Remote '{}': unknown probe mode: {}".format(name, self._probe))
+
+        self._transfers = self.package.project.user.transfers
+        self._host = self._backend.get_host()
 
         overlay_name = config.get('overlay')
         self.overlay = None
@@ -67,30 +181,200 @@ class Remote(object):
         """ Returns whether this remote is overlaying another. """
         return self.overlay is not None
 
+    def _use_parallel_probe(self):
+        return self._probe == 'parallel' and self.has_overlay()
+
+    def _get_chain(self):
+        """ Returns this remote and its overlays, in order of priority. """
+        chain = []
+        remote = self
+        while remote is not None:
+            chain.append(remote)
+            remote = remote.overlay
+        return chain
+
+    def _probe_chain_async(self, hash, project_relpath):
+        """ Queries this remote and its overlays concurrently.
+        @returns Future of the highest-priority remote which has the file, or None. Once this is
+            known, queries of lower-priority remotes are cancelled. """
+        chain = self._get_chain()
+        probes = [remote.has_file_async(hash, project_relpath, check_overlay=False) for remote in chain]
+        out = futures.Future()
+        lock = threading.Lock()
+        decided = [False]
+        def on_probe(_):
+            with lock:
+                if decided[0]:
+                    return
+                winner = None
+                for remote, probe in zip(chain, probes):
+                    if not probe.done():
+                        # Wait on higher-priority remotes.
+                        return
+                    # Treat errors as not having the file.
+                    if probe.exception() is None and probe.result():
+                        winner = remote
+                        break
+                decided[0] = True
+            # @note Cancelling runs callbacks (including this one), so do so outside of the lock.
+            for probe in probes:
+                probe.cancel()
+            if winner is not None:
+                metrics.add("probe_winners", remote=self.name, winner=winner.name)
+            out.set_result(winner)
+        for probe in probes:
+            probe.add_done_callback(on_probe)
+        return out
+
     def has_file(self, hash, project_relpath, check_overlay=True):
         """ Returns whether this remote (or its overlay) has a given SHA. """
-        if self._backend.has_file(hash, project_relpath):
+        if check_overlay and self._use_parallel_probe():
+            with profiling.span("Remote.probe_chain", remote=self.name, hash=str(hash)):
+                return self._probe_chain_async(hash, project_relpath).result() is not None
+        with profiling.span("Remote.has_file", remote=self.name, hash=str(hash)):
+            has_file = self._backend.has_file(hash, project_relpath)
+        metrics.add("has_file_queries", remote=self.name, result=str(bool(has_file)).lower())
+        if has_file:
             return True
         elif check_overlay and self.has_overlay():
             return self.overlay.has_file(hash, project_relpath)
 
+    def _no_remote_error(self, hash):
+        return util.DownloadError("No remote in the chain of '{}' has file {}: {}".format(
+            self.name, hash, ", ".join(remote.name for remote in self._get_chain())))
+
     def download_file_direct(self, hash, project_relpath, output_file):
         """ Downloads a file directly and checks the SHA.
         @pre `output_file` should not exist. """
+        if self._use_parallel_probe():
+            with profiling.span("Remote.probe_chain", remote=self.name, hash=str(hash)):
+                winner = self._probe_chain_async(hash, project_relpath).result()
+            if winner is None:
+                raise self._no_remote_error(hash)
+            winner._download_file_direct(hash, project_relpath, output_file)
+        else:
+            self._download_file_direct(hash, project_relpath, output_file)
+
+    def _download_file_direct(self, hash, project_relpath, output_file):
+        # Walks the overlay chain sequentially.
         assert not os.path.exists(output_file)
         try:
-            self._backend.download_file(hash, project_relpath, output_file)
+            with profiling.span("Remote.download_file_direct", remote=self.name, hash=str(hash)), \
+                    metrics.Timer("download_seconds", remote=self.name):
+                computed = self._transfers.run(
+                    self._host, lambda: self._download_backend(hash, project_relpath, output_file))
             # TODO(eric.cousineau): Revert to overlay of checksum fails?
-            hash.check_file(output_file)
+            if computed is not None:
+                hash.check(computed)
+            else:
+                hash.check_file(output_file)
+            metrics.add("downloads", remote=self.name)
+            metrics.add("download_bytes", os.path.getsize(output_file), remote=self.name)
         except util.DownloadError as e:
+            metrics.add("download_errors", remote=self.name)
             if self.has_overlay():
+                metrics.add("overlay_fallbacks", remote=self.name, overlay=self.overlay.name)
+                # Remove any partial download.
+                if os.path.exists(output_file):
+                    os.remove(output_file)
                 # TODO(eric.cousineau): If hierarchical caching is used (for whatever reason), this
                 # would be an invalid operation.
-                self.overlay.download_file_direct(hash, project_relpath, output_file)
+                self.overlay._download_file_direct(hash, project_relpath, output_file)
             else:
                 # Rethrow
                 raise e
 
+    def _download_backend(self, hash, project_relpath, output_file):
+        """ Downloads from this remote's backend only.
+        @returns The hash computed while streaming, or None if the backend does not stream (and
+            `output_file` must be read back to check it). """
+        hasher = hash.hash_type.create_hasher() if self._backend.can_stream else None
+        if hasher is None:
+            self._backend.download_file(hash, project_relpath, output_file)
+            self._transfers.throttle(os.path.getsize(output_file))
+            return None
+        with open(output_file, 'wb') as f:
+            def write(data):
+                hasher.update(data)
+                f.write(data)
+                self._transfers.throttle(len(data))
+            self._backend.download_stream(hash, project_relpath, write)
+        metrics.add("hash_checks", algo=hash.get_algo())
+        metrics.add("hash_check_bytes", os.path.getsize(output_file), algo=hash.get_algo())
+        return hash.hash_type.create(hasher.hexdigest(), filepath=output_file)
+
+    def has_file_async(self, hash, project_relpath, check_overlay=True):
+        """ Asynchronous `has_file`.
+        @returns Future of bool """
+        if check_overlay and self._use_parallel_probe():
+            return futures.then(self._record_probe_chain(hash, project_relpath),
+                                lambda f: f.result() is not None)
+        def on_done(f):
+            has_file = f.result()
+            metrics.add("has_file_queries", remote=self.name, result=str(bool(has_file)).lower())
+            if has_file:
+                return True
+            elif check_overlay and self.has_overlay():
+                return self.overlay.has_file_async(hash, project_relpath)
+            return False
+        queried = profiling.record_future(
+            "Remote.has_file", self._backend.has_file_async(hash, project_relpath),
+            remote=self.name, hash=str(hash))
+        return futures.then(queried, on_done)
+
+    def download_file_direct_async(self, hash, project_relpath, output_file):
+        """ Asynchronous `download_file_direct`, including overlay fallback.
+        @returns Future of None """
+        if self._use_parallel_probe():
+            def on_probe(f):
+                winner = f.result()
+                if winner is None:
+                    raise self._no_remote_error(hash)
+                return winner._download_file_direct_async(hash, project_relpath, output_file)
+            return futures.then(self._record_probe_chain(hash, project_relpath), on_probe)
+        return self._download_file_direct_async(hash, project_relpath, output_file)
+
+    def _record_probe_chain(self, hash, project_relpath):
+        # `_probe_chain_async`, with the same span as the synchronous probes.
+        return profiling.record_future(
+            "Remote.probe_chain", self._probe_chain_async(hash, project_relpath),
+            remote=self.name, hash=str(hash))
+
+    def _download_file_direct_async(self, hash, project_relpath, output_file):
+        assert not os.path.exists(output_file)
+        if self._transfers.has_rate():
+            # Bandwidth is shaped as data arrives (or after each file), which requires blocking.
+            return futures.submit(self._download_file_direct, hash, project_relpath, output_file)
+        start = time.time()
+        def on_download(f):
+            metrics.add("download_seconds", time.time() - start, remote=self.name)
+            f.result()
+            # Hash off of the completing thread.
+            return futures.submit(hash.check_file, output_file)
+        def on_checked(f):
+            error = f.exception()
+            if error is None:
+                metrics.add("downloads", remote=self.name)
+                metrics.add("download_bytes", os.path.getsize(output_file), remote=self.name)
+                return None
+            if not isinstance(error, util.DownloadError):
+                raise error
+            metrics.add("download_errors", remote=self.name)
+            if not self.has_overlay():
+                raise error
+            metrics.add("overlay_fallbacks", remote=self.name, overlay=self.overlay.name)
+            # Remove any partial download.
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            return self.overlay._download_file_direct_async(hash, project_relpath, output_file)
+        transfer = self._transfers.run_async(
+            self._host,
+            lambda: self._backend.download_file_async(hash, project_relpath, output_file))
+        profiling.record_future(
+            "Remote.download_file_direct", transfer, remote=self.name, hash=str(hash))
+        downloaded = futures.then(transfer, on_download)
+        return futures.then(downloaded, on_checked)
+
     def download_file(self, hash, project_relpath, output_file,
                       use_cache = True, symlink = True):
         """ Downloads a file.
@@ -109,17 +393,18 @@ class Remote(object):
         # Helper functions.
         def get_cached(skip_sha_check=False):
             # Can use cache. Copy to output path.
-            if symlink:
-                util.subshell(['ln', '-s', cache_path, output_file])
-            else:
-                util.subshell(['cp', cache_path, output_file])
-                util.subshell(['chmod', '+w', output_file])
+            packed = self.materialize_cached(hash, output_file, symlink=symlink)
             # On error, remove cached file, and re-download.
             if not skip_sha_check:
                 if not hash.check_file(output_file, do_throw=False):
+                    metrics.add("cache_corruptions", remote=self.name)
                     util.eprint("SHA-512 mismatch. Removing old cached file, re-downloading.")
-                    # `os.remove()` will remove read-only files without prompting.
-                    os.remove(cache_path)
+                    if packed:
+                        user_packs.remove(hash.get_algo(), hash.get_value())
+                        os.remove(output_file)
+                    else:
+                        # `os.remove()` will remove read-only files without prompting.
+                        os.remove(cache_path)
                     if os.path.islink(output_file):
                         # In this situation, the cache was corrupted (somehow), and Bazel
                         # triggered a recompilation, and we still have a symlink in Bazel-space.
@@ -130,31 +415,232 @@ class Remote(object):
                     get_download_and_cache()
 
         def get_download_and_cache():
-            with util.FileWriteLock(cache_path):
-                self.download_file_direct(hash, project_relpath, cache_path)
-                # Make cache file read-only.
-                util.subshell(['chmod', '-w', cache_path])
+            self._download_to_cache_path(hash, project_relpath, cache_path)
             # Use cached file - `get_download()` has already checked the hash.
             get_cached(skip_sha_check=True)
 
         # Check if we need to download.
         if use_cache:
-            if self._check_always:
-                if not self.has_file(hash):
-                    raise util.DownloadError("Remote '{}' does not have file {} to download to {}".format(self.name, hash, output_file))
-            cache_path = self.package.get_hash_cache_path(hash, create_dir=True)
+            user_packs = self.package.project.user.packs
+            cache_path = self.package.get_hash_cache_path(hash)
             # TODO(eric.cousineau): This still isn't atomic, and may encounter a race condition...
             util.wait_file_read_lock(cache_path)
-            if os.path.isfile(cache_path):
+            if self.package.is_hash_cached(hash):
+                metrics.add("cache_hits", remote=self.name)
+                # Only a cache hit needs to query the remote; on a miss, the download itself
+                # shows whether the remote has the file.
+                if self._check_always:
+                    if not self.has_file(hash, project_relpath):
+                        raise util.DownloadError("Remote '{}' does not have file {} to download to {}".format(self.name, hash, output_file))
                 get_cached()
                 return 'cached'
             else:
+                metrics.add("cache_misses", remote=self.name)
                 get_download_and_cache()
                 return 'download'
         else:
             self.download_file_direct(hash, project_relpath, output_file)
             return 'download'
 
+    def materialize_cached(self, hash, output_file, symlink=True):
+        """ Places a cached file at `output_file`, without checking its hash (e.g. since it was
+        just downloaded via `download_to_cache`).
+        @param symlink
+            As for `download_file`. Packed files are always written out (read-only, if true).
+        @returns Whether the file was stored in a pack.
+        @raises util.DownloadError if the file is not cached. """
+        cache_path = self.package.get_hash_cache_path(hash)
+        packed = None
+        if not os.path.isfile(cache_path):
+            packed = self.package.project.user.packs.get(hash.get_algo(), hash.get_value())
+            if packed is None:
+                raise util.DownloadError("File {} is not cached".format(hash))
+        with profiling.span("cache.materialize", symlink=symlink):
+            if packed is not None:
+                # Packed files have no cache file to link to, so they are always written out
+                # (read-only, as with a symlink into the cache).
+                with open(output_file, 'wb') as f:
+                    f.write(packed)
+                if symlink:
+                    os.chmod(output_file, 0o444)
+            elif symlink:
+                util.subshell(['ln', '-s', cache_path, output_file])
+            else:
+                util.subshell(['cp', cache_path, output_file])
+                util.subshell(['chmod', '+w', output_file])
+        return packed is not None
+
+    def _get_cache_tmp_path(self, cache_path):
+        # Download into the cache directory (i.e. the same filesystem), but outside of the
+        # sharded layout, so that packed files do not create directories.
+        tmp_dir = os.path.join(self.package.project.user.cache_dir, 'tmp')
+        util.makedirs(tmp_dir)
+        return util.get_publish_tmp_path(os.path.join(tmp_dir, os.path.basename(cache_path)))
+
+    def _store_in_cache(self, hash, tmp_file):
+        """ Moves a checked download into the cache: small files are appended to a pack, and
+        others are published (read-only) at their cache path.
+        @returns The cache path, or None if packed. """
+        user_packs = self.package.project.user.packs
+        if user_packs.accepts(os.path.getsize(tmp_file)):
+            with open(tmp_file, 'rb') as f:
+                user_packs.add(hash.get_algo(), hash.get_value(), f.read())
+            os.remove(tmp_file)
+            return None
+        cache_path = self.package.get_hash_cache_path(hash, create_dir=True)
+        util.publish_file(tmp_file, cache_path)
+        return cache_path
+
+    def _find_in_bazel_caches(self, hash):
+        # Returns the path of a file with the same SHA-256 in Bazel's caches, or None.
+        value = hash.get_sha256()
+        if value is None:
+            return None
+        return self.package.project.user.bazel_caches.find(value)
+
+    def _import_from_bazel_cache(self, hash, path, tmp_file):
+        """ Links or copies a file found in Bazel's caches to `tmp_file`, and checks it against
+        `hash` (which Bazel does not do on read).
+        @returns True if successful; otherwise, the file should be downloaded. """
+        bazel_caches.link_or_copy(path, tmp_file)
+        if hash.check_file(tmp_file, do_throw=False):
+            metrics.add("bazel_cache_imports", remote=self.name)
+            metrics.add("bazel_cache_import_bytes", os.path.getsize(tmp_file), remote=self.name)
+            return True
+        util.eprint("WARNING: Ignoring file in Bazel cache with mismatching contents: {}".format(path))
+        os.remove(tmp_file)
+        return False
+
+    def _download_to_cache_path(self, hash, project_relpath, cache_path):
+        # Download (and check) into a temporary file in the cache directory, then publish it, so
+        # that a partial or corrupt file never appears at `cache_path`.
+        tmp_file = self._get_cache_tmp_path(cache_path)
+        try:
+            path = self._find_in_bazel_caches(hash)
+            if path is None or not self._import_from_bazel_cache(hash, path, tmp_file):
+                self.download_file_direct(hash, project_relpath, tmp_file)
+            return self._store_in_cache(hash, tmp_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def _check_cached(self, hash, cache_path):
+        """ Re-checks a cache entry (file or packed blob) against `hash`, and removes it if it
+        does not match.
+        @returns True if it matches. """
+        if os.path.isfile(cache_path):
+            ok = hash.check_file(cache_path, do_throw=False)
+            if not ok:
+                os.remove(cache_path)
+        else:
+            user_packs = self.package.project.user.packs
+            tmp_file = self._get_cache_tmp_path(cache_path)
+            try:
+                with open(tmp_file, 'wb') as f:
+                    f.write(user_packs.get(hash.get_algo(), hash.get_value()))
+                ok = hash.check_file(tmp_file, do_throw=False)
+            finally:
+                os.remove(tmp_file)
+            if not ok:
+                user_packs.remove(hash.get_algo(), hash.get_value())
+        if not ok:
+            metrics.add("cache_corruptions", remote=self.name)
+            util.eprint("Hash mismatch. Removing old cached file, re-downloading: {}".format(hash))
+        return ok
+
+    def download_to_cache(self, hash, project_relpath, check=False):
+        """ Ensures that a file is in the cache, without placing it anywhere else.
+        @param check
+            If true, an existing cache entry is re-checked (and re-downloaded if it does not
+            match), as with `download_file`. Otherwise, it is trusted.
+        @returns (cache_path, 'cached' or 'download'). `cache_path` is None if the file is stored
+            in a pack (see `User.packs`). """
+        cache_path = self.package.get_hash_cache_path(hash)
+        util.wait_file_read_lock(cache_path)
+        if self.package.is_hash_cached(hash) and (not check or self._check_cached(hash, cache_path)):
+            metrics.add("cache_hits", remote=self.name)
+            return (cache_path if os.path.isfile(cache_path) else None, 'cached')
+        metrics.add("cache_misses", remote=self.name)
+        return (self._download_to_cache_path(hash, project_relpath, cache_path), 'download')
+
+    def download_to_cache_async(self, hash, project_relpath):
+        """ Asynchronous `download_to_cache`.
+        @returns Future of (cache_path, 'cached' or 'download') """
+        cache_path = self.package.get_hash_cache_path(hash)
+        if self.package.is_hash_cached(hash):
+            metrics.add("cache_hits", remote=self.name)
+            return futures.completed((cache_path if os.path.isfile(cache_path) else None, 'cached'))
+        metrics.add("cache_misses", remote=self.name)
+        tmp_file = self._get_cache_tmp_path(cache_path)
+        def on_done(f):
+            try:
+                f.result()
+                return (self._store_in_cache(hash, tmp_file), 'download')
+            finally:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+        path = self._find_in_bazel_caches(hash)
+        if path is not None:
+            # Check off of the calling thread, and download if that fails.
+            def on_import(f):
+                if f.result():
+                    return None
+                return self.download_file_direct_async(hash, project_relpath, tmp_file)
+            fetched = futures.then(
+                futures.submit(self._import_from_bazel_cache, hash, path, tmp_file), on_import)
+        else:
+            fetched = self.download_file_direct_async(hash, project_relpath, tmp_file)
+        return futures.then(fetched, on_done)
+
+    def open_file(self, hash, project_relpath):
+        """ Opens a file for reading, without necessarily downloading all of it.
+        If the file is not cached, byte ranges are fetched on demand from the first remote in the
+        overlay chain whose backend supports ranges and has the file (see `remote_file.py`).
+        Otherwise (or if no such remote exists), the whole file is downloaded to the cache.
+        @returns A seekable, read-only binary file object. """
+        user = self.package.project.user
+        if not self.package.is_hash_cached(hash):
+            # Files in Bazel's caches are imported whole, rather than read remotely.
+            if self._find_in_bazel_caches(hash) is None:
+                for remote in self._get_chain():
+                    if not remote._backend.can_range:
+                        continue
+                    with profiling.span("Remote.get_size", remote=remote.name, hash=str(hash)):
+                        size = remote._backend.get_size(hash, project_relpath)
+                    if size is not None:
+                        return remote_file.RemoteFile(
+                            user.cache_dir, hash, size,
+                            fetch=lambda offset, count, remote=remote: remote._download_range(
+                                hash, project_relpath, offset, count),
+                            complete=lambda tmp_file: self._store_in_cache(hash, tmp_file),
+                            open_cached=lambda: self._open_cached(hash))
+            self.download_to_cache(hash, project_relpath)
+        return self._open_cached(hash)
+
+    def _open_cached(self, hash):
+        # Returns None if not cached.
+        cache_path = self.package.get_hash_cache_path(hash)
+        if os.path.isfile(cache_path):
+            return io.open(cache_path, 'rb')
+        data = self.package.project.user.packs.get(hash.get_algo(), hash.get_value())
+        if data is not None:
+            return io.BytesIO(data)
+        return None
+
+    def _download_range(self, hash, project_relpath, offset, size):
+        with profiling.span("Remote.download_range", remote=self.name, hash=str(hash)), \
+                metrics.Timer("download_seconds", remote=self.name):
+            data = self._transfers.run(
+                self._host,
+                lambda: self._backend.download_range(hash, project_relpath, offset, size))
+            self._transfers.throttle(len(data))
+        if len(data) != size:
+            raise util.DownloadError("Expected {} bytes at offset {} of {}, got {}".format(
+                size, offset, hash, len(data)))
+        metrics.add("range_requests", remote=self.name)
+        metrics.add("range_bytes", size, remote=self.name)
+        return data
+
     def upload_file(self, hash_type, project_relpath, filepath):
         """ Uploads a file (only if it does not already exist in this remote - NOT the backend),
         and updates the corresponding hash file. """
@@ -166,9 +652,39 @@ class Remote(object):
         if self._backend.has_file(hash, project_relpath):
             print("File already uploaded")
         else:
-            self._backend.upload_file(hash, project_relpath, filepath)
+            self._upload_file_direct(hash, project_relpath, filepath)
         return hash
 
+    def _upload_file_direct(self, hash, project_relpath, filepath):
+        size = os.path.getsize(filepath)
+        self._transfers.run(
+            self._host, lambda: self._backend.upload_file(hash, project_relpath, filepath),
+            size=size)
+        self._transfers.throttle(size)
+        metrics.add("uploads", remote=self.name)
+        metrics.add("upload_bytes", size, remote=self.name)
+
+    def upload_file_async(self, hash, project_relpath, filepath):
+        """ Asynchronously uploads a file with a known `hash`, without checking whether the backend
+        already has it (see `has_file_async(..., check_overlay=False)`), or updating its hash file.
+        @returns Future of None """
+        assert os.path.isabs(filepath)
+        if not self._backend.can_upload:
+            return futures.failed(RuntimeError("Backend does not support uploading"))
+        if self._transfers.has_rate():
+            return futures.submit(self._upload_file_direct, hash, project_relpath, filepath)
+        size = os.path.getsize(filepath)
+        def on_upload(f):
+            f.result()
+            metrics.add("uploads", remote=self.name)
+            metrics.add("upload_bytes", size, remote=self.name)
+        return futures.then(
+            self._transfers.run_async(
+                self._host,
+                lambda: self._backend.upload_file_async(hash, project_relpath, filepath),
+                size=size),
+            on_upload)
+
 
 class Package(object):
     """ Provides a hierarchy of remotes for incorporating data from multiple sources. """
@@ -198,8 +714,7 @@ class Package(object):
 
     def load_backend(self, backend_type, config):
         """ @see Project.load_backend """
-        backend_cls = self.project.get_backend_cls(backend_type)
-        return backend_cls(config, self)
+        return self.project.load_backend(backend_type, config, self)
 
     def _load_remote_impl(self, name, remote_config):
         assert name not in self._remotes
@@ -253,13 +768,17 @@ class Package(object):
         """ Get the cache path for a given hash file for the given package.
         Presently, this uses `Project.user.cache_dir`. """
         # TODO(eric.cousineau): Consider enabling multiple tiers of caching (for temporary stuff) according to remotes.
-        hash_algo = hash.get_algo()
-        hash_value = hash.get_value()
-        out_dir = os.path.join(
-            self.project.user.cache_dir, hash_algo, hash_value[0:2], hash_value[2:4])
-        if create_dir and not os.path.isdir(out_dir):
-            os.makedirs(out_dir)
-        return os.path.join(out_dir, hash_value)
+        out_file = get_cas_path(self.project.user.cache_dir, hash.get_algo(), hash.get_value())
+        out_dir = os.path.dirname(out_file)
+        if create_dir:
+            util.makedirs(out_dir)
+        return out_file
+
+    def is_hash_cached(self, hash):
+        """ Returns whether a hash is in the cache (as a file, or in a pack). """
+        if os.path.isfile(self.get_hash_cache_path(hash)):
+            return True
+        return self.project.user.packs.find(hash.get_algo(), hash.get_value()) is not None
 
 
 class User(object):
@@ -267,6 +786,33 @@ class User(object):
     def __init__(self, config):
         self.config = config
         self.cache_dir = os.path.expanduser(config['core']['cache_dir'])
+        # Existing packs are always read; new files are only packed if a threshold is set.
+        pack_threshold = config['core'].get('pack_threshold')
+        self.packs = packs.PackStore(
+            os.path.join(self.cache_dir, 'packs'),
+            util.parse_size(pack_threshold) if pack_threshold is not None else None)
+        # Shared by all remotes.
+        transfers_config = config['transfers']
+        limit_rate = transfers_config.get('limit_rate')
+        self.transfers = transfers.Scheduler(
+            max_per_host=transfers_config.get('max_connections_per_host'),
+            rate=util.parse_size(limit_rate) if limit_rate is not None else None)
+        bazel_caches_config = config['bazel_caches']
+        self.bazel_caches = bazel_caches.BazelCaches(
+            bazel_caches_config.get('repository_cache'), bazel_caches_config.get('disk_cache'))
+
+    def record_metrics_at_exit(self, command, start_time=None):
+        """ If enabled, appends the process-wide metrics to `{cache_dir}/metrics/` at exit (even if
+        the command fails).
+        @returns True if enabled. """
+        core_config = self.config['core']
+        if not core_config['record_metrics']:
+            return False
+        max_size = core_config.get('metrics_max_size')
+        atexit.register(
+            metrics.append, metrics.get_metrics_file(self.cache_dir), command, start_time,
+            util.parse_size(max_size) if max_size is not None else None)
+        return True
 
 
 class Project(object):
@@ -292,6 +838,9 @@ class Project(object):
         self._packages = {}
         self._root_package = None
 
+        # Backend instances, keyed by normalized configuration (see `load_backend`).
+        self._backend_instances = {}
+
     def init_root_package(self, package_config):
         """ Initializes the root package for a project.
         Must be called close to the project being initialized. """
@@ -300,6 +849,15 @@ class Project(object):
         config_file_rel = self.get_relpath(package_config['config_file'])
         self._packages[config_file_rel] = self._root_package
 
+    def load_root_remote(self, name=None):
+        """ Load a remote of the root package, for files identified by hash alone (with no file path
+        to find a package from).
+        @param name
+            Remote name, or None for the root package's selected remote. """
+        if name is None:
+            return self._root_package.remote
+        return self._root_package.load_remote(name)
+
     def debug_dump_user_config(self):
         """ Returns the user settings configuration. """
         return self.user.config
@@ -352,23 +910,42 @@ class Project(object):
         """ Load the backend of a given type. """
         return self._backends[backend_type]
 
+    def load_backend(self, backend_type, config, package):
+        """ Load a backend for a remote's configuration. For `shareable` backends, remotes (in any
+        package, including `file_overrides`) with equivalent backend configurations share one
+        instance, and thus its state (e.g. authentication, connections, and caches of queries).
+        @param package
+            Package of the remote. Shared instances get that of the first remote to load them. """
+        backend_config = dict(
+            (key, value) for key, value in config.items() if key not in REMOTE_ONLY_CONFIG_KEYS)
+        backend_cls = self.get_backend_cls(backend_type)
+        if not backend_cls.shareable:
+            return backend_cls(backend_config, package)
+        key = json.dumps(backend_config, sort_keys=True, default=str)
+        backend = self._backend_instances.get(key)
+        if backend is None:
+            backend = backend_cls(backend_config, package)
+            self._backend_instances[key] = backend
+        return backend
+
     def load_package(self, relpath):
         """ Load the package for the given filepath. """
-        config_files = _find_package_config_files(self, relpath)
-        package = None
-        for config_file in config_files:
-            config_file_rel = self.get_relpath(config_file)
-            parent = package
-            package = self._packages.get(config_file_rel)
-            if package is None:
-                # Parse the package config file.
-                config = config_helpers.parse_config_file(config_file)
-                # Load package.
-                parent_relpath = parent.get_relpath(os.path.dirname(config_file_rel))
-                # Create.
-                package = Package(config, self, parent, parent_relpath=parent_relpath)
-                self._packages[config_file_rel] = package
-        return package
+        with profiling.span("Project.load_package", relpath=relpath):
+            config_files = _find_package_config_files(self, relpath)
+            package = None
+            for config_file in config_files:
+                config_file_rel = self.get_relpath(config_file)
+                parent = package
+                package = self._packages.get(config_file_rel)
+                if package is None:
+                    # Parse the package config file.
+                    config = config_helpers.parse_config_file(config_file)
+                    # Load package.
+                    parent_relpath = parent.get_relpath(os.path.dirname(config_file_rel))
+                    # Create.
+                    package = Package(config, self, parent, parent_relpath=parent_relpath)
+                    self._packages[config_file_rel] = package
+            return package
 
     def load_remote(self, project_relpath):
         """ Load remote for a given file to either fetch or push a file """
@@ -381,6 +958,12 @@ class Project(object):
         """ Get file information for a given file (package, remote, default output, etc.). """
         return self._frontend.get_file_info(input_file, must_have_hash=must_have_hash)
 
+    def open_remote(self, filepath):
+        """ Opens a file, given its hash file (or original path), for reading, fetching only the
+        byte ranges that are read if possible. @see Remote.open_file """
+        info = self.get_file_info(os.path.abspath(filepath))
+        return info.remote.open_file(info.hash, info.project_relpath)
+
     def update_file_info(self, info, hash):
         self._frontend.update_file_info(info, hash)
 
@@ -390,6 +973,24 @@ class Project(object):
         assert os.path.isabs(input_file)
         return self._frontend.is_hash_file(input_file)
 
+    def find_hash_files(self, paths):
+        """ Find all hash files under the given files or directories (sorted, without duplicates).
+        Hidden directories and symlinked directories (e.g. `bazel-*`) are not traversed. """
+        hash_files = set()
+        for path in paths:
+            path = os.path.abspath(path)
+            if not os.path.isdir(path):
+                if self.is_hash_file(path):
+                    hash_files.add(path)
+                continue
+            for cur_dir, dirs, files in os.walk(path):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                for file in files:
+                    filepath = os.path.join(cur_dir, file)
+                    if self.is_hash_file(filepath):
+                        hash_files.add(filepath)
+        return sorted(hash_files)
+
 
 class Frontend(object):
     """ Determine how a project determines the hash for a given file. """
@@ -445,11 +1046,10 @@ class HashFileFrontend(Frontend):
             project_file = hash_orig_file
             orig_filepath = project_file
         else:
-            # Get default hash type.
-            hash_type = self._hash_type_default
+            # Use the hash type of an existing hash file, or the default.
+            hash_type = self._find_hash_type(input_file)
             hash_file = hash_type.get_hash_file(input_file)
             project_file = input_file
-        # TODO(eric.cousineau): Ensure that there are no other hash files for a given file???
         orig_filepath = input_file
         project_relpath = self.project.get_relpath(project_file)
         remote = package.load_remote_by_relpath(project_relpath)
@@ -472,23 +1072,22 @@ class HashFileFrontend(Frontend):
         assert hash.filepath == filepath
         hash.write_hash_file()
 
-    def get_hash_type(self, project_relpath):
+    def _find_hash_type(self, orig_file):
+        # Infer hash type from the hash files present next to the original file.
         hash_type = None
-        # Start checking through other hash types.
         for hash_type_cur in self._hash_types:
-            if hash_type == hash_type_cur:
-                continue
-            hash_relpath = hash_type_cur.get_hash_file(project_relpath)
-            hash_file = self.project.get_canonical_path(hash_relpath)
-            if os.path.exists(hash_file):
+            if os.path.exists(hash_type_cur.get_hash_file(orig_file)):
                 if hash_type is not None:
-                    raise RuntimeError("File has multiple hash files present: {}".format(project_relpath))
+                    raise RuntimeError("File has multiple hash files present: {}".format(orig_file))
                 hash_type = hash_type_cur
-        if hash_type is None and not return_none:
+        if hash_type is None:
             return self._hash_type_default
         else:
             return hash_type
 
+    def get_hash_type(self, project_relpath):
+        return self._find_hash_type(self.project.get_canonical_path(project_relpath))
+
 
 class FileInfo(object):
     def __init__(self, hash, remote, package, project_relpath, default_output_file, orig_filepath):
@@ -538,6 +1137,16 @@ def load_project(guess_filepath, project_name = None, user_config_in = None):
     @return A `Project` instance.
     @see test/bazel_external_data_config
     """
+    with profiling.span("load_project"):
+        return _load_project(guess_filepath, project_name, user_config_in)
+
+
+def load_user(user_config_in = None):
+    """ Load user configuration, merged with defaults.
+    @param user_config_in
+        Overload for user configuration. If None, `USER_CONFIG_FILE_DEFAULT` is used, if present.
+    @return A `User` instance.
+    """
     if user_config_in is None:
         # Can augment `user_config` with project-specific settings, if needed.
         if os.path.exists(USER_CONFIG_FILE_DEFAULT):
@@ -547,7 +1156,11 @@ def load_project(guess_filepath, project_name = None, user_config_in = None):
     else:
         user_config = user_config_in
     user_config = config_helpers.merge_config(USER_CONFIG_DEFAULT, user_config)
-    user = User(user_config)
+    return User(user_config)
+
+
+def _load_project(guess_filepath, project_name, user_config_in):
+    user = load_user(user_config_in)
 
     project_config = _load_project_config(guess_filepath, project_name)
 
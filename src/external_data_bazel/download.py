@@ -4,16 +4,17 @@ import os
 import yaml
 import argparse
 
-from external_data_bazel import core, util, config_helpers
+from external_data_bazel import core, util, config_helpers, stat_index
 
 # TODO(eric.cousineau): Make a `--quick` option to ignore checking SHAs, if the files are really large.
 
 def add_arguments(parser):
-    # TODO(eric.cousineau): Consider making this interpret inputs/outputs as pairs.
     parser.add_argument('-o', '--output', dest='output_file', type=str,
                         help='Output destination. If specified, only one input file may be provided.')
     parser.add_argument('input_files', type=str, nargs='+',
                         help='Files to be downloaded. If --output is not provided, the output destination is inferred from the input path.')
+    parser.add_argument('--pairs', action='store_true',
+                        help='Interpret `input_files` as (input, output) pairs. All files are resolved in one project load and downloaded concurrently (per --jobs).')
 
     parser.add_argument('-f', '--force', action='store_true',
                         help='Overwrite existing output file.')
@@ -25,34 +26,64 @@ def add_arguments(parser):
 
 
 def run(args, project):
-    good = True
+    # Record the hashes of downloaded workspace files, so that `status` need not re-hash them.
+    index = stat_index.load_index(project)
+    try:
+        return _run(args, project, index)
+    finally:
+        index.save()
+
+
+def _run(args, project, index):
     if args.output_file:
         if len(args.input_files) != 1:
             raise RuntimeError("Can only specify one input file with --output")
         input_file = os.path.abspath(args.input_files[0])
         info = project.get_file_info(input_file)
         output_file = os.path.abspath(args.output_file)
-        do_download(args, project, info, output_file)
+        do_download(args, project, info, output_file, index)
+        return True
+
+    if args.pairs:
+        if len(args.input_files) % 2 != 0:
+            raise RuntimeError("--pairs requires an even number of arguments: {}".format(args.input_files))
+        pairs = zip(args.input_files[0::2], args.input_files[1::2])
     else:
-        for input_file in args.input_files:
-            input_file = os.path.abspath(input_file)
-            info = project.get_file_info(input_file)
-            output_file = info.default_output_file
-            def action():
-                do_download(args, project, info, output_file)
-            if args.keep_going:
-                try:
-                    action()
-                except RuntimeError as e:
-                    good = False
-                    util.eprint(e)
-                    util.eprint("Continuing (--keep_going).")
+        pairs = [(input_file, None) for input_file in args.input_files]
+
+    good = True
+    # Resolve all files before downloading anything.
+    tasks = []
+    for input_file, output_file in pairs:
+        def resolve():
+            info = project.get_file_info(os.path.abspath(input_file))
+            if output_file is None:
+                tasks.append((info, info.default_output_file))
             else:
-                action()
+                tasks.append((info, os.path.abspath(output_file)))
+        good = util.keep_going(args.keep_going, resolve) and good
+
+    # Download files concurrently. Files which share a hash are deferred until the first one
+    # has populated the cache, so that the same blob is not downloaded into the cache twice.
+    first = []
+    rest = []
+    hashes_seen = set()
+    for task in tasks:
+        info = task[0]
+        if args.no_cache or info.hash not in hashes_seen:
+            hashes_seen.add(info.hash)
+            first.append(task)
+        else:
+            rest.append(task)
+    def download(task):
+        info, output_file = task
+        return util.keep_going(args.keep_going, lambda: do_download(args, project, info, output_file, index))
+    for batch in [first, rest]:
+        good = all(util.parallel_map(download, batch, args.jobs)) and good
     return good
 
 
-def do_download(args, project, info, output_file):
+def do_download(args, project, info, output_file, index=None):
     project_relpath = info.project_relpath
     remote = info.remote
 
@@ -77,3 +108,6 @@ def do_download(args, project, info, output_file):
         info.hash, project_relpath, output_file,
         use_cache=not args.no_cache,
         symlink=args.symlink)
+    # The output has been checked against the hash (on download, or when taken from the cache).
+    if index is not None and output_file == info.default_output_file:
+        stat_index.record_written(index, output_file, project_relpath, info.hash)
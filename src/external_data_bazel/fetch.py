@@ -0,0 +1,89 @@
+"""
+Fetches files by hash alone, e.g. for CMake/ExternalData, which knows only the algorithm and hash
+of each object. Files are fetched through the cache from the root package's remote (and its
+overlays), without any file path to discover packages from.
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+
+from external_data_bazel import util, hashes
+
+
+def add_arguments(parser):
+    parser.add_argument('items', type=str, nargs='*',
+                        help='(algo, hash, output) triples, e.g. `SHA512 <hash> /path/to/output`. Algorithm names are case-insensitive.')
+    parser.add_argument('--input', type=str, default=None,
+                        help="Read additional triples from this file ('-' for stdin), one per line, whitespace-separated.")
+    parser.add_argument('--remote', type=str, default=None,
+                        help="Remote of the root package to fetch from. Defaults to the root package's selected remote.")
+    parser.add_argument('--symlink', action='store_true',
+                        help='Use a symlink from the cache rather than copying the file.')
+
+
+def _read_items(args):
+    words = list(args.items)
+    if args.input is not None:
+        if args.input == '-':
+            words += sys.stdin.read().split()
+        else:
+            with open(args.input) as f:
+                words += f.read().split()
+    if len(words) % 3 != 0:
+        raise RuntimeError("Expected (algo, hash, output) triples, got {} words".format(len(words)))
+    return zip(words[0::3], words[1::3], words[2::3])
+
+
+def run(args, project):
+    good = True
+    remote = project.load_root_remote(args.remote)
+
+    tasks = []
+    for algo, value, output_file in _read_items(args):
+        def resolve():
+            hash_type = hashes.get_hash_type(algo.lower())
+            tasks.append((hash_type.create(value.lower()), os.path.abspath(output_file)))
+        good = util.keep_going(args.keep_going, resolve) and good
+
+    # Fetch each unique hash into the cache concurrently (per --jobs), then place the outputs.
+    unique = []
+    seen = set()
+    for hash, _ in tasks:
+        if hash not in seen:
+            seen.add(hash)
+            unique.append(hash)
+    fetches = dict((hash, remote.download_to_cache_async(hash, None)) for hash in unique)
+    failed = set()
+    # Hashes whose cache entries need no further check: those downloaded by this run (which were
+    # checked on download), and those already placed once.
+    checked = set()
+    for hash in unique:
+        def wait():
+            try:
+                _, status = fetches[hash].result()
+            except Exception:
+                failed.add(hash)
+                raise
+            if status == 'download':
+                checked.add(hash)
+        good = util.keep_going(args.keep_going, wait) and good
+
+    for hash, output_file in tasks:
+        if hash in failed:
+            continue
+        def place():
+            output_dir = os.path.dirname(output_file)
+            if not os.path.isdir(output_dir):
+                os.makedirs(output_dir)
+            if os.path.lexists(output_file):
+                os.remove(output_file)
+            if hash in checked:
+                remote.materialize_cached(hash, output_file, symlink=args.symlink)
+            else:
+                # Checks (and, if corrupt, re-downloads) the existing entry.
+                remote.download_file(hash, None, output_file, symlink=args.symlink)
+                checked.add(hash)
+        good = util.keep_going(args.keep_going, place) and good
+    return good
@@ -0,0 +1,318 @@
+import collections
+import subprocess
+import tempfile
+import threading
+import time
+
+# Minimal futures for asynchronous backend / remote operations.
+# (Python 2 has neither `asyncio` nor `concurrent.futures`.)
+#
+# There are two sources of futures:
+# * `submit` runs a blocking function on a shared thread pool. This is how synchronous backends
+#   are adapted, and how CPU-bound work (e.g. hashing) is moved off of callback threads.
+# * `run_process` starts a subprocess (e.g. `curl`), and completes when it exits. A single poller
+#   thread watches all processes, so hundreds of transfers may be in flight without a thread each.
+#
+# Continuations (`then`) run on whichever thread completes the future, and thus must not block;
+# blocking work should be returned as another future (e.g. via `submit`).
+#
+# Futures may be cancelled: pending work is skipped, running processes are killed, and
+# cancellation propagates through `then` to whichever stage is in progress. (A function already
+# running on the thread pool runs to completion, but its result is discarded.)
+
+
+class CancelledError(RuntimeError):
+    pass
+
+
+class Future(object):
+    """ The result of an asynchronous operation. """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._done = False
+        self._cancelled = False
+        self._value = None
+        self._error = None
+        self._callbacks = []
+        self._cancel_callbacks = []
+
+    def _finish(self, value, error):
+        with self._cond:
+            if self._done:
+                # Late completion of a cancelled operation.
+                assert self._cancelled, "Future already completed"
+                return
+            self._value = value
+            self._error = error
+            self._done = True
+            callbacks = self._callbacks
+            self._callbacks = []
+            self._cond.notify_all()
+        for callback in callbacks:
+            callback(self)
+
+    def set_result(self, value):
+        self._finish(value, None)
+
+    def set_exception(self, error):
+        self._finish(None, error)
+
+    def done(self):
+        with self._cond:
+            return self._done
+
+    def cancelled(self):
+        with self._cond:
+            return self._cancelled
+
+    def cancel(self):
+        """ Cancel the operation, if not yet done; the future then raises `CancelledError`.
+        @returns True if cancelled. """
+        with self._cond:
+            if self._done:
+                return False
+            self._cancelled = True
+            cancel_callbacks = self._cancel_callbacks
+            self._cancel_callbacks = []
+        for callback in cancel_callbacks:
+            callback()
+        self._finish(None, CancelledError())
+        return True
+
+    def add_cancel_callback(self, callback):
+        """ Call `callback()` if this future is cancelled. """
+        with self._cond:
+            if not self._done:
+                self._cancel_callbacks.append(callback)
+
+    def add_done_callback(self, callback):
+        """ Call `callback(self)` once done (immediately, if already done). """
+        with self._cond:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def exception(self):
+        """ Wait, and return the error (or None). """
+        with self._cond:
+            while not self._done:
+                # Use a timeout so that KeyboardInterrupt is handled.
+                self._cond.wait(1.)
+            return self._error
+
+    def result(self):
+        """ Wait, and return the value (or raise the error). """
+        error = self.exception()
+        if error is not None:
+            raise error
+        return self._value
+
+
+def completed(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def failed(error):
+    future = Future()
+    future.set_exception(error)
+    return future
+
+
+def then(future, func):
+    """ Chain `func(future)` to run once `future` is done.
+    @returns Future of the value returned by `func`. If `func` returns a Future, its result is
+        used instead (permitting asynchronous continuations). """
+    out = Future()
+    # The stage in progress, for cancellation.
+    current = [future]
+    out.add_cancel_callback(lambda: current[0].cancel())
+    def on_done(f):
+        if out.cancelled():
+            return
+        try:
+            value = func(f)
+        except Exception as e:
+            out.set_exception(e)
+            return
+        if isinstance(value, Future):
+            current[0] = value
+            if out.cancelled():
+                value.cancel()
+            value.add_done_callback(lambda inner: _forward(inner, out))
+        else:
+            out.set_result(value)
+    future.add_done_callback(on_done)
+    return out
+
+
+def _forward(src, dest):
+    error = src.exception()
+    if error is not None:
+        dest.set_exception(error)
+    else:
+        dest.set_result(src.result())
+
+
+def wait_all(futures):
+    """ Wait for all futures.
+    @returns List of results (raising the first error, in order). """
+    return [future.result() for future in futures]
+
+
+# Thread pool.
+_pool_lock = threading.Lock()
+_pool = None
+_max_workers = 8
+
+
+def set_max_workers(max_workers):
+    """ Set the number of threads for `submit` (only effective before first use). """
+    global _max_workers
+    _max_workers = max_workers
+
+
+def submit(func, *args, **kwargs):
+    """ Run `func` on the shared thread pool.
+    @returns Future of its result. """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from multiprocessing.pool import ThreadPool
+            _pool = ThreadPool(_max_workers)
+    future = Future()
+    def run():
+        if future.cancelled():
+            return
+        try:
+            value = func(*args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        future.set_result(value)
+    _pool.apply_async(run)
+    return future
+
+
+# Processes.
+class ProcessError(RuntimeError):
+    def __init__(self, cmd, returncode, stderr):
+        RuntimeError.__init__(self, "Command failed ({}): {}\n{}".format(returncode, cmd, stderr))
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class _ProcessPoller(object):
+    """ Starts processes (up to a limit) and completes their futures, from a single thread. """
+    def __init__(self, max_processes, interval=0.002):
+        self.max_processes = max_processes
+        self._interval = interval
+        self._cond = threading.Condition()
+        self._pending = collections.deque()
+        self._running = []
+        self._thread = None
+
+    def submit(self, cmd):
+        future = Future()
+        with self._cond:
+            self._pending.append((cmd, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="futures.ProcessPoller")
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def _start_pending(self):
+        # Requires `_cond`.
+        started = []
+        while self._pending and len(self._running) < self.max_processes:
+            cmd, future = self._pending.popleft()
+            if future.cancelled():
+                continue
+            # Buffer outputs in files, so that processes never block on a full pipe.
+            stdout = tempfile.TemporaryFile()
+            stderr = tempfile.TemporaryFile()
+            try:
+                process = subprocess.Popen(
+                    cmd, shell=isinstance(cmd, str), stdout=stdout, stderr=stderr)
+            except OSError as e:
+                stdout.close()
+                stderr.close()
+                started.append((future, e))
+                continue
+            self._running.append((cmd, process, stdout, stderr, future))
+        return started
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._running:
+                    self._cond.wait()
+                failed_to_start = self._start_pending()
+                running = list(self._running)
+            for future, error in failed_to_start:
+                future.set_exception(error)
+            for cmd, process, stdout, stderr, future in running:
+                if future.cancelled() and process.returncode is None:
+                    try:
+                        process.kill()
+                    except OSError:
+                        # Already exited.
+                        pass
+            finished = [item for item in running if item[1].poll() is not None]
+            if finished:
+                with self._cond:
+                    for item in finished:
+                        self._running.remove(item)
+                for cmd, process, stdout, stderr, future in finished:
+                    stdout.seek(0)
+                    stderr.seek(0)
+                    out, err = stdout.read(), stderr.read()
+                    stdout.close()
+                    stderr.close()
+                    if process.returncode != 0:
+                        future.set_exception(ProcessError(cmd, process.returncode, err))
+                    else:
+                        future.set_result(out)
+            else:
+                time.sleep(self._interval)
+
+
+_poller = _ProcessPoller(max_processes=64)
+
+
+def set_max_processes(max_processes):
+    """ Set the maximum number of processes run concurrently by `run_process`. """
+    _poller.max_processes = max_processes
+
+
+def run_process(cmd):
+    """ Run a command asynchronously.
+    @returns Future of its stdout; raises `ProcessError` on a non-zero exit code. """
+    return _poller.submit(cmd)
+
+
+if __name__ == '__main__':
+    assert submit(lambda x: x + 1, 1).result() == 2
+    assert then(completed(1), lambda f: submit(lambda: f.result() * 10)).result() == 10
+    assert isinstance(then(completed(1), lambda f: 1 / 0).exception(), ZeroDivisionError)
+    assert run_process(['echo', 'hi']).result().strip() == b'hi'
+    assert isinstance(run_process(['false']).exception(), ProcessError)
+    assert isinstance(run_process(['/nonexistent']).exception(), OSError)
+    # Cancellation kills processes, and propagates through `then`.
+    start = time.time()
+    chained = then(run_process(['sleep', '10']), lambda f: 1)
+    time.sleep(0.1)
+    assert chained.cancel()
+    assert isinstance(chained.exception(), CancelledError)
+    run_process(['true']).result()
+    assert time.time() - start < 2
+    # Many processes in flight, driven by one thread.
+    start = time.time()
+    wait_all([run_process(['sleep', '0.5']) for i in range(50)])
+    assert time.time() - start < 2.5
+    print("[ Done ]")
@@ -1,5 +1,10 @@
+import hashlib
+import multiprocessing
 import os
-from external_data_bazel import util
+import re
+import struct
+
+from external_data_bazel import util, profiling, metrics
 
 # TODO(eric.cousineau): `HashType` and `Hash` interfaces are too tightly bound to
 # `HashFileFrontend`. Delegate these mechanisms back.
@@ -21,6 +26,11 @@ class HashType(object):
         """ Return a type that can be compared via == (e.g. a string, or tuple (for size + sha)). """
         raise NotImplemented
 
+    def create_hasher(self):
+        """ Return an incremental hasher (with `update(data)` and `hexdigest()`), so that data can be
+        hashed as it arrives, or None if not supported. """
+        return None
+
     def create(self, value, filepath=None):
         return Hash(self, value, filepath=filepath)
 
@@ -41,12 +51,21 @@ class HashType(object):
         orig_file = self.get_orig_file(hash_file)
         assert orig_file is not None
         value = self.do_read_file(hash_file)
-        return self.create(value, filepath="hash_file[{}]".format(hash_file))
+        hash = self.create(value, filepath="hash_file[{}]".format(hash_file))
+        hash.secondary = _read_secondary(get_secondary_file(orig_file))
+        return hash
 
     def write_file(self, hash_file, hash):
         value = hash.get_value()
         with open(hash_file, 'w') as f:
             f.write(value + "\n")
+        secondary_file = get_secondary_file(self.get_orig_file(hash_file))
+        if hash.secondary is not None:
+            with open(secondary_file, 'w') as f:
+                f.write(hash.secondary.get_value() + "\n")
+        elif os.path.exists(secondary_file):
+            # Stale.
+            os.remove(secondary_file)
 
     def do_read_file(self, hash_file):
         """ Read contents from a file. """
@@ -61,12 +80,39 @@ class HashType(object):
         return "hash[{}]".format(self.name)
 
 
+# Suffix of the optional file (next to the hash file) which records a secondary SHA-256 digest (see
+# `Hash.secondary`). Hash files themselves hold only their value, since older versions of this tool
+# and CMake/ExternalData read the whole file. This is not a hash file suffix, so the file is
+# neither taken for a hash file nor globbed by `tools/macros.bzl`.
+SECONDARY_SUFFIX = '.secondary_sha256'
+
+_SHA256_REGEX = re.compile(r"^[0-9a-f]{64}$")
+
+
+def get_secondary_file(orig_file):
+    return orig_file + SECONDARY_SUFFIX
+
+
+def _read_secondary(secondary_file):
+    if not os.path.exists(secondary_file):
+        return None
+    with open(secondary_file) as f:
+        value = f.read().strip()
+    if not _SHA256_REGEX.match(value):
+        raise RuntimeError("Invalid secondary SHA-256 file: {}".format(secondary_file))
+    return sha256.create(value)
+
+
 class Hash(object):
     """ Store hash value, type, and possibly the filepath the hash was generated from. """
     def __init__(self, hash_type, value, filepath=None):
         self.hash_type = hash_type
         self.filepath = filepath
         self._value = value
+        # Optional SHA-256 of the same contents, recorded next to the hash file (see
+        # `SECONDARY_SUFFIX`), so that the file can be found in Bazel's caches (see
+        # `bazel_caches.py`). Not part of the hash's identity.
+        self.secondary = None
 
     def compute(self, filepath):
         # Compute hash for a filepath, using the same type as this hash.
@@ -80,7 +126,13 @@ class Hash(object):
                 raise RuntimeError("Hash mismatch: {} != {}".format(self.full_str(), other_hash.full_str()))
 
     def check_file(self, filepath, do_throw=True):
-        return self.check(self.compute(filepath), do_throw=do_throw)
+        algo = self.get_algo()
+        with profiling.span("Hash.check_file", algo=algo), \
+                metrics.Timer("hash_check_seconds", algo=algo):
+            hash = self.compute(filepath)
+        metrics.add("hash_checks", algo=algo)
+        metrics.add("hash_check_bytes", os.path.getsize(filepath), algo=algo)
+        return self.check(hash, do_throw=do_throw)
 
     def has_value(self):
         return self._value is not None
@@ -91,6 +143,14 @@ class Hash(object):
     def get_algo(self):
         return self.hash_type.name
 
+    def get_sha256(self):
+        """ Returns the SHA-256 value of the contents, if known (this hash or its secondary). """
+        if self.hash_type == sha256:
+            return self.get_value()
+        elif self.secondary is not None:
+            return self.secondary.get_value()
+        return None
+
     def write_hash_file(self):
         assert self.has_value()
         # This *has* to have been computed from a file.
@@ -120,7 +180,21 @@ class Hash(object):
         return out
 
 
-class Sha512(HashType):
+class SuffixHashType(HashType):
+    """ Hash type whose hash file is the original file with a suffix appended. """
+    _SUFFIX = None
+
+    def get_hash_file(self, orig_file):
+        return orig_file + self._SUFFIX
+
+    def get_orig_file(self, hash_file):
+        if not hash_file.endswith(self._SUFFIX):
+            return None
+        else:
+            return hash_file[:-len(self._SUFFIX)]
+
+
+class Sha512(SuffixHashType):
     _SUFFIX = '.sha512'
 
     def __init__(self):
@@ -130,18 +204,123 @@ class Sha512(HashType):
         value = util.subshell(['sha512sum', filepath]).split(' ')[0]
         return value
 
-    def get_hash_file(self, orig_file):
-        return orig_file + self._SUFFIX
+    def create_hasher(self):
+        return hashlib.sha512()
+
+
+class _TreeHasher(object):
+    """ Incremental (single-threaded) version of `Sha512Tree.do_compute`. """
+    def __init__(self, chunk_size):
+        self._chunk_size = chunk_size
+        self._digests = []
+        self._size = 0
+        self._reset_chunk()
+
+    def _reset_chunk(self):
+        self._chunk = hashlib.sha512()
+        self._chunk.update(b'\x00')
+        self._chunk_len = 0
+
+    def update(self, data):
+        self._size += len(data)
+        while data:
+            take = min(len(data), self._chunk_size - self._chunk_len)
+            self._chunk.update(data[:take])
+            self._chunk_len += take
+            data = data[take:]
+            if self._chunk_len == self._chunk_size:
+                self._digests.append(self._chunk.digest())
+                self._reset_chunk()
+
+    def hexdigest(self):
+        digests = list(self._digests)
+        if self._chunk_len > 0 or not digests:
+            digests.append(self._chunk.digest())
+        hasher = hashlib.sha512()
+        hasher.update(b'\x01')
+        hasher.update(struct.pack('>Q', self._size))
+        for digest in digests:
+            hasher.update(digest)
+        return hasher.hexdigest()
+
+
+class Sha512Tree(SuffixHashType):
+    """ Tree hash which may be computed on multiple cores.
+    The file is split into fixed-size chunks, each of which is hashed (concurrently) with SHA-512.
+    The value is the SHA-512 of the file size and the chunk digests, in order.
+    The chunk size is part of the definition, so the value does not depend on the number of cores. """
+    _SUFFIX = '.sha512_tree'
+    CHUNK_SIZE = 8 * 1024 * 1024
+    _READ_SIZE = 1024 * 1024
+
+    def __init__(self, jobs=None):
+        HashType.__init__(self, 'sha512_tree')
+        if jobs is None:
+            jobs = multiprocessing.cpu_count()
+        self.jobs = jobs
+
+    def _hash_chunk(self, filepath, index):
+        hasher = hashlib.sha512()
+        # Distinguish leaves from the root.
+        hasher.update(b'\x00')
+        with open(filepath, 'rb') as f:
+            f.seek(index * self.CHUNK_SIZE)
+            remaining = self.CHUNK_SIZE
+            while remaining > 0:
+                data = f.read(min(self._READ_SIZE, remaining))
+                if not data:
+                    break
+                # `hashlib` releases the GIL for large updates, so threads hash in parallel.
+                hasher.update(data)
+                remaining -= len(data)
+        return hasher.digest()
+
+    def do_compute(self, filepath):
+        size = os.path.getsize(filepath)
+        num_chunks = max(1, (size + self.CHUNK_SIZE - 1) // self.CHUNK_SIZE)
+        digests = util.parallel_map(
+            lambda index: self._hash_chunk(filepath, index), range(num_chunks), self.jobs)
+        hasher = hashlib.sha512()
+        hasher.update(b'\x01')
+        hasher.update(struct.pack('>Q', size))
+        for digest in digests:
+            hasher.update(digest)
+        return hasher.hexdigest()
+
+    def create_hasher(self):
+        return _TreeHasher(self.CHUNK_SIZE)
+
+
+class Sha256(SuffixHashType):
+    """ SHA-256, for backends which address files by it (e.g. Git LFS object ids). """
+    _SUFFIX = '.sha256'
+
+    def __init__(self):
+        HashType.__init__(self, 'sha256')
+
+    def do_compute(self, filepath):
+        value = util.subshell(['sha256sum', filepath]).split(' ')[0]
+        return value
+
+    def create_hasher(self):
+        return hashlib.sha256()
 
-    def get_orig_file(self, hash_file):
-        if not hash_file.endswith(self._SUFFIX):
-            return None
-        else:
-            return hash_file[:-len(self._SUFFIX)]
 
 sha512 = Sha512()
+sha512_tree = Sha512Tree()
+sha256 = Sha256()
+
+# The first hash type is the default for new files.
+hash_types = [sha512, sha512_tree, sha256]
+
+
+def get_hash_type(name):
+    """ Get a hash type by its name (e.g. 'sha512'). """
+    for hash_type in hash_types:
+        if hash_type.name == name:
+            return hash_type
+    raise RuntimeError("Unknown hash type: {}".format(name))
 
-hash_types = [sha512]
 
 if __name__ == "__main__":
     tmp_file = '/tmp/test_hash_file'
@@ -169,3 +348,44 @@ if __name__ == "__main__":
     except RuntimeError as e:
         print(e)
     assert hash != hash_bad
+
+    # Tree hash: Should not depend on the number of jobs, and should differ from SHA-512.
+    tree_hash = sha512_tree.compute(tmp_file)
+    assert Sha512Tree(jobs=1).compute(tmp_file).get_value() == tree_hash.get_value()
+    assert tree_hash != hash
+    print(tree_hash)
+    tmp_file_large = '/tmp/test_hash_file_large'
+    with open(tmp_file_large, 'wb') as f:
+        for i in range(5):
+            f.write(os.urandom(Sha512Tree.CHUNK_SIZE // 2))
+    tree_value = sha512_tree.compute(tmp_file_large).get_value()
+    assert Sha512Tree(jobs=1).compute(tmp_file_large).get_value() == tree_value
+    assert sha512_tree.get_orig_file('/tmp/file.sha512_tree') == '/tmp/file'
+    # Incremental hashers should match (with uneven updates).
+    for hash_type in hash_types:
+        for filepath in [tmp_file, tmp_file_large]:
+            hasher = hash_type.create_hasher()
+            with open(filepath, 'rb') as f:
+                while True:
+                    data = f.read(3 * 1024 * 1024 + 7)
+                    if not data:
+                        break
+                    hasher.update(data)
+            assert hasher.hexdigest() == hash_type.compute(filepath).get_value()
+    assert sha512.get_orig_file('/tmp/file.sha512_tree') is None
+    assert sha256.compute(tmp_file).get_value() == hashlib.sha256(b'Example contents\n').hexdigest()
+    # Secondary digests round-trip (without changing the hash file), and do not affect identity.
+    hash_file = sha512.get_hash_file(tmp_file)
+    hash.secondary = sha256.compute(tmp_file)
+    hash.write_hash_file()
+    with open(hash_file) as f:
+        assert f.read() == value_expected + "\n"
+    hash_read = sha512.read_file(hash_file)
+    assert hash_read == hash and hash_read.get_value() == value_expected
+    assert hash_read.get_sha256() == hash.secondary.get_value()
+    hash.secondary = None
+    hash.write_hash_file()
+    assert sha512.read_file(hash_file).get_sha256() is None
+    assert not os.path.exists(get_secondary_file(tmp_file))
+    os.remove(hash_file)
+    os.remove(tmp_file_large)
@@ -0,0 +1,211 @@
+import json
+import os
+import threading
+import time
+
+from external_data_bazel import util
+
+# Counters and timings accumulated over a process (cache hits, bytes transferred per remote,
+# overlay fallbacks, hashing time, etc.).
+# If enabled (`core: {record_metrics: true}`), the CLI appends the counters of each invocation as
+# one JSON line to `{cache_dir}/metrics/metrics.jsonl`; `cli.py stats` aggregates them. Once that
+# file exceeds `metrics_max_size`, it is rotated to `metrics.jsonl.1` (replacing any older one).
+# Counters are always accumulated in-process (this is cheap); they are only written if
+# requested.
+
+METRICS_FILE_RELPATH = os.path.join('metrics', 'metrics.jsonl')
+
+# Metric descriptions, used for summaries and for Prometheus `# HELP` lines.
+DESCRIPTIONS = {
+    "invocations": "Number of recorded invocations.",
+    "cache_hits": "Files materialized from the user cache.",
+    "cache_misses": "Files downloaded because they were not in the user cache.",
+    "cache_corruptions": "Cached files that failed their hash check and were re-downloaded.",
+    "cache_entries_verified": "Cache entries re-hashed by `cache verify`.",
+    "cache_entries_quarantined": "Cache entries moved to quarantine by `cache verify`.",
+    "downloads": "Files successfully downloaded from a remote.",
+    "download_bytes": "Bytes successfully downloaded from a remote.",
+    "download_seconds": "Time spent downloading from a remote (including failed attempts).",
+    "download_errors": "Failed downloads from a remote.",
+    "overlay_fallbacks": "Downloads that fell back from a remote to its overlay.",
+    "has_file_queries": "Queries for whether a remote has a file.",
+    "probe_winners": "Remotes chosen by parallel probing of an overlay chain.",
+    "range_requests": "Byte ranges fetched from a remote for partial reads.",
+    "range_bytes": "Bytes fetched from a remote for partial reads.",
+    "transfer_wait_seconds": "Time transfers waited for a connection slot to their host.",
+    "transfer_throttle_seconds": "Time transfers were delayed by the bandwidth cap.",
+    "bazel_cache_imports": "Files taken from Bazel's repository or disk caches rather than downloaded.",
+    "bazel_cache_import_bytes": "Bytes taken from Bazel's repository or disk caches rather than downloaded.",
+    "bazel_cache_exports": "Files published into Bazel's repository or disk caches by `cache export`.",
+    "uploads": "Files uploaded to a remote.",
+    "upload_bytes": "Bytes uploaded to a remote.",
+    "chunks_fetched": "Chunks downloaded into the local chunk cache.",
+    "chunk_bytes_fetched": "Bytes of chunks downloaded into the local chunk cache.",
+    "chunks_uploaded": "Chunks uploaded to a chunked store.",
+    "chunk_bytes_uploaded": "Bytes of chunks uploaded to a chunked store.",
+    "chunks_reused": "Chunks that did not need to be transferred.",
+    "hash_checks": "Files hashed to verify their contents.",
+    "hash_check_bytes": "Bytes hashed to verify file contents.",
+    "hash_check_seconds": "Time spent hashing to verify file contents.",
+    "command_seconds": "Wall time of invocations.",
+}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+class Metrics(object):
+    """ Thread-safe set of counters, each identified by a name and a set of labels. """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def add(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def merge(self, entries):
+        """ Add entries, as produced by `to_entries`. """
+        for name, labels, value in entries:
+            self.add(name, value, **labels)
+
+    def to_entries(self):
+        """ @returns Sorted list of [name, labels, value]. """
+        with self._lock:
+            items = sorted(self._counters.items())
+        return [[name, dict(labels), value] for (name, labels), value in items]
+
+    def get(self, name, **labels):
+        with self._lock:
+            return self._counters.get(_key(name, labels), 0)
+
+    def sum_by(self, name, label):
+        """ @returns Dictionary of `label` value to the total of counter `name`. """
+        out = {}
+        for entry_name, labels, value in self.to_entries():
+            if entry_name == name:
+                key = labels.get(label)
+                out[key] = out.get(key, 0) + value
+        return out
+
+    def total(self, name):
+        return sum(self.sum_by(name, None).values())
+
+
+_metrics = Metrics()
+
+
+def add(name, value=1, **labels):
+    """ Add to a process-wide counter. """
+    _metrics.add(name, value, **labels)
+
+
+def get_metrics():
+    return _metrics
+
+
+class Timer(object):
+    """ Context manager adding the elapsed time (in seconds) to a counter. """
+    def __init__(self, name, **labels):
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.time()
+
+    def __exit__(self, *args):
+        add(self._name, time.time() - self._start, **self._labels)
+
+
+def get_metrics_file(cache_dir):
+    return os.path.join(cache_dir, METRICS_FILE_RELPATH)
+
+
+def get_rotated_files(metrics_file):
+    """ @returns The files holding records, oldest first. """
+    return [metrics_file + ".1", metrics_file]
+
+
+def _rotate(metrics_file, max_size):
+    try:
+        if os.path.getsize(metrics_file) < max_size:
+            return
+        os.rename(metrics_file, get_rotated_files(metrics_file)[0])
+    except OSError:
+        # Not yet written, or rotated concurrently.
+        pass
+
+
+def append(metrics_file, command, start_time=None, max_size=None):
+    """ Append the process-wide counters, as a single record, to `metrics_file`.
+    @param max_size
+        If not None, `metrics_file` is first rotated if it has at least this many bytes. """
+    now = time.time()
+    record = {
+        "time": now,
+        "command": command,
+        "counters": _metrics.to_entries(),
+    }
+    if start_time is not None:
+        record["counters"].append(["command_seconds", {"command": command}, now - start_time])
+    util.makedirs(os.path.dirname(metrics_file))
+    # Write the record in one call, in append mode, so that concurrent invocations (e.g. under
+    # Bazel) do not interleave lines.
+    if max_size is not None:
+        _rotate(metrics_file, max_size)
+    line = json.dumps(record, sort_keys=True) + "\n"
+    fd = os.open(metrics_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode('utf-8'))
+    finally:
+        os.close(fd)
+
+
+def load(metrics_file, since=None):
+    """ Aggregate records in `metrics_file` (and its rotated file).
+    @param since
+        If not None, only records at or after this time (seconds since epoch) are included.
+    @returns (Metrics, number of records) """
+    out = Metrics()
+    count = 0
+    for filepath in get_rotated_files(metrics_file):
+        if not os.path.exists(filepath):
+            continue
+        with open(filepath) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Skip truncated lines (e.g. from a killed process).
+                    continue
+                if since is not None and record["time"] < since:
+                    continue
+                out.add("invocations", command=record["command"])
+                out.merge(record["counters"])
+                count += 1
+    return out, count
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def to_prometheus(metrics, prefix="external_data_"):
+    """ Format counters in the Prometheus text exposition format. """
+    lines = []
+    prev_name = None
+    for name, labels, value in metrics.to_entries():
+        full_name = prefix + name + "_total"
+        if name != prev_name:
+            if name in DESCRIPTIONS:
+                lines.append("# HELP {} {}".format(full_name, DESCRIPTIONS[name]))
+            lines.append("# TYPE {} counter".format(full_name))
+            prev_name = name
+        label_str = ",".join(
+            '{}="{}"'.format(k, _escape_label(v)) for k, v in sorted(labels.items()))
+        if label_str:
+            label_str = "{" + label_str + "}"
+        lines.append("{}{} {}".format(full_name, label_str, repr(float(value))))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,228 @@
+import binascii
+import errno
+import mmap
+import os
+import re
+import struct
+import threading
+
+from external_data_bazel import util
+
+# Append-only pack files for small blobs in the user cache, so that projects with many small files
+# do not need one file (and inode) per blob.
+#
+# Layout under `{cache_dir}/packs/`:
+#   pack-{id}.pack  Concatenated blob contents. Only ever appended to; a new pack is started once
+#                   the current one reaches `PACK_MAX_SIZE`.
+#   index/{xx}      Fixed-size records, sharded by the first byte of the hash (`xx`), mapping
+#                   (algo, digest) to (pack id, offset, size). The last record for a key wins.
+#   lock            Serializes writers (across processes) with `flock`.
+#
+# Contents are written and flushed to disk before their index record is appended, so readers
+# (which take no lock) only see complete blobs. A record with `TOMBSTONE` as its pack id removes
+# an entry (e.g. if it was found to be corrupt).
+
+PACK_MAX_SIZE = 256 * 1024 * 1024
+TOMBSTONE = 0xffffffff
+
+# Stable ids for each algorithm (do not reorder).
+ALGO_IDS = {
+    'sha512': 1,
+    'sha512_tree': 2,
+    'sha256': 3,
+}
+_ALGO_NAMES = dict((value, key) for key, value in ALGO_IDS.items())
+# Digest sizes, in bytes; digests are zero-padded to `_DIGEST_SIZE` in records.
+DIGEST_SIZES = {
+    'sha512': 64,
+    'sha512_tree': 64,
+    'sha256': 32,
+}
+
+_DIGEST_SIZE = 64
+# algo id, digest (zero-padded), pack id, offset, size
+_RECORD = struct.Struct('>B64sIQI')
+_LOCATION = struct.Struct('>IQI')
+_KEY_SIZE = 1 + _DIGEST_SIZE
+_PACK_REGEX = re.compile(r"^pack-(\d+)\.pack$")
+
+
+def _encode_key(algo, value):
+    digest = binascii.unhexlify(value)
+    assert len(digest) == DIGEST_SIZES[algo]
+    return struct.pack('>B64s', ALGO_IDS[algo], digest)
+
+
+def _decode_value(algo, digest):
+    return binascii.hexlify(digest[:DIGEST_SIZES[algo]])
+
+
+class PackStore(object):
+    """ Stores blobs of at most `threshold` bytes in pack files under `root_dir`. """
+    def __init__(self, root_dir, threshold=None):
+        self.root_dir = root_dir
+        self.threshold = threshold
+        self._index_dir = os.path.join(root_dir, 'index')
+        self._lock = threading.Lock()
+        # Pack file -> mmap, reused across reads (and remapped as the pack grows).
+        self._maps = {}
+
+    def accepts(self, size):
+        """ Returns whether a blob of `size` bytes should be stored in a pack. """
+        return self.threshold is not None and size <= self.threshold
+
+    def _get_pack_path(self, pack_id):
+        return os.path.join(self.root_dir, 'pack-{:06d}.pack'.format(pack_id))
+
+    def _get_index_path(self, value):
+        return os.path.join(self._index_dir, value[0:2])
+
+    def _read_index(self, index_path):
+        try:
+            with open(index_path, 'rb') as f:
+                data = f.read()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return b''
+            raise
+        # Ignore a trailing partial record (e.g. from a process killed mid-write).
+        return data[:len(data) - len(data) % _RECORD.size]
+
+    def find(self, algo, value):
+        """ @returns (pack file, offset, size), or None if not present. """
+        if algo not in ALGO_IDS or len(value) != 2 * DIGEST_SIZES[algo]:
+            return None
+        key = _encode_key(algo, value)
+        data = self._read_index(self._get_index_path(value))
+        end = len(data)
+        while True:
+            pos = data.rfind(key, 0, end)
+            if pos < 0:
+                return None
+            if pos % _RECORD.size == 0:
+                break
+            end = pos + _KEY_SIZE - 1
+        _, _, pack_id, offset, size = _RECORD.unpack_from(data, pos)
+        if pack_id == TOMBSTONE:
+            return None
+        return (self._get_pack_path(pack_id), offset, size)
+
+    def _get_map(self, pack_file, end):
+        with self._lock:
+            m = self._maps.get(pack_file)
+            if m is None or len(m) < end:
+                if m is not None:
+                    m.close()
+                with open(pack_file, 'rb') as f:
+                    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[pack_file] = m
+            return m
+
+    def get(self, algo, value):
+        """ @returns Contents of a blob, or None if not present. """
+        location = self.find(algo, value)
+        if location is None:
+            return None
+        pack_file, offset, size = location
+        if size == 0:
+            # The pack may itself be empty, which cannot be mapped.
+            return b''
+        return self._get_map(pack_file, offset + size)[offset:offset + size]
+
+    def _append_record(self, value, record):
+        # Requires the write lock.
+        if not os.path.isdir(self._index_dir):
+            os.makedirs(self._index_dir)
+        # A single write in append mode, so that records are never interleaved.
+        fd = os.open(self._get_index_path(value), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, record)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _write_lock(self):
+        util.makedirs(self.root_dir)
+        return util.FileLock(os.path.join(self.root_dir, 'lock'))
+
+    def _get_current_pack(self, size):
+        # Requires the write lock.
+        pack_ids = [int(m.group(1)) for m in map(_PACK_REGEX.match, os.listdir(self.root_dir)) if m]
+        pack_id = max(pack_ids) if pack_ids else 0
+        pack_file = self._get_pack_path(pack_id)
+        if os.path.exists(pack_file) and os.path.getsize(pack_file) + size > PACK_MAX_SIZE:
+            pack_id += 1
+        return pack_id
+
+    def add(self, algo, value, data):
+        """ Appends a blob (whose contents should already have been checked). """
+        with self._write_lock():
+            pack_id = self._get_current_pack(len(data))
+            with open(self._get_pack_path(pack_id), 'ab') as f:
+                offset = os.fstat(f.fileno()).st_size
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            location = _LOCATION.pack(pack_id, offset, len(data))
+            self._append_record(value, _encode_key(algo, value) + location)
+
+    def remove(self, algo, value):
+        """ Removes a blob from the index (its contents remain in the pack). """
+        with self._write_lock():
+            self._append_record(value, _encode_key(algo, value) + _LOCATION.pack(TOMBSTONE, 0, 0))
+
+    def iter_entries(self):
+        """ @returns Generator of (algo, value, pack file, offset, size) for each current blob. """
+        if not os.path.isdir(self._index_dir):
+            return
+        for shard in sorted(os.listdir(self._index_dir)):
+            data = self._read_index(os.path.join(self._index_dir, shard))
+            latest = {}
+            for pos in range(0, len(data), _RECORD.size):
+                algo_id, digest, pack_id, offset, size = _RECORD.unpack_from(data, pos)
+                latest[(algo_id, digest)] = (pack_id, offset, size)
+            for (algo_id, digest), (pack_id, offset, size) in sorted(latest.items()):
+                if pack_id == TOMBSTONE or algo_id not in _ALGO_NAMES:
+                    continue
+                algo = _ALGO_NAMES[algo_id]
+                yield (algo, _decode_value(algo, digest), self._get_pack_path(pack_id), offset, size)
+
+
+if __name__ == '__main__':
+    import hashlib
+    import shutil
+    import tempfile
+
+    root_dir = tempfile.mkdtemp()
+    try:
+        # An empty blob, alone in its pack.
+        store = PackStore(os.path.join(root_dir, 'empty'), threshold=1024)
+        empty_value = hashlib.sha512(b'').hexdigest()
+        store.add('sha512', empty_value, b'')
+        assert store.get('sha512', empty_value) == b''
+        assert PackStore(os.path.join(root_dir, 'empty')).get('sha512', empty_value) == b''
+
+        store = PackStore(root_dir, threshold=1024)
+        blobs = [os.urandom(n) for n in [0, 1, 100, 1024]]
+        values = [hashlib.sha512(blob).hexdigest() for blob in blobs]
+        assert store.get('sha512', values[0]) is None
+        for blob, value in zip(blobs, values):
+            assert store.accepts(len(blob))
+            store.add('sha512', value, blob)
+        assert not store.accepts(1025)
+        for blob, value in zip(blobs, values):
+            assert store.get('sha512', value) == blob
+        # Removal, and re-adding (e.g. after corruption).
+        store.remove('sha512', values[2])
+        assert store.get('sha512', values[2]) is None
+        assert len(list(store.iter_entries())) == len(blobs) - 1
+        store.add('sha512', values[2], blobs[2])
+        assert store.get('sha512', values[2]) == blobs[2]
+        assert sorted(entry[1] for entry in store.iter_entries()) == sorted(values)
+        # Other algorithms are separate keys.
+        assert store.get('sha512_tree', values[1]) is None
+        # New readers see the same contents.
+        assert PackStore(root_dir).get('sha512', values[3]) == blobs[3]
+    finally:
+        shutil.rmtree(root_dir)
+    print("[ Done ]")
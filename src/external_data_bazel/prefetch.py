@@ -0,0 +1,49 @@
+"""
+Warms the cache with every file referenced by hash files under a set of paths, without creating
+any outputs in the workspace.
+"""
+
+from __future__ import absolute_import, print_function
+
+from external_data_bazel import util
+
+
+def add_arguments(parser):
+    parser.add_argument('paths', type=str, nargs='*', default=['.'],
+                        help='Files or directories to inspect for hash files. Defaults to the current directory.')
+    parser.add_argument('--limit_rate', type=str, default=None,
+                        help='Total bandwidth cap for downloads (e.g. 500K, 20M), shared across --jobs. Overrides `transfers.limit_rate` in the user config.')
+
+
+def run(args, project):
+    good = True
+    hash_files = project.find_hash_files(args.paths)
+
+    # Resolve, and dedupe by hash.
+    infos = {}
+    for hash_file in hash_files:
+        def resolve():
+            info = project.get_file_info(hash_file)
+            infos.setdefault(info.hash, info)
+        good = util.keep_going(args.keep_going, resolve) and good
+
+    # Skip entries that are already cached.
+    pending = []
+    for hash, info in infos.items():
+        if not info.package.is_hash_cached(hash):
+            pending.append(info)
+
+    if args.limit_rate is not None:
+        project.user.transfers.set_rate(util.parse_size(args.limit_rate))
+
+    # Start all downloads; concurrency is bounded by `--jobs` (see `futures`).
+    fetches = [info.remote.download_to_cache_async(info.hash, info.project_relpath) for info in pending]
+    count = 0
+    for fetch in fetches:
+        if util.keep_going(args.keep_going, fetch.result):
+            count += 1
+        else:
+            good = False
+    print("Prefetched {} of {} unique files ({} hash files)".format(
+        count, len(infos), len(hash_files)))
+    return good
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+import time
+
+# Records timed spans, written in the Chrome trace-event format:
+# https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+# View with `chrome://tracing` or https://ui.perfetto.dev.
+# Profiling is disabled by default, in which case spans are no-ops.
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+_null_span = _NullSpan()
+
+
+class _Span(object):
+    def __init__(self, profiler, name, args):
+        self._profiler = profiler
+        self._name = name
+        self._args = args
+
+    def __enter__(self):
+        self._start = time.time()
+
+    def __exit__(self, *args):
+        self._profiler.record(self._name, self._start, time.time(), self._args)
+
+
+class Profiler(object):
+    """ Accumulates spans across threads. Each thread is shown as its own track. """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._tids = {}
+        self._pid = os.getpid()
+
+    def _get_tid(self):
+        # Requires `_lock`.
+        thread = threading.current_thread()
+        tid = self._tids.get(thread.ident)
+        if tid is None:
+            tid = len(self._tids)
+            self._tids[thread.ident] = tid
+            self._events.append({
+                "name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid,
+                "args": {"name": thread.name},
+            })
+        return tid
+
+    def span(self, name, args):
+        return _Span(self, name, args)
+
+    def record(self, name, start, end, args):
+        with self._lock:
+            self._events.append({
+                "name": name, "ph": "X", "pid": self._pid, "tid": self._get_tid(),
+                "ts": start * 1e6, "dur": (end - start) * 1e6, "args": args,
+            })
+
+    def write(self, filepath):
+        with self._lock:
+            trace = {"traceEvents": list(self._events), "displayTimeUnit": "ms"}
+        with open(filepath, 'w') as f:
+            json.dump(trace, f)
+
+
+_profiler = None
+
+
+def enable():
+    """ Start recording spans for this process. """
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+    return _profiler
+
+
+def is_enabled():
+    return _profiler is not None
+
+
+def span(name, **args):
+    """ Context manager to record a span; `args` are shown with the span.
+    This is a no-op if profiling is not enabled. """
+    if _profiler is None:
+        return _null_span
+    return _profiler.span(name, args)
+
+
+def record_future(name, future, **args):
+    """ Record a span from now until `future` is done, for asynchronous operations. It is shown on
+    the thread which completes `future`. This is a no-op if profiling is not enabled.
+    @returns `future` """
+    profiler = _profiler
+    if profiler is not None:
+        start = time.time()
+        future.add_done_callback(lambda _: profiler.record(name, start, time.time(), args))
+    return future
+
+
+def write(filepath):
+    """ Write recorded spans as a Chrome trace file. """
+    if _profiler is not None:
+        _profiler.write(filepath)
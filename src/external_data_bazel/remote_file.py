@@ -0,0 +1,183 @@
+import io
+import os
+import threading
+
+from external_data_bazel import util
+
+# Partial reads of remote files, so that consumers which only need part of a large file (e.g. a
+# header or an index block) need not download all of it.
+#
+# Fetched ranges are stored in a sparse file under `{cache_dir}/partial/{algo}/{hash}`, with a
+# bitmap of which blocks are present in `{hash}.bitmap`, so that they are reused by later readers
+# (including other processes). Once every block has been fetched, the file is verified against its
+# hash and moved into the cache proper.
+#
+# NOTE: Blocks cannot be verified individually (the hash only covers the whole file), so data read
+# before completion is unverified.
+
+BLOCK_SIZE = 1024 * 1024
+PARTIAL_RELPATH = 'partial'
+
+
+class RemoteFile(io.RawIOBase):
+    """ Seekable, read-only file object which fetches blocks on demand. """
+    def __init__(self, cache_dir, hash, size, fetch, complete, open_cached):
+        """
+        @param fetch
+            `fetch(offset, size)` returns `size` bytes of the file at `offset`.
+        @param complete
+            `complete(filepath)` moves the fully fetched (and verified) file into the cache.
+        @param open_cached
+            `open_cached()` returns a file object for the file if it is in the cache, or None.
+        """
+        io.RawIOBase.__init__(self)
+        self.hash = hash
+        self.size = size
+        self._fetch = fetch
+        self._complete = complete
+        self._open_cached = open_cached
+        partial_dir = os.path.join(cache_dir, PARTIAL_RELPATH, hash.get_algo())
+        util.makedirs(partial_dir)
+        self._path = os.path.join(partial_dir, hash.get_value())
+        self._bitmap_path = self._path + '.bitmap'
+        self._lock_path = self._path + '.lock'
+        self._num_blocks = (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+        self._lock = threading.Lock()
+        self._pos = 0
+        self._file = None
+        self._done = False
+        with self._lock, util.FileLock(self._lock_path):
+            self._open_partial()
+            self._finish_if_complete()
+
+    def _open_partial(self):
+        # Requires locks.
+        if not os.path.isfile(self._path) or os.path.getsize(self._path) != self.size:
+            # Start a new sparse file.
+            with open(self._path, 'wb') as f:
+                f.truncate(self.size)
+            if os.path.exists(self._bitmap_path):
+                os.remove(self._bitmap_path)
+        self._file = open(self._path, 'r+b')
+        self._inode = os.fstat(self._file.fileno()).st_ino
+
+    def _load_bitmap(self):
+        size = (self._num_blocks + 7) // 8
+        if os.path.isfile(self._bitmap_path):
+            with open(self._bitmap_path, 'rb') as f:
+                bitmap = bytearray(f.read())
+            if len(bitmap) == size:
+                return bitmap
+        return bytearray(size)
+
+    def _save_bitmap(self, bitmap):
+        tmp_file = util.get_publish_tmp_path(self._bitmap_path)
+        with open(tmp_file, 'wb') as f:
+            f.write(bitmap)
+        os.rename(tmp_file, self._bitmap_path)
+
+    def _sync(self):
+        # Requires locks. Switch to the cached file if another process completed this entry.
+        try:
+            current = os.stat(self._path).st_ino
+        except OSError:
+            current = None
+        if current == self._inode:
+            return
+        self._file.close()
+        cached = self._open_cached()
+        if cached is not None:
+            self._file = cached
+            self._done = True
+        else:
+            # Discarded (e.g. on a hash mismatch); start again.
+            self._open_partial()
+
+    def _ensure(self, start, end):
+        """ Fetch any missing blocks in [start, end). """
+        first = start // BLOCK_SIZE
+        last = (end + BLOCK_SIZE - 1) // BLOCK_SIZE
+        with util.FileLock(self._lock_path):
+            self._sync()
+            if self._done:
+                return
+            bitmap = self._load_bitmap()
+            block = first
+            while block < last:
+                if bitmap[block // 8] & (1 << (block % 8)):
+                    block += 1
+                    continue
+                # Fetch a run of missing blocks in one request.
+                run_end = block
+                while run_end < last and not bitmap[run_end // 8] & (1 << (run_end % 8)):
+                    run_end += 1
+                offset = block * BLOCK_SIZE
+                data = self._fetch(offset, min(run_end * BLOCK_SIZE, self.size) - offset)
+                self._file.seek(offset)
+                self._file.write(data)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                for i in range(block, run_end):
+                    bitmap[i // 8] |= 1 << (i % 8)
+                self._save_bitmap(bitmap)
+                block = run_end
+            self._finish_if_complete(bitmap)
+
+    def _finish_if_complete(self, bitmap=None):
+        # Requires locks.
+        if bitmap is None:
+            bitmap = self._load_bitmap()
+        if any(not bitmap[i // 8] & (1 << (i % 8)) for i in range(self._num_blocks)):
+            return
+        computed = self.hash.compute(self._path)
+        if not self.hash.check(computed, do_throw=False):
+            os.remove(self._path)
+            if os.path.exists(self._bitmap_path):
+                os.remove(self._bitmap_path)
+            self.hash.check(computed)
+        # The open file remains valid once moved.
+        self._complete(self._path)
+        if os.path.exists(self._bitmap_path):
+            os.remove(self._bitmap_path)
+        self._done = True
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError("Invalid whence: {}".format(whence))
+        if pos < 0:
+            raise ValueError("Negative seek position: {}".format(pos))
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        return self._pos
+
+    def readinto(self, b):
+        with self._lock:
+            count = min(len(b), self.size - self._pos)
+            if count <= 0:
+                return 0
+            if not self._done:
+                self._ensure(self._pos, self._pos + count)
+            self._file.seek(self._pos)
+            data = self._file.read(count)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        io.RawIOBase.close(self)
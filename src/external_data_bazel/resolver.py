@@ -0,0 +1,110 @@
+"""
+In-process access to external data, e.g. for Python tests which need data at runtime.
+
+Projects are loaded once per process (per project root), rather than once per lookup as when
+shelling out to `cli.py`:
+
+    from external_data_bazel import resolver
+    filepath = resolver.resolve("data/volume.bin.sha512")
+
+Safe to use from multiple threads.
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from external_data_bazel import config_helpers, core, util
+
+_lock = threading.Lock()
+# (project root, project name, user config file) -> Project
+_projects = {}
+# Directory for files stored in packs, which have no cache path of their own.
+_extract_dir = None
+# (cache directory, algo, value) of entries checked by this process (see `resolve`).
+_checked = set()
+# Cache directories to which metrics are recorded at exit.
+_metrics_dirs = set()
+_start_time = time.time()
+
+
+def get_project(guess_filepath=None, project_name=None, user_config_file=None):
+    """ Returns the (memoized) project containing a given path.
+    @param guess_filepath
+        Filepath where to start guessing where the project root is. Defaults to the current
+        directory.
+    @param project_name
+        Constrain finding the project root to project files with the provided project name.
+    @param user_config_file
+        Overload for user configuration (as `cli.py --user_config`).
+    @returns A `core.Project` instance. """
+    if guess_filepath is None:
+        guess_filepath = os.getcwd()
+    guess_filepath = os.path.abspath(guess_filepath)
+    project_root, _ = config_helpers.find_project_root(
+        guess_filepath, core.PROJECT_CONFIG_FILE, project_name)
+    key = (project_root, project_name, user_config_file)
+    with _lock:
+        project = _projects.get(key)
+        if project is None:
+            user_config = None
+            if user_config_file is not None:
+                user_config = config_helpers.parse_config_file(user_config_file)
+            project = core.load_project(
+                guess_filepath, project_name=project_name, user_config_in=user_config)
+            _projects[key] = project
+            cache_dir = project.user.cache_dir
+            if cache_dir not in _metrics_dirs and \
+                    project.user.record_metrics_at_exit('resolver', _start_time):
+                _metrics_dirs.add(cache_dir)
+        return project
+
+
+def _extract(remote, hash, project_relpath):
+    # Writes out a file stored in a pack.
+    global _extract_dir
+    with _lock:
+        if _extract_dir is None:
+            _extract_dir = tempfile.mkdtemp(prefix='external_data_')
+            atexit.register(shutil.rmtree, _extract_dir, True)
+        output_file = os.path.join(_extract_dir, hash.get_algo(), hash.get_value())
+        if not os.path.isfile(output_file):
+            util.makedirs(os.path.dirname(output_file))
+            tmp_file = util.get_publish_tmp_path(output_file)
+            f = remote.open_file(hash, project_relpath)
+            try:
+                with open(tmp_file, 'wb') as out:
+                    out.write(f.read())
+            finally:
+                f.close()
+            util.publish_file(tmp_file, output_file)
+        return output_file
+
+
+def resolve(filepath, project=None):
+    """ Returns a read-only path to the contents of a file, downloading it to the cache if needed.
+    @param filepath
+        Hash file (or original file path).
+    @param project
+        Project to use. By default, the project containing `filepath` (see `get_project`).
+    As with `download`, cache entries are checked against their hash (and re-downloaded if
+    corrupt), though only the first time each is resolved by this process.
+    @returns Path in the user cache. For files stored in packs (see `pack_threshold`), a copy in
+        a temporary directory, removed when the process exits. """
+    filepath = os.path.abspath(filepath)
+    if project is None:
+        project = get_project(os.path.dirname(filepath))
+    info = project.get_file_info(filepath)
+    key = (project.user.cache_dir, info.hash.get_algo(), info.hash.get_value())
+    with _lock:
+        check = key not in _checked
+    cache_path, _ = info.remote.download_to_cache(info.hash, info.project_relpath, check=check)
+    with _lock:
+        _checked.add(key)
+    if cache_path is not None:
+        return cache_path
+    # Stored in a pack.
+    return _extract(info.remote, info.hash, info.project_relpath)
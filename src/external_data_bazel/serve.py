@@ -0,0 +1,201 @@
+"""
+Serves the user cache as a read-only, content-addressed HTTP cache, at `/{algo}/{hash}`.
+
+Other machines may then use it as a `url_templates` remote (or overlay), e.g.:
+    url_templates: ["http://build-cache.local:8000/{algo}/{hash}"]
+"""
+
+from __future__ import absolute_import, print_function
+
+import BaseHTTPServer
+import SocketServer
+import ctypes
+import ctypes.util
+import os
+import re
+import sys
+
+from external_data_bazel import core, hashes, packs, util
+
+_PATH_REGEX = re.compile(r"^/([a-z0-9_]+)/([0-9a-f]+)$")
+_RANGE_REGEX = re.compile(r"^bytes=(\d*)-(\d*)$")
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _get_libc_sendfile():
+    # Python 2 does not expose `sendfile`; use libc on Linux, where the signature is known.
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = libc.sendfile64
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    func.restype = ctypes.c_ssize_t
+    return func
+
+_libc_sendfile = _get_libc_sendfile()
+
+
+def _send_range(out_file, f, offset, count):
+    """ Send `count` bytes of `f` at `offset` to `out_file` (a socket file), without copying through
+    userspace if possible. """
+    out_file.flush()
+    if hasattr(os, 'sendfile'):
+        out_fd = out_file.fileno()
+        while count > 0:
+            sent = os.sendfile(out_fd, f.fileno(), offset, count)
+            if sent == 0:
+                break
+            offset += sent
+            count -= sent
+        return
+    if _libc_sendfile is not None:
+        out_fd = out_file.fileno()
+        c_offset = ctypes.c_int64(offset)
+        while count > 0:
+            sent = _libc_sendfile(out_fd, f.fileno(), ctypes.byref(c_offset), count)
+            if sent < 0:
+                errno = ctypes.get_errno()
+                raise IOError(errno, os.strerror(errno))
+            if sent == 0:
+                break
+            count -= sent
+        return
+    f.seek(offset)
+    while count > 0:
+        chunk = f.read(min(count, _COPY_CHUNK_SIZE))
+        if not chunk:
+            break
+        out_file.write(chunk)
+        count -= len(chunk)
+
+
+def _parse_range(header, size):
+    """ Parse a single-range `Range` header.
+    @returns (start, end) (inclusive), None to serve the full file, or False if unsatisfiable. """
+    m = _RANGE_REGEX.match(header.strip())
+    if not m:
+        # Ignore multiple ranges or unknown units; serve the full file.
+        return None
+    start, end = m.groups()
+    if start == '' and end == '':
+        return None
+    if start == '':
+        # Suffix range: the last `end` bytes.
+        suffix = int(end)
+        if suffix == 0:
+            return False
+        return (max(size - suffix, 0), size - 1)
+    start = int(start)
+    end = size - 1 if end == '' else min(int(end), size - 1)
+    if start >= size or start > end:
+        return False
+    return (start, end)
+
+
+class CacheRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves files from `server.cache_dir`. """
+    protocol_version = 'HTTP/1.1'
+
+    def _resolve(self):
+        m = _PATH_REGEX.match(self.path.split('?')[0])
+        if not m:
+            return None
+        algo, value = m.groups()
+        if algo not in self.server.algos:
+            return None
+        filepath = core.get_cas_path(self.server.cache_dir, algo, value)
+        if os.path.isfile(filepath):
+            return filepath, 0, os.path.getsize(filepath), value
+        # Small files may be stored in a pack.
+        location = self.server.packs.find(algo, value)
+        if location is None:
+            return None
+        pack_file, offset, size = location
+        return pack_file, offset, size, value
+
+    def _send_error(self, code, extra_headers=()):
+        self.send_response(code)
+        for key, value in extra_headers:
+            self.send_header(key, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _handle(self, send_body):
+        resolved = self._resolve()
+        if resolved is None:
+            self._send_error(404)
+            return
+        filepath, base_offset, size, value = resolved
+        with open(filepath, 'rb') as f:
+            byte_range = None
+            range_header = self.headers.get('Range')
+            if range_header is not None:
+                byte_range = _parse_range(range_header, size)
+                if byte_range is False:
+                    self._send_error(416, [('Content-Range', 'bytes */{}'.format(size))])
+                    return
+            if byte_range is None:
+                start, end = 0, size - 1
+                self.send_response(200)
+            else:
+                start, end = byte_range
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+            count = end - start + 1
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(count))
+            self.send_header('Accept-Ranges', 'bytes')
+            # Contents are immutable for a given hash.
+            self.send_header('ETag', '"{}"'.format(value))
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+            self.end_headers()
+            if send_body and count > 0:
+                _send_range(self.wfile, f, base_offset + start, count)
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            util.eprint("{} - {}".format(self.address_string(), format % args))
+
+
+class CacheServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, cache_dir, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, CacheRequestHandler)
+        self.cache_dir = cache_dir
+        self.packs = packs.PackStore(os.path.join(cache_dir, 'packs'))
+        self.algos = set(hash_type.name for hash_type in hashes.hash_types)
+        self.verbose = verbose
+
+
+def add_arguments(parser):
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Address to bind (e.g. 0.0.0.0 for all interfaces). Defaults to localhost, since the server has no authentication.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='Directory to serve. Defaults to the user cache directory.')
+
+
+def run(args, user):
+    cache_dir = os.path.abspath(os.path.expanduser(args.cache_dir or user.cache_dir))
+    server = CacheServer((args.host, args.port), cache_dir, verbose=args.verbose)
+    util.eprint("Serving {} at http://{}:{}/{{algo}}/{{hash}}".format(
+        cache_dir, args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return True
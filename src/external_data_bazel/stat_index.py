@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import time
+
+from external_data_bazel import util
+
+# Similar in spirit to Git's index: record the `stat` signature of a workspace file when its
+# hash was computed, so that unchanged files need not be re-hashed.
+
+# Files modified within this window of being hashed are treated as suspicious, since
+# coarse file system timestamps may not reflect a modification made right after hashing.
+RACY_WINDOW = 2.
+
+
+def get_signature(filepath):
+    """ Returns the stat signature of a file (following symlinks), or None if it does not exist. """
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime, st.st_ino]
+
+
+class StatIndex(object):
+    """ Maps project-relative paths to (stat signature, hash) for a given project.
+    Stored in the user cache, keyed by project name and root. """
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self._entries = {}
+        self._dirty = False
+        if os.path.isfile(self.index_file):
+            with open(self.index_file) as f:
+                try:
+                    self._entries = json.load(f)
+                except ValueError:
+                    # Corrupt index; start from scratch.
+                    self._entries = {}
+
+    def get(self, project_relpath, signature):
+        """ Returns the recorded hash string if `signature` still matches, None otherwise. """
+        entry = self._entries.get(project_relpath)
+        if entry is None or signature is None:
+            return None
+        recorded_signature, hashed_at, hash_str = entry
+        if recorded_signature != signature:
+            return None
+        if signature[1] + RACY_WINDOW >= hashed_at:
+            # Racily clean; cannot trust the signature.
+            return None
+        return hash_str
+
+    def update(self, project_relpath, signature, hash, hashed_at=None):
+        """ Records the hash computed for a file. `signature` should be taken *before* hashing.
+        @param hashed_at
+            Time at which the file was hashed. If None (e.g. for a file that this process has just
+            written with known contents), the time of `save` is used; as with Git's index, files
+            written just before then remain racily clean. """
+        if signature is None:
+            return
+        self._entries[project_relpath] = [signature, hashed_at, str(hash)]
+        self._dirty = True
+
+    def remove(self, project_relpath):
+        if self._entries.pop(project_relpath, None) is not None:
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        util.makedirs(os.path.dirname(self.index_file))
+        now = time.time()
+        for entry in self._entries.values():
+            if entry[1] is None:
+                entry[1] = now
+        # Write atomically; concurrent writers simply race, which only costs a re-hash.
+        tmp_file = "{}.tmp.{}".format(self.index_file, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump(self._entries, f)
+        os.rename(tmp_file, self.index_file)
+        self._dirty = False
+
+
+def load_index(project):
+    """ Load the stat index for a given project. """
+    root_key = hashlib.md5(project.root.encode('utf-8')).hexdigest()[:12]
+    index_file = os.path.join(
+        project.user.cache_dir, 'index', "{}-{}.json".format(project.name, root_key))
+    return StatIndex(index_file)
+
+
+def record_written(index, filepath, project_relpath, hash):
+    """ Records the hash of a file which this process has just written (or checked) with known
+    contents, e.g. by `download`, so that it need not be re-hashed. """
+    index.update(project_relpath, get_signature(filepath), hash)
+
+
+def compute_hash(index, hash_type, filepath, project_relpath):
+    """ Compute the hash of a file, recording it in the index. """
+    signature = get_signature(filepath)
+    hashed_at = time.time()
+    hash = hash_type.compute(filepath)
+    index.update(project_relpath, signature, hash, hashed_at)
+    return hash
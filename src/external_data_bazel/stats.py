@@ -0,0 +1,108 @@
+"""
+Summarizes metrics recorded by previous invocations (see `metrics.py`).
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import time
+
+from external_data_bazel import metrics, util
+
+
+def add_arguments(parser):
+    parser.add_argument('--format', choices=['summary', 'prometheus'], default='summary',
+                        help='Print a human-readable summary, or counters in Prometheus text format.')
+    parser.add_argument('--days', type=float, default=None,
+                        help='Only include invocations from the past number of days.')
+    parser.add_argument('--clear', action='store_true',
+                        help='Remove recorded metrics.')
+
+
+def _print_summary(m, count):
+    print("Invocations: {}".format(count))
+    for command, num in sorted(m.sum_by("invocations", "command").items()):
+        seconds = m.get("command_seconds", command=command)
+        print("  {:<12} {:>8}  {:10.1f}s".format(command, num, seconds))
+
+    hits = m.total("cache_hits")
+    misses = m.total("cache_misses")
+    print("Cache:")
+    print("  hits: {}, misses: {}, hit rate: {}".format(
+        hits, misses, "{:.1%}".format(float(hits) / (hits + misses)) if hits + misses else "n/a"))
+    print("  corruptions: {}".format(m.total("cache_corruptions")))
+    if m.total("cache_entries_verified"):
+        print("  verified: {}, quarantined: {}".format(
+            m.total("cache_entries_verified"), m.total("cache_entries_quarantined")))
+
+    columns = [
+        ("hits", "cache_hits"), ("misses", "cache_misses"), ("downloads", "downloads"),
+        ("bytes", "download_bytes"), ("seconds", "download_seconds"), ("errors", "download_errors"),
+        ("fallbacks", "overlay_fallbacks"), ("queries", "has_file_queries"), ("uploads", "uploads"),
+    ]
+    by_remote = dict((name, m.sum_by(name, "remote")) for _, name in columns)
+    remotes = sorted(set(remote for values in by_remote.values() for remote in values))
+    if remotes:
+        print("Remotes:")
+        header = "  {:<16}".format("remote") + "".join("{:>10}".format(label) for label, _ in columns)
+        print(header + "{:>12}".format("rate"))
+        for remote in remotes:
+            row = "  {:<16}".format(remote)
+            for _, name in columns:
+                value = by_remote[name].get(remote, 0)
+                if name == "download_bytes":
+                    row += "{:>10}".format(util.format_size(value))
+                elif name == "download_seconds":
+                    row += "{:>10.2f}".format(value)
+                else:
+                    row += "{:>10}".format(value)
+            seconds = by_remote["download_seconds"].get(remote, 0)
+            size = by_remote["download_bytes"].get(remote, 0)
+            row += "{:>12}".format(util.format_size(size / seconds) + "/s" if seconds else "n/a")
+            print(row)
+
+    if m.total("chunks_fetched") or m.total("chunks_uploaded") or m.total("chunks_reused"):
+        print("Chunks:")
+        print("  fetched: {} ({}), uploaded: {} ({}), reused: {}".format(
+            m.total("chunks_fetched"), util.format_size(m.total("chunk_bytes_fetched")),
+            m.total("chunks_uploaded"), util.format_size(m.total("chunk_bytes_uploaded")),
+            m.total("chunks_reused")))
+
+    if m.total("bazel_cache_imports") or m.total("bazel_cache_exports"):
+        print("Bazel caches:")
+        print("  imported: {} ({}), exported: {}".format(
+            m.total("bazel_cache_imports"), util.format_size(m.total("bazel_cache_import_bytes")),
+            m.total("bazel_cache_exports")))
+
+    waits = m.sum_by("transfer_wait_seconds", "host")
+    if waits or m.total("transfer_throttle_seconds"):
+        print("Transfer scheduling:")
+        for host, seconds in sorted(waits.items()):
+            print("  {:<24} waited for a connection: {:.1f}s".format(host, seconds))
+        print("  throttled by bandwidth cap: {:.1f}s".format(m.total("transfer_throttle_seconds")))
+
+    print("Hash checks:")
+    for algo, num in sorted(m.sum_by("hash_checks", "algo").items()):
+        print("  {:<16} files: {}, size: {}, time: {:.2f}s".format(
+            algo, num, util.format_size(m.get("hash_check_bytes", algo=algo)),
+            m.get("hash_check_seconds", algo=algo)))
+
+
+def run(args, user):
+    metrics_file = metrics.get_metrics_file(user.cache_dir)
+    if args.clear:
+        for filepath in metrics.get_rotated_files(metrics_file):
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        print("Cleared: {}".format(metrics_file))
+        return True
+    since = None
+    if args.days is not None:
+        since = time.time() - args.days * 24 * 60 * 60
+    m, count = metrics.load(metrics_file, since=since)
+    if args.format == 'prometheus':
+        sys.stdout.write(metrics.to_prometheus(m))
+    else:
+        _print_summary(m, count)
+    return True
@@ -0,0 +1,65 @@
+"""
+Reports which tracked files differ from their committed hashes, using a stat index to avoid
+re-hashing unchanged files.
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+
+from external_data_bazel import util, stat_index
+
+
+def add_arguments(parser):
+    parser.add_argument('paths', type=str, nargs='*', default=['.'],
+                        help='Files or directories to inspect for hash files. Defaults to the current directory.')
+    parser.add_argument('--local_only', action='store_true',
+                        help='Do not query remotes for files that have not been uploaded.')
+
+
+def run(args, project):
+    hash_files = project.find_hash_files(args.paths)
+    infos = [project.get_file_info(hash_file) for hash_file in hash_files]
+    index = stat_index.load_index(project)
+
+    # Determine which files need to be (re-)hashed.
+    missing = []
+    suspicious = []
+    current = {}
+    for info in infos:
+        filepath = info.default_output_file
+        signature = stat_index.get_signature(filepath)
+        if signature is None:
+            missing.append(info)
+            index.remove(info.project_relpath)
+            continue
+        hash_str = index.get(info.project_relpath, signature)
+        if hash_str is None:
+            suspicious.append(info)
+        else:
+            current[info.project_relpath] = hash_str
+
+    def rehash(info):
+        return stat_index.compute_hash(
+            index, info.hash.hash_type, info.default_output_file, info.project_relpath)
+    hashes = util.parallel_map(rehash, suspicious, args.jobs)
+    for info, hash in zip(suspicious, hashes):
+        current[info.project_relpath] = str(hash)
+    index.save()
+
+    modified = [info for info in infos if info.project_relpath in current and
+                current[info.project_relpath] != str(info.hash)]
+
+    not_uploaded = []
+    if not args.local_only:
+        def has_file(info):
+            return info.remote.has_file(info.hash, info.project_relpath)
+        present = util.parallel_map(has_file, infos, args.jobs)
+        not_uploaded = [info for info, has in zip(infos, present) if not has]
+
+    if args.verbose:
+        util.eprint("Hashed {} of {} files".format(len(suspicious), len(infos)))
+    for label, group in [("modified", modified), ("missing", missing), ("not uploaded", not_uploaded)]:
+        for info in group:
+            print("{:<14}{}".format(label + ":", os.path.relpath(info.default_output_file)))
+    return True
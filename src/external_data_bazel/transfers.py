@@ -0,0 +1,200 @@
+import heapq
+import itertools
+import threading
+import time
+
+from external_data_bazel import futures, metrics
+
+# Scheduling of transfers across all remotes of a process, so that concurrent transfers (e.g.
+# `prefetch --jobs=100`) neither open too many connections to one host nor saturate a shared link.
+# (Existence queries are not limited, since some backends batch them.)
+#
+# * Per-host limits: each transfer holds one of `max_per_host` slots for its backend's host (see
+#   `Backend.get_host`) while running. Waiting operations with a known size (e.g. uploads) start
+#   largest first, so that small ones fill in the gaps towards the end; others start in order.
+# * Bandwidth: a token bucket shared by all transfers. Streamed downloads are throttled as data
+#   arrives; other transfers are charged once complete (delaying the next transfer on that thread),
+#   which holds the average rate.
+
+
+class TokenBucket(object):
+    """ Thread-safe token bucket; `consume` blocks to keep the average rate at `rate` bytes / sec. """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        # Allow up to one second's worth of bytes in a burst by default.
+        self.burst = float(burst if burst is not None else rate)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._last = time.time()
+
+    def consume(self, count):
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Go into debt, and wait for it to be repaid; concurrent callers queue up behind it.
+            self._tokens -= count
+            delay = -self._tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class _HostSlots(object):
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        # Heap of (-size, sequence, future).
+        self.waiters = []
+
+
+class Scheduler(object):
+    """ Enforces per-host limits and a bandwidth cap on transfers. """
+    def __init__(self, max_per_host=None, rate=None):
+        """
+        @param max_per_host
+            Maximum concurrent operations per host, or None for no limit.
+        @param rate
+            Total bandwidth cap in bytes / sec, or None for no limit.
+        """
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._sequence = itertools.count()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        self._bucket = TokenBucket(rate) if rate is not None else None
+
+    def has_rate(self):
+        return self._bucket is not None
+
+    def acquire_async(self, host, size=None):
+        """ Acquire a slot for `host` (released with `release`).
+        @returns Future completing once acquired. If cancelled while waiting, no slot is held. """
+        future = futures.Future()
+        if host is None or self.max_per_host is None:
+            future.set_result(None)
+            return future
+        with self._lock:
+            slots = self._hosts.get(host)
+            if slots is None:
+                slots = self._hosts[host] = _HostSlots(self.max_per_host)
+            if slots.active < slots.limit:
+                slots.active += 1
+                acquired = True
+            else:
+                heapq.heappush(slots.waiters, (-(size or 0), next(self._sequence), future))
+                acquired = False
+        if acquired:
+            future.set_result(None)
+        return future
+
+    def release(self, host):
+        if host is None or self.max_per_host is None:
+            return
+        while True:
+            with self._lock:
+                slots = self._hosts[host]
+                if not slots.waiters:
+                    slots.active -= 1
+                    return
+                # Hand the slot over directly.
+                _, _, waiter = heapq.heappop(slots.waiters)
+            waiter.set_result(None)
+            if not waiter.cancelled():
+                return
+            # Cancelled while waiting; try the next one.
+
+    def run(self, host, func, size=None):
+        """ Run `func()` while holding a slot for `host`. """
+        with metrics.Timer("transfer_wait_seconds", host=str(host)):
+            self.acquire_async(host, size).result()
+        try:
+            return func()
+        finally:
+            self.release(host)
+
+    def run_async(self, host, start, size=None):
+        """ Run `start()` (returning a Future) once a slot for `host` is acquired, holding it until
+        that Future is done (or cancelled).
+        @returns Future of its result. """
+        out = futures.Future()
+        requested = time.time()
+        acquired = self.acquire_async(host, size)
+        # The stage in progress, for cancellation.
+        current = [acquired]
+        out.add_cancel_callback(lambda: current[0].cancel())
+        def on_done(f):
+            self.release(host)
+            error = f.exception()
+            if error is not None:
+                out.set_exception(error)
+            else:
+                out.set_result(f.result())
+        def on_acquired(f):
+            if f.cancelled():
+                # No slot is held.
+                return
+            if out.cancelled():
+                self.release(host)
+                return
+            metrics.add("transfer_wait_seconds", time.time() - requested, host=str(host))
+            try:
+                future = start()
+            except Exception as e:
+                self.release(host)
+                out.set_exception(e)
+                return
+            current[0] = future
+            if out.cancelled():
+                future.cancel()
+            future.add_done_callback(on_done)
+        acquired.add_done_callback(on_acquired)
+        return out
+
+    def throttle(self, count):
+        """ Account for `count` bytes transferred, blocking as needed to hold the bandwidth cap. """
+        if self._bucket is not None and count > 0:
+            delay = self._bucket.consume(count)
+            if delay > 0:
+                metrics.add("transfer_throttle_seconds", delay)
+
+
+if __name__ == '__main__':
+    # Per-host limits: at most 2 at once, and waiters start largest first.
+    scheduler = Scheduler(max_per_host=2)
+    held = [scheduler.acquire_async('a', 1) for _ in range(2)]
+    assert all(f.done() for f in held)
+    small = scheduler.acquire_async('a', 10)
+    large = scheduler.acquire_async('a', 1000)
+    cancelled = scheduler.acquire_async('a', 5000)
+    other = scheduler.acquire_async('b')
+    assert other.done() and not small.done() and not large.done()
+    cancelled.cancel()
+    scheduler.release('a')
+    assert large.done() and not small.done()
+    scheduler.release('a')
+    assert small.done()
+    # Async operations hold their slot until done.
+    pending = futures.Future()
+    result = scheduler.run_async('b', lambda: pending)
+    queued = scheduler.acquire_async('b')
+    assert scheduler.acquire_async('b').done() is False
+    pending.set_result(3)
+    assert result.result() == 3 and queued.done()
+    # Cancelling a waiting operation does not hold a slot.
+    scheduler = Scheduler(max_per_host=1)
+    scheduler.acquire_async('a')
+    result = scheduler.run_async('a', lambda: futures.completed(None))
+    result.cancel()
+    scheduler.release('a')
+    assert scheduler.acquire_async('a').done()
+    # Bandwidth: 4 MiB at 2 MiB/sec (with a 2 MiB burst) takes about 1 second.
+    scheduler = Scheduler(rate=2 * 1024 * 1024)
+    start = time.time()
+    for _ in range(16):
+        scheduler.throttle(256 * 1024)
+    elapsed = time.time() - start
+    assert 0.8 < elapsed < 1.5, elapsed
+    print("[ Done ]")
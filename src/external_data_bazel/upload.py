@@ -8,23 +8,46 @@ import json
 import os
 import sys
 import textwrap
+import time
 import argparse
 
 from datetime import datetime
 
-from external_data_bazel import core, util
+from external_data_bazel import core, util, hashes, futures, stat_index
 
 
 def add_arguments(parser):
     parser.add_argument('filepaths', type=str, nargs='+')
     parser.add_argument('--update_only', action='store_true',
                         help="Only update the file information (e.g. hash file), but do not upload the file.")
+    parser.add_argument('--hash_type', type=str, default=None,
+                        choices=[hash_type.name for hash_type in hashes.hash_types],
+                        help="Hash type for files which do not yet have a hash file (e.g. 'sha512_tree' for multi-core hashing of large files).")
+    parser.add_argument('--secondary_sha256', action='store_true',
+                        help="For hash types other than sha256, also record a SHA-256 digest (in `{file}.secondary_sha256`), so that files can be found in Bazel's repository and disk caches. Digests already recorded are kept up to date.")
+    parser.add_argument('--plan', action='store_true',
+                        help="Hash all files concurrently (per --jobs), check which blobs each remote already has in bulk, print the plan, then upload only the missing blobs. Hash files are written once all uploads have finished.")
+    parser.add_argument('--dry_run', action='store_true',
+                        help="With --plan, only print the plan.")
 
 def run(args, project):
+    # Record the hashes computed here, so that `status` need not re-hash the files.
+    index = stat_index.load_index(project)
+    try:
+        return _run(args, project, index)
+    finally:
+        index.save()
+
+
+def _run(args, project, index):
+    if args.plan:
+        return run_plan(args, project, index)
+    if args.dry_run:
+        raise RuntimeError("--dry_run requires --plan")
     good = True
     for filepath in args.filepaths:
         def action():
-            do_upload(args, project, filepath)
+            do_upload(args, project, filepath, index)
         if args.keep_going:
             try:
                 action()
@@ -37,22 +60,135 @@ def run(args, project):
     return good
 
 
-def do_upload(args, project, filepath_in):
-    filepath = os.path.abspath(filepath_in)
-
+def _resolve(args, project, filepath):
+    """ @returns (info, hash_type) for a file to be uploaded. """
     hash_orig_file = project.is_hash_file(filepath)
     if hash_orig_file:
         raise RuntimeError("Input file is a hash file. Did you mean to upload '{}' instead?".format(hash_orig_file))
 
     info = project.get_file_info(filepath, must_have_hash=False)
+    hash_type = info.hash.hash_type
+    if args.hash_type is not None and args.hash_type != hash_type.name:
+        if info.hash.has_value():
+            raise RuntimeError("File already has a '{}' hash file; remove it to switch to '{}': {}".format(hash_type.name, args.hash_type, filepath))
+        hash_type = hashes.get_hash_type(args.hash_type)
+    return info, hash_type
+
+
+def _add_secondary(args, info, hash_type, hash, filepath):
+    # Record a SHA-256 if requested, or if the file already has one.
+    if hash_type != hashes.sha256 and (args.secondary_sha256 or info.hash.secondary is not None):
+        hash.secondary = hashes.sha256.compute(filepath)
+
+
+def do_upload(args, project, filepath_in, index=None):
+    filepath = os.path.abspath(filepath_in)
+    info, hash_type = _resolve(args, project, filepath)
     remote = info.remote
     project_relpath = info.project_relpath
+    # Taken before hashing (see `stat_index`).
+    signature = stat_index.get_signature(filepath)
+    hashed_at = time.time()
 
     # TODO(eric.cousineau): Consider replacing `filepath` with `info.orig_filepath`, to allow
     # the hash file to be 'uploaded' (redirecting to original file).
     if not args.update_only:
-        hash = remote.upload_file(info.hash.hash_type, project_relpath, filepath)
+        hash = remote.upload_file(hash_type, project_relpath, filepath)
     else:
         # ... Hmm... This looks ugly.
-        hash = info.hash.compute(filepath)
+        hash = hash_type.compute(filepath)
+    _add_secondary(args, info, hash_type, hash, filepath)
     project.update_file_info(info, hash)
+    if index is not None:
+        index.update(project_relpath, signature, hash, hashed_at)
+
+
+class _Blob(object):
+    # A unique blob to be uploaded to one remote, possibly shared by several files.
+    def __init__(self, remote, hash, filepath, project_relpath):
+        self.remote = remote
+        self.hash = hash
+        # First file with this content, which is the one uploaded.
+        self.filepath = filepath
+        self.project_relpath = project_relpath
+        self.size = os.path.getsize(filepath)
+        self.files = []
+
+
+def run_plan(args, project, index):
+    """ Uploads files in bulk: hash, deduplicate, query, then transfer only what is missing. """
+    good = True
+
+    # Resolve and hash all files first.
+    tasks = []
+    for filepath_in in args.filepaths:
+        filepath = os.path.abspath(filepath_in)
+        def resolve():
+            info, hash_type = _resolve(args, project, filepath)
+            tasks.append((info, hash_type, filepath))
+        good = util.keep_going(args.keep_going, resolve) and good
+    def compute(task):
+        info, hash_type, filepath = task
+        hash = stat_index.compute_hash(index, hash_type, filepath, info.project_relpath)
+        _add_secondary(args, info, hash_type, hash, filepath)
+        return hash
+    hashes_computed = util.parallel_map(compute, tasks, args.jobs)
+
+    # Group files by (remote, hash), in input order.
+    blobs = {}
+    blob_order = []
+    for (info, _, filepath), hash in zip(tasks, hashes_computed):
+        key = (id(info.remote), hash)
+        blob = blobs.get(key)
+        if blob is None:
+            blob = blobs[key] = _Blob(info.remote, hash, filepath, info.project_relpath)
+            blob_order.append(blob)
+        blob.files.append((info, hash))
+
+    # Query all remotes in bulk (only the remote itself, not its overlays, as for `do_upload`).
+    if args.update_only:
+        missing = []
+    else:
+        present = futures.wait_all([
+            blob.remote.has_file_async(blob.hash, blob.project_relpath, check_overlay=False)
+            for blob in blob_order])
+        missing = [blob for blob, has_file in zip(blob_order, present) if not has_file]
+
+    # Print the plan.
+    total_size = sum(blob.size for blob in blob_order)
+    print("Upload plan: {} file(s), {} unique blob(s) ({}), {} to upload".format(
+        len(tasks), len(blob_order), util.format_size(total_size), len(missing)))
+    by_remote = {}
+    for blob in missing:
+        count, size = by_remote.get(blob.remote.name, (0, 0))
+        by_remote[blob.remote.name] = (count + 1, size + blob.size)
+    for name, (count, size) in sorted(by_remote.items()):
+        print("  {}: {} blob(s), {}".format(name, count, util.format_size(size)))
+    if args.verbose:
+        for blob in missing:
+            print("  upload: {} ({}, {})".format(
+                blob.project_relpath, blob.remote.name, util.format_size(blob.size)))
+    if args.dry_run:
+        return good
+
+    # Upload missing blobs concurrently; the transfer scheduler starts the largest first.
+    uploads = [
+        blob.remote.upload_file_async(blob.hash, blob.project_relpath, blob.filepath)
+        for blob in missing]
+    failed = set()
+    for blob, future in zip(missing, uploads):
+        def wait():
+            try:
+                future.result()
+            except Exception:
+                failed.add(id(blob))
+                raise
+        good = util.keep_going(args.keep_going, wait) and good
+
+    # Write hash files for every file whose blob is now available.
+    for blob in blob_order:
+        if id(blob) in failed:
+            continue
+        for info, hash in blob.files:
+            project.update_file_info(info, hash)
+    return good
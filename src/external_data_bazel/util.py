@@ -2,8 +2,15 @@ from __future__ import absolute_import, print_function
 import os
 import subprocess
 import sys
+import fcntl
 import json
+import re
+import stat
+import tempfile
 import time
+import uuid
+
+from external_data_bazel import futures
 
 
 def is_child_path(child_path, parent_path, require_abs=True):
@@ -51,6 +58,41 @@ def find_key(d, value):
 class DownloadError(RuntimeError):
     pass
 
+class HttpError(DownloadError):
+    """ A download failed with an HTTP error status (`code`). """
+    def __init__(self, message, code):
+        DownloadError.__init__(self, message)
+        self.code = code
+
+def keep_going(enabled, action):
+    """ Run `action`. If `enabled`, report (rather than raise) a `RuntimeError`.
+    @returns True if `action` succeeded. """
+    if enabled:
+        try:
+            action()
+        except RuntimeError as e:
+            eprint(e)
+            eprint("Continuing (--keep_going).")
+            return False
+    else:
+        action()
+    return True
+
+def parallel_map(func, items, jobs):
+    """ Apply `func` to each item using a pool of `jobs` threads, preserving order.
+    Work here is dominated by subprocesses and I/O, so threads are sufficient.
+    The first exception encountered is re-raised. """
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(jobs, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
 def get_chain(value, key_chain, default=None):
     for key in key_chain:
         if value is None:
@@ -73,13 +115,144 @@ def set_chain(base, key_chain, value):
     return base
 
 
+def parse_size(value):
+    """ Parse a size with an optional (binary) suffix, e.g. '512K', '10M', '1G', into bytes. """
+    suffixes = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
+    number = str(value).strip().upper()
+    scale = 1
+    if number and number[-1] in suffixes:
+        scale = suffixes[number[-1]]
+        number = number[:-1]
+    try:
+        return int(float(number) * scale)
+    except ValueError:
+        raise RuntimeError("Invalid size: {}".format(value))
+
+def format_size(size):
+    """ Format a size in bytes with a binary suffix, e.g. '1.5 MiB'. """
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if size < 1024:
+            return "{:.1f} {}".format(size, unit)
+        size /= 1024.
+    return "{:.1f} TiB".format(size)
+
+def header_args(headers):
+    """ @returns `curl` arguments (unquoted) to send a dictionary of HTTP headers. """
+    args = []
+    for key, value in sorted(headers.items()):
+        args += ["-H", "{}: {}".format(key, value)]
+    return args
+
+def _curl_cmd(args):
+    return "curl {}".format(args)
+
 def curl(args):
     try:
-        return subshell("curl {}".format(args))
+        return subshell(_curl_cmd(args))
     except subprocess.CalledProcessError as e:
         # Assume any error is just due to downloading.
         raise DownloadError(e)
 
+def curl_async(args):
+    """ Asynchronous `curl`.
+    @returns futures.Future of the (stripped) output; raises `DownloadError` on failure. """
+    def check(f):
+        error = f.exception()
+        if error is not None:
+            raise DownloadError(error)
+        return f.result().strip()
+    return futures.then(futures.run_process(_curl_cmd(args)), check)
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+def _parse_headers(text):
+    """ Parse response headers, as written by `curl -D` or `curl -I`.
+    @returns (status code, dict of lower-case header names to values) of the last response (with
+        `-L`, headers of each response are written), or (None, {}). """
+    code = None
+    headers = {}
+    for line in text.splitlines():
+        m = re.match(r"^HTTP/[\d.]+ (\d+)", line)
+        if m:
+            code = int(m.group(1))
+            headers = {}
+        elif ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    return code, headers
+
+def _read_http_code(header_file):
+    with open(header_file) as f:
+        return _parse_headers(f.read())[0]
+
+def curl_head(args):
+    """ Request only the headers (following redirects).
+    @returns (status code, dict of lower-case header names to values) of the final response. """
+    return _parse_headers(curl('-s -I -L {}'.format(args)))
+
+def curl_stream(args, write):
+    """ Run `curl` (following redirects, failing on HTTP errors), passing its output to
+    `write(data)` as it arrives, so that it may be hashed and written in a single pass.
+    @returns The HTTP status code of the final response (e.g. 206 for a range request).
+    @raises HttpError if the server returned an error status (in which case nothing was written),
+        or DownloadError on other failures. """
+    fd, header_file = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        cmd = _curl_cmd('-L --fail -s -D {header_file} -o - {args}'.format(
+            header_file=header_file, args=args))
+        p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
+        try:
+            while True:
+                data = p.stdout.read(STREAM_CHUNK_SIZE)
+                if not data:
+                    break
+                write(data)
+        except:
+            p.kill()
+            p.wait()
+            raise
+        p.wait()
+        if p.returncode != 0:
+            code = _read_http_code(header_file)
+            if code is not None and code >= 400:
+                raise HttpError("HTTP {}: {}".format(code, cmd), code)
+            raise DownloadError("Command failed ({}): {}".format(p.returncode, cmd))
+        return _read_http_code(header_file)
+    finally:
+        os.remove(header_file)
+
+def makedirs(path):
+    """ Create a directory (and its parents) if it does not exist, tolerating concurrent creation
+    (e.g. by another thread or process, or another machine on a shared mount). """
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+def get_publish_tmp_path(filepath):
+    """ Get a unique temporary path next to `filepath` (i.e. on the same filesystem), for use with
+    `publish_file`. """
+    return "{}.{}.tmp".format(filepath, uuid.uuid4().hex)
+
+def publish_file(tmp_file, filepath):
+    """ Flush `tmp_file` to disk, make it read-only, and atomically rename it to `filepath`, so that
+    a partially written file is never visible at `filepath`. """
+    fd = os.open(tmp_file, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        mode = os.fstat(fd).st_mode
+    finally:
+        os.close(fd)
+    write_bits = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+    if mode & write_bits:
+        # Skip if already read-only (e.g. hardlinked from a store we do not own).
+        os.chmod(tmp_file, stat.S_IMODE(mode) & ~write_bits)
+    # If published concurrently, this replaces the file with identical contents.
+    os.rename(tmp_file, filepath)
+
 def _lock_path(filepath):
     return filepath + ".lock"
 
@@ -119,6 +292,20 @@ class FileWriteLock(object):
         # assert os.path.isfile(self.lock)
         # os.remove(self.lock)
 
+class FileLock(object):
+    """ Exclusive `flock` on a lock file (created if needed), held within a `with` block.
+    Unlike `FileWriteLock`, this is effective across processes (on local filesystems). """
+    def __init__(self, filepath):
+        self._filepath = filepath
+
+    def __enter__(self):
+        self._fd = os.open(self._filepath, os.O_WRONLY | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *args):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+
 # TODO: Replace this with a more general sentinel with a callback on directory.
 # This can be used to check project name as well.
 def find_file_sentinel(start_dir, sentinel_file, sentinel_check=os.path.exists, max_depth=100):
@@ -0,0 +1,115 @@
+"""
+Tests the asynchronous `Remote` operations (`has_file_async`, `download_file_direct_async`,
+`download_to_cache_async`), including fallback along an overlay chain.
+"""
+
+import os
+
+from external_data_bazel import util
+
+from test_project import TestProject
+
+# Priority order: master -> mid -> base.
+remotes = {
+    "master": {"backend": "counting", "dir": "store/master", "overlay": "mid"},
+    "mid": {"backend": "counting", "dir": "store/mid", "overlay": "base"},
+    "base": {"backend": "counting", "dir": "store/base"},
+}
+
+
+def read(filepath):
+    with open(filepath, 'rb') as f:
+        return f.read()
+
+
+def get_calls(backends, name):
+    return dict((remote, backend.calls[name]) for remote, backend in backends.items())
+
+
+def expect_error(future, error_type, message):
+    error = future.exception()
+    assert isinstance(error, error_type), error
+    assert message in str(error), error
+
+
+tp = TestProject(remotes)
+try:
+    top_file = tp.add_file("data/top.bin", b"Top contents", ["master"])
+    base_file = tp.add_file("data/base.bin", b"Base contents", ["base"])
+    missing_file = tp.add_file("data/missing.bin", b"Missing contents")
+    project = tp.load()
+    top, base, missing = [project.get_file_info(f) for f in [top_file, base_file, missing_file]]
+    remote = top.remote
+    backends = dict((r.name, r._backend) for r in remote._get_chain())
+
+    # `has_file_async` walks the chain until a remote has the file.
+    assert remote.has_file_async(top.hash, top.project_relpath).result() is True
+    assert get_calls(backends, 'has_file') == {"master": 1, "mid": 0, "base": 0}
+    assert remote.has_file_async(base.hash, base.project_relpath).result() is True
+    assert get_calls(backends, 'has_file') == {"master": 2, "mid": 1, "base": 1}
+    assert remote.has_file_async(missing.hash, missing.project_relpath).result() is False
+    assert get_calls(backends, 'has_file') == {"master": 3, "mid": 2, "base": 2}
+    # - Or only queries this remote.
+    assert remote.has_file_async(
+        base.hash, base.project_relpath, check_overlay=False).result() is False
+    assert get_calls(backends, 'has_file') == {"master": 4, "mid": 2, "base": 2}
+
+    # `download_file_direct_async` falls back along the chain on failure.
+    output_file = os.path.join(tp.root, "output.bin")
+    remote.download_file_direct_async(top.hash, top.project_relpath, output_file).result()
+    assert read(output_file) == b"Top contents"
+    assert get_calls(backends, 'download') == {"master": 1, "mid": 0, "base": 0}
+    os.remove(output_file)
+    remote.download_file_direct_async(base.hash, base.project_relpath, output_file).result()
+    assert read(output_file) == b"Base contents"
+    assert get_calls(backends, 'download') == {"master": 2, "mid": 1, "base": 1}
+    os.remove(output_file)
+    # - If no remote has the file, the last error is raised, and nothing is left behind.
+    expect_error(
+        remote.download_file_direct_async(missing.hash, missing.project_relpath, output_file),
+        util.DownloadError, "Unknown hash")
+    assert not os.path.exists(output_file)
+    assert get_calls(backends, 'download') == {"master": 3, "mid": 2, "base": 2}
+
+    # `download_to_cache_async` downloads on a cache miss.
+    cache_path, status = remote.download_to_cache_async(base.hash, base.project_relpath).result()
+    assert (cache_path, status) == (tp.get_cache_path(base_file), 'download')
+    assert read(cache_path) == b"Base contents"
+    assert get_calls(backends, 'download') == {"master": 4, "mid": 3, "base": 3}
+    # - And not on a hit.
+    assert remote.download_to_cache_async(base.hash, base.project_relpath).result() == \
+        (cache_path, 'cached')
+    assert get_calls(backends, 'download') == {"master": 4, "mid": 3, "base": 3}
+    # - Failures leave no cache entry or temporary files.
+    expect_error(remote.download_to_cache_async(missing.hash, missing.project_relpath),
+                 util.DownloadError, "Unknown hash")
+    assert not os.path.exists(tp.get_cache_path(missing_file))
+    cache_files = [os.path.join(d, f) for d, _, files in os.walk(tp.cache_dir) for f in files]
+    assert cache_files == [cache_path], cache_files
+finally:
+    tp.cleanup()
+
+# With `probe: parallel`, the asynchronous operations download from the probe's winner.
+remotes["master"]["probe"] = "parallel"
+tp = TestProject(remotes)
+try:
+    base_file = tp.add_file("data/base.bin", b"Base contents", ["base"])
+    missing_file = tp.add_file("data/missing.bin", b"Missing contents")
+    project = tp.load()
+    base, missing = [project.get_file_info(f) for f in [base_file, missing_file]]
+    remote = base.remote
+    backends = dict((r.name, r._backend) for r in remote._get_chain())
+
+    assert remote.has_file_async(base.hash, base.project_relpath).result() is True
+    assert remote.has_file_async(missing.hash, missing.project_relpath).result() is False
+    cache_path, status = remote.download_to_cache_async(base.hash, base.project_relpath).result()
+    assert status == 'download'
+    assert read(cache_path) == b"Base contents"
+    assert get_calls(backends, 'download') == {"master": 0, "mid": 0, "base": 1}
+    expect_error(remote.download_to_cache_async(missing.hash, missing.project_relpath),
+                 util.DownloadError, "No remote in the chain of 'master'")
+    assert get_calls(backends, 'download') == {"master": 0, "mid": 0, "base": 1}
+finally:
+    tp.cleanup()
+
+print("[ Done ]")
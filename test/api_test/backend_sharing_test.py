@@ -0,0 +1,45 @@
+"""
+Tests that remotes with equivalent backend configurations share a backend instance (across
+packages and `file_overrides`), unless the backend is not `shareable`.
+"""
+
+from test_project import TestProject
+
+store = {"backend": "counting", "dir": "store/master"}
+remotes = {"master": store}
+tp = TestProject(remotes)
+try:
+    # Same configuration, in another package (differing only in remote-only settings).
+    tp.write_package("a", {"a": dict(store, check_always=True)}, "a",
+                     file_overrides={"override.bin": dict(store)})
+    # Different configuration.
+    tp.write_package("b", {"b": {"backend": "counting", "dir": "store/other"}}, "b")
+    # Not shareable.
+    unshared = {"backend": "counting_unshared", "dir": "store/master"}
+    tp.write_package("c", {"c": unshared}, "c")
+    tp.write_package("d", {"d": unshared}, "d")
+    hash_files = dict(
+        (name, tp.add_file(relpath, name.encode('utf-8'), ["master"])) for name, relpath in [
+            ("root", "root.bin"), ("a", "a/a.bin"), ("override", "a/override.bin"),
+            ("b", "b/b.bin"), ("c", "c/c.bin"), ("d", "d/d.bin")])
+    project = tp.load()
+    remotes = dict((name, project.get_file_info(hash_file).remote)
+                   for name, hash_file in hash_files.items())
+    backends = dict((name, remote._backend) for name, remote in remotes.items())
+
+    assert remotes["a"] is not remotes["root"]
+    assert backends["a"] is backends["root"]
+    assert remotes["override"] is not remotes["a"]
+    assert backends["override"] is backends["root"]
+    assert backends["b"] is not backends["root"]
+    assert backends["c"] is not backends["d"]
+    assert backends["c"].package is remotes["c"].package
+    assert backends["d"].package is remotes["d"].package
+    # Shared state, e.g. counters.
+    for name in ["root", "a", "override"]:
+        info = project.get_file_info(hash_files[name])
+        assert info.remote.has_file(info.hash, info.project_relpath)
+    assert backends["root"].calls['has_file'] == 3
+finally:
+    tp.cleanup()
+print("[ Done ]")
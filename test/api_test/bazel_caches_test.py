@@ -0,0 +1,137 @@
+"""
+Tests Bazel's caches (see `bazel_caches.py`): recording secondary SHA-256 digests on upload,
+importing files from a repository cache or disk cache rather than downloading them (unless their
+contents mismatch), and `cache export` into both layouts, including packed entries.
+"""
+
+import hashlib
+import os
+
+from external_data_bazel import bazel_caches, cache, metrics, upload
+
+from test_project import TestProject, parse_args
+
+
+def sha256(contents):
+    return hashlib.sha256(contents).hexdigest()
+
+
+def write(filepath, contents):
+    if not os.path.isdir(os.path.dirname(filepath)):
+        os.makedirs(os.path.dirname(filepath))
+    with open(filepath, 'wb') as f:
+        f.write(contents)
+
+
+def read(filepath):
+    with open(filepath, 'rb') as f:
+        return f.read()
+
+
+def get_imports():
+    return metrics.get_metrics().get("bazel_cache_imports", remote="master")
+
+
+remotes = {"master": {"backend": "counting", "dir": "store/master"}}
+contents = {
+    "repository": b"Contents in the repository cache",
+    "disk": b"Contents in the disk cache",
+    "corrupt": b"Contents corrupted in the disk cache",
+    "small": b"Small",
+}
+tp = TestProject(remotes, user_config={"core": {"pack_threshold": "16"}})
+try:
+    repository_dir = os.path.join(tp.root, "bazel", "repository")
+    disk_dir = os.path.join(tp.root, "bazel", "disk")
+    tp.user_config["bazel_caches"] = {
+        "repository_cache": [repository_dir], "disk_cache": [disk_dir]}
+    hash_files = {}
+    for name, data in contents.items():
+        hash_files[name] = tp.add_file("data/{}.bin".format(name), data, ["master"])
+        write(os.path.join(tp.root, "data", name + ".bin"), data)
+    # Record secondary SHA-256 digests, by which Bazel's caches are addressed.
+    filepaths = [hash_file[:-len(".sha512")] for hash_file in hash_files.values()]
+    args = parse_args(upload, ["--update_only", "--secondary_sha256"] + filepaths)
+    assert upload.run(args, tp.load())
+    for name, data in contents.items():
+        # Hash files stay one line (as read by older versions, and by CMake/ExternalData).
+        assert read(hash_files[name]) == hashlib.sha512(data).hexdigest() + "\n"
+        secondary_file = os.path.join(tp.root, "data", name + ".bin.secondary_sha256")
+        assert read(secondary_file) == sha256(data) + "\n"
+    # - Later uploads keep them, even without `--secondary_sha256`.
+    assert upload.run(parse_args(upload, ["--update_only", filepaths[0]]), tp.load())
+    assert os.path.exists(filepaths[0] + ".secondary_sha256")
+    write(bazel_caches.get_repository_cache_path(repository_dir, sha256(contents["repository"])),
+          contents["repository"])
+    write(bazel_caches.get_disk_cache_paths(disk_dir, sha256(contents["disk"]))[0],
+          contents["disk"])
+    corrupt_path = bazel_caches.get_disk_cache_paths(disk_dir, sha256(contents["corrupt"]))[0]
+    write(corrupt_path, b"Not the expected contents")
+
+    project = tp.load()
+    infos = dict((name, project.get_file_info(hash_file)) for name, hash_file in hash_files.items())
+    remote = infos["repository"].remote
+    backend = remote._backend
+
+    # Files in the repository cache are imported, not downloaded.
+    imports = get_imports()
+    info = infos["repository"]
+    cache_path, _ = remote.download_to_cache(info.hash, info.project_relpath)
+    assert read(cache_path) == contents["repository"]
+    assert backend.calls['download'] == 0
+    assert get_imports() == imports + 1
+    # - Likewise for the disk cache (asynchronously).
+    info = infos["disk"]
+    cache_path, _ = remote.download_to_cache_async(info.hash, info.project_relpath).result()
+    assert read(cache_path) == contents["disk"]
+    assert backend.calls['download'] == 0
+    assert get_imports() == imports + 2
+
+    # Mismatching files in Bazel's caches are ignored (and left alone).
+    for download_to_cache in [
+            remote.download_to_cache,
+            lambda *args: remote.download_to_cache_async(*args).result()]:
+        info = infos["corrupt"]
+        cache_path = tp.get_cache_path(hash_files["corrupt"])
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        assert download_to_cache(info.hash, info.project_relpath)[0] == cache_path
+        assert read(cache_path) == contents["corrupt"]
+        assert get_imports() == imports + 2
+        assert read(corrupt_path) == b"Not the expected contents"
+    assert backend.calls['download'] == 2
+
+    # `cache export` publishes every entry, including packed ones, into both layouts.
+    info = infos["small"]
+    assert remote.download_to_cache(info.hash, info.project_relpath)[0] is None
+    export_repository_dir = os.path.join(tp.root, "export", "repository")
+    export_disk_dir = os.path.join(tp.root, "export", "disk")
+    args = parse_args(cache, [
+        "export", "--repository_cache", export_repository_dir, "--disk_cache", export_disk_dir])
+    exports = metrics.get_metrics().get("bazel_cache_exports")
+    assert cache.run(args, project.user)
+    assert metrics.get_metrics().get("bazel_cache_exports") == exports + 2 * len(contents)
+    for data in contents.values():
+        value = sha256(data)
+        repository_path = bazel_caches.get_repository_cache_path(export_repository_dir, value)
+        disk_path = bazel_caches.get_disk_cache_paths(export_disk_dir, value)[0]
+        for path in [repository_path, disk_path]:
+            assert read(path) == data, path
+            assert not os.stat(path).st_mode & 0o222, path
+    # - Existing files are kept.
+    assert cache.run(args, project.user)
+    assert metrics.get_metrics().get("bazel_cache_exports") == exports + 2 * len(contents)
+    # - Exported files are found by later imports.
+    tp.user_config["bazel_caches"] = {
+        "repository_cache": [export_repository_dir], "disk_cache": []}
+    os.remove(tp.get_cache_path(hash_files["disk"]))
+    project = tp.load()
+    info = project.get_file_info(hash_files["disk"])
+    cache_path, _ = info.remote.download_to_cache(info.hash, info.project_relpath)
+    assert read(cache_path) == contents["disk"]
+    assert info.remote._backend.calls['download'] == 0
+    assert get_imports() == imports + 3
+finally:
+    tp.cleanup()
+
+print("[ Done ]")
@@ -0,0 +1,55 @@
+"""
+Tests `cache verify`: quarantining, its result (i.e. the exit status), `--refetch`, and entries
+removed during a scrub.
+"""
+
+import os
+
+from external_data_bazel import cache
+
+from test_project import TestProject, parse_args
+
+remotes = {"master": {"backend": "counting", "dir": "store/master"}}
+tp = TestProject(remotes)
+try:
+    hash_files = [tp.add_file("data/{}.bin".format(i), b"Contents " * i, ["master"])
+                  for i in range(1, 4)]
+    project = tp.load()
+    for hash_file in hash_files:
+        info = project.get_file_info(hash_file)
+        info.remote.download_to_cache(info.hash, info.project_relpath)
+    user = project.user
+    assert cache.run(parse_args(cache, ['verify']), user)
+
+    # Corrupt an entry.
+    cache_path = tp.get_cache_path(hash_files[0])
+    os.chmod(cache_path, 0o644)
+    with open(cache_path, 'ab') as f:
+        f.write(b"!")
+    assert not cache.run(parse_args(cache, ['verify']), user)
+    assert not os.path.exists(cache_path)
+    assert os.listdir(os.path.join(tp.cache_dir, cache.QUARANTINE_RELPATH))
+    assert cache.run(parse_args(cache, ['verify']), user)
+
+    # Re-fetching repairs it.
+    cache_path = tp.get_cache_path(hash_files[1])
+    os.chmod(cache_path, 0o644)
+    with open(cache_path, 'ab') as f:
+        f.write(b"!")
+    os.chdir(tp.root)
+    assert cache.run(parse_args(cache, ['verify', '--refetch', 'data']), user, project)
+    assert os.path.isfile(cache_path)
+    # - Not if the entry is not referenced under the given paths.
+    os.chmod(cache_path, 0o644)
+    with open(cache_path, 'ab') as f:
+        f.write(b"!")
+    os.makedirs(os.path.join(tp.root, 'empty'))
+    assert not cache.run(parse_args(cache, ['verify', '--refetch', 'empty']), user, project)
+
+    # Entries removed after being listed are skipped.
+    missing = os.path.join(tp.cache_dir, 'missing')
+    item, ok, _ = cache._verify_entry((missing, 0, None, 'sha512', '00', None))
+    assert ok is None
+finally:
+    tp.cleanup()
+print("[ Done ]")
@@ -0,0 +1,123 @@
+"""
+Tests parallel probing of an overlay chain (`probe: parallel`): the highest-priority remote which
+has a file wins (regardless of which answers first), lower-priority probes are cancelled once the
+winner is known, downloads fall back from the winner to its overlays, and there is an error if no
+remote has the file.
+"""
+
+import os
+import time
+
+from external_data_bazel import metrics, util
+
+from test_project import TestProject
+
+CONTENTS = b"Probed contents"
+# Priority order: master -> mid -> base.
+CHAIN = [("master", "mid"), ("mid", "base"), ("base", None)]
+
+
+def run_chain(stores, configs, func):
+    """ Calls `func(remote, info, backends, output_file)` for a file placed in `stores`, where
+    `remote` ("master") probes its overlays in parallel, and `configs` gives extra backend config
+    per remote. """
+    remotes = {}
+    for name, overlay in CHAIN:
+        remote = {"backend": "counting", "dir": "store/" + name}
+        if name == "master":
+            remote["probe"] = "parallel"
+        remote.update(configs.get(name, {}))
+        if overlay is not None:
+            remote["overlay"] = overlay
+        remotes[name] = remote
+    tp = TestProject(remotes)
+    try:
+        hash_file = tp.add_file("data/a.bin", CONTENTS, stores)
+        info = tp.load().get_file_info(hash_file)
+        backends = dict((remote.name, remote._backend) for remote in info.remote._get_chain())
+        func(info.remote, info, backends, os.path.join(tp.root, "output.bin"))
+    finally:
+        tp.cleanup()
+
+
+def read(filepath):
+    with open(filepath, 'rb') as f:
+        return f.read()
+
+
+def get_downloads(backends):
+    return dict((name, backend.calls['download']) for name, backend in backends.items())
+
+
+def get_metric(name, **labels):
+    return metrics.get_metrics().get(name, **labels)
+
+
+# The highest-priority remote wins, even if lower-priority remotes answer first.
+def check_winner(remote, info, backends, output_file):
+    winners = get_metric("probe_winners", remote="master", winner="master")
+    assert remote.has_file(info.hash, info.project_relpath)
+    remote.download_file_direct(info.hash, info.project_relpath, output_file)
+    assert read(output_file) == CONTENTS
+    assert get_downloads(backends) == {"master": 1, "mid": 0, "base": 0}
+    assert get_metric("probe_winners", remote="master", winner="master") == winners + 2
+    # Every remote was queried, once per probe.
+    for backend in backends.values():
+        assert backend.calls['has_file'] == 2
+run_chain(["master", "mid", "base"], {"master": {"delay": 0.3}}, check_winner)
+
+
+# If it does not have the file, the next remote in the chain wins.
+def check_next(remote, info, backends, output_file):
+    winners = get_metric("probe_winners", remote="master", winner="mid")
+    remote.download_file_direct(info.hash, info.project_relpath, output_file)
+    assert read(output_file) == CONTENTS
+    assert get_downloads(backends) == {"master": 0, "mid": 1, "base": 0}
+    assert get_metric("probe_winners", remote="master", winner="mid") == winners + 1
+run_chain(["mid", "base"], {"mid": {"delay": 0.3}}, check_next)
+
+
+# Once the winner is known, lower-priority probes are cancelled rather than waited on.
+def check_cancel(remote, info, backends, output_file):
+    start = time.time()
+    remote.download_file_direct(info.hash, info.project_relpath, output_file)
+    assert time.time() - start < 2
+    assert read(output_file) == CONTENTS
+    assert not backends["master"].probes[-1].cancelled()
+    assert backends["base"].probes[-1].cancelled()
+    assert get_downloads(backends) == {"master": 1, "mid": 0, "base": 0}
+run_chain(["master", "mid", "base"], {"base": {"delay": 5}}, check_cancel)
+
+
+# If the winner's download fails, the download falls back along its overlays.
+def check_fallback(remote, info, backends, output_file):
+    fallbacks = get_metric("overlay_fallbacks", remote="master", overlay="mid")
+    remote.download_file_direct(info.hash, info.project_relpath, output_file)
+    assert read(output_file) == CONTENTS
+    assert get_downloads(backends) == {"master": 1, "mid": 1, "base": 0}
+    assert get_metric("overlay_fallbacks", remote="master", overlay="mid") == fallbacks + 1
+run_chain(["master", "mid", "base"], {"master": {"fail_downloads": True}}, check_fallback)
+
+
+# No winner.
+def check_none(remote, info, backends, output_file):
+    assert not remote.has_file(info.hash, info.project_relpath)
+    try:
+        remote.download_file_direct(info.hash, info.project_relpath, output_file)
+        assert False, "Expected an error"
+    except util.DownloadError as e:
+        assert "No remote in the chain of 'master'" in str(e), e
+        assert "master, mid, base" in str(e), e
+    assert not os.path.exists(output_file)
+    assert get_downloads(backends) == {"master": 0, "mid": 0, "base": 0}
+run_chain([], {}, check_none)
+
+
+# Unknown modes are rejected.
+try:
+    run_chain([], {"master": {"probe": "random"}}, lambda *args: None)
+    assert False, "Expected an error"
+except RuntimeError as e:
+    assert "unknown probe mode: random" in str(e), e
+
+print("[ Done ]")
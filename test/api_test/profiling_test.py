@@ -0,0 +1,40 @@
+"""
+Tests profiling (see `profiling.py`), as enabled by `cli.py --profile`: a command's trace records
+project loading, transfers and hash checks, including those on the asynchronous path, with
+concurrent work on separate tracks.
+"""
+
+import json
+import os
+
+from external_data_bazel import prefetch, profiling
+
+from test_project import TestProject, parse_args
+
+# Downloads take long enough that they overlap on the thread pool.
+remotes = {"master": {"backend": "counting", "dir": "store/master", "download_delay": 0.2}}
+tp = TestProject(remotes)
+try:
+    for i in range(4):
+        tp.add_file("data/file_{}.bin".format(i), "Contents {}".format(i).encode(), ["master"])
+    profile = os.path.join(tp.root, "profile.json")
+    # As `cli.py --profile`.
+    profiling.enable()
+    assert prefetch.run(parse_args(prefetch, [os.path.join(tp.root, "data")], jobs=4), tp.load())
+    profiling.write(profile)
+
+    with open(profile) as f:
+        trace = json.load(f)
+    spans = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    def get_tids(name):
+        return set(span["tid"] for span in spans if span["name"] == name)
+    for name in ["load_project", "Remote.download_file_direct", "Hash.check_file"]:
+        assert get_tids(name), name
+    assert len(get_tids("Remote.download_file_direct")) > 1, spans
+    # Each track is named.
+    names = [event for event in trace["traceEvents"] if event["ph"] == "M"]
+    assert set(event["tid"] for event in names) >= set(span["tid"] for span in spans)
+finally:
+    tp.cleanup()
+
+print("[ Done ]")
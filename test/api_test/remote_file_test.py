@@ -0,0 +1,106 @@
+"""
+Tests partial reads (`Project.open_remote`, via `remote_file.RemoteFile`): fetching only the blocks
+read, sharing them between readers, and completion into the cache (or a pack), including on a hash
+mismatch.
+"""
+
+import os
+
+from external_data_bazel import remote_file
+
+from test_project import TestProject
+
+BLOCK_SIZE = remote_file.BLOCK_SIZE
+
+
+def get_partial_path(tp, hash):
+    return os.path.join(tp.cache_dir, remote_file.PARTIAL_RELPATH, 'sha512', hash.get_value())
+
+
+remotes = {"master": {"backend": "counting", "dir": "store/master"}}
+tp = TestProject(remotes, user_config={"core": {"pack_threshold": "2M"}})
+try:
+    large = os.urandom(3 * BLOCK_SIZE + 1000)
+    small = os.urandom(BLOCK_SIZE + 1000)
+    large_file = tp.add_file("data/large.bin", large, ["master"])
+    small_file = tp.add_file("data/small.bin", small, ["master"])
+
+    # A tail read only fetches the last block.
+    project = tp.load()
+    info = project.get_file_info(large_file)
+    partial_path = get_partial_path(tp, info.hash)
+    backend = info.remote._backend
+    f = project.open_remote(large_file)
+    assert isinstance(f, remote_file.RemoteFile)
+    f.seek(-100, os.SEEK_END)
+    assert f.read() == large[-100:]
+    assert backend.ranges == [(3 * BLOCK_SIZE, 1000)]
+    assert os.path.isfile(partial_path + '.bitmap')
+    assert not os.path.exists(tp.get_cache_path(large_file))
+
+    # Another reader (e.g. process) reuses fetched blocks.
+    other_project = tp.load()
+    other_backend = other_project.get_file_info(large_file).remote._backend
+    other = other_project.open_remote(large_file)
+    other.seek(3 * BLOCK_SIZE)
+    assert other.read(10) == large[3 * BLOCK_SIZE:3 * BLOCK_SIZE + 10]
+    assert other_backend.ranges == []
+    # - Reading the rest completes the file, moving it into the cache.
+    other.seek(0)
+    assert other.read() == large
+    # - Only the missing blocks are fetched.
+    assert sum(size for _, size in other_backend.ranges) == 3 * BLOCK_SIZE
+    assert all(offset + size <= 3 * BLOCK_SIZE for offset, size in other_backend.ranges)
+    assert os.path.isfile(tp.get_cache_path(large_file))
+    assert not os.path.exists(partial_path)
+    assert not os.path.exists(partial_path + '.bitmap')
+    other.close()
+    # - The first reader switches to the cached file.
+    f.seek(BLOCK_SIZE)
+    assert f.read(10) == large[BLOCK_SIZE:BLOCK_SIZE + 10]
+    assert len(backend.ranges) == 1
+    f.close()
+    # - Later opens read the cached file.
+    f = tp.load().open_remote(large_file)
+    assert not isinstance(f, remote_file.RemoteFile)
+    f.close()
+
+    # Small files are completed into a pack.
+    info = project.get_file_info(small_file)
+    f = project.open_remote(small_file)
+    assert isinstance(f, remote_file.RemoteFile)
+    assert f.read() == small
+    f.close()
+    assert project.user.packs.get('sha512', info.hash.get_value()) == small
+    assert not os.path.exists(tp.get_cache_path(small_file))
+    assert not os.path.exists(get_partial_path(tp, info.hash))
+
+    # A hash mismatch on completion raises, and discards the partial file.
+    tp.user_config['core']['pack_threshold'] = None
+    corrupt_file = tp.add_file("data/corrupt.bin", large[:2 * BLOCK_SIZE], ["master"])
+    project = tp.load()
+    info = project.get_file_info(corrupt_file)
+    partial_path = get_partial_path(tp, info.hash)
+    f = project.open_remote(corrupt_file)
+    assert isinstance(f, remote_file.RemoteFile)
+    assert f.read(10) == large[:10]
+    with open(partial_path, 'r+b') as corrupt:
+        corrupt.write(b"!")
+    f.seek(BLOCK_SIZE)
+    try:
+        f.read()
+        assert False, "Should have failed"
+    except RuntimeError as e:
+        assert "Hash mismatch" in str(e)
+    f.close()
+    assert not os.path.exists(partial_path)
+    assert not os.path.exists(partial_path + '.bitmap')
+    assert not os.path.exists(tp.get_cache_path(corrupt_file))
+    # - Reading again starts over.
+    f = project.open_remote(corrupt_file)
+    assert f.read() == large[:2 * BLOCK_SIZE]
+    f.close()
+    assert os.path.isfile(tp.get_cache_path(corrupt_file))
+finally:
+    tp.cleanup()
+print("[ Done ]")
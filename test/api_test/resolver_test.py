@@ -0,0 +1,68 @@
+"""
+Tests `resolver`: project memoization, resolving (re-checking existing cache entries once per
+process), and files stored in packs.
+"""
+
+import os
+
+from external_data_bazel import resolver
+
+from test_project import TestProject
+
+
+def corrupt(filepath):
+    os.chmod(filepath, 0o644)
+    with open(filepath, 'ab') as f:
+        f.write(b"!")
+
+
+def read(filepath):
+    with open(filepath, 'rb') as f:
+        return f.read()
+
+
+remotes = {"master": {"backend": "counting", "dir": "store/master"}}
+tp = TestProject(remotes, user_config={"core": {"pack_threshold": "16"}})
+try:
+    new_file = tp.add_file("data/new.bin", b"Contents, not packed", ["master"])
+    old_file = tp.add_file("data/old.bin", b"Old contents, not packed", ["master"])
+    small_file = tp.add_file("data/small.bin", b"Small", ["master"])
+
+    # Projects are memoized per project root (and user config).
+    project = resolver.get_project(tp.root, user_config_file=tp.user_config_file)
+    assert resolver.get_project(
+        os.path.join(tp.root, "data"), user_config_file=tp.user_config_file) is project
+    assert resolver.get_project(tp.root) is not project
+    backend = project.get_file_info(new_file).remote._backend
+
+    # Download on first use.
+    path = resolver.resolve(new_file, project=project)
+    assert path == tp.get_cache_path(new_file)
+    assert read(path) == b"Contents, not packed"
+    assert backend.calls['download'] == 1
+    assert resolver.resolve(new_file, project=project) == path
+    assert backend.calls['download'] == 1
+
+    # Entries cached before this process resolves them (e.g. by another process) are checked.
+    info = project.get_file_info(old_file)
+    cache_path, _ = info.remote.download_to_cache(info.hash, info.project_relpath)
+    assert backend.calls['download'] == 2
+    corrupt(cache_path)
+    assert resolver.resolve(old_file, project=project) == cache_path
+    assert read(cache_path) == b"Old contents, not packed"
+    assert backend.calls['download'] == 3
+    # - Only once per process.
+    corrupt(cache_path)
+    assert resolver.resolve(old_file, project=project) == cache_path
+    assert backend.calls['download'] == 3
+
+    # Packed files are written out of the cache.
+    path = resolver.resolve(small_file, project=project)
+    assert not path.startswith(tp.cache_dir)
+    assert read(path) == b"Small"
+    assert not os.path.exists(tp.get_cache_path(small_file))
+    assert resolver.resolve(small_file, project=project) == path
+    assert backend.calls['download'] == 4
+finally:
+    tp.cleanup()
+print("[ Done ]")
@@ -0,0 +1,15 @@
+#!/bin/bash
+set -e -u -x
+
+# Tests the Python API (e.g. `resolver`) against throwaway projects with mock backends (see
+# `test_project.py`).
+
+cur_dir=$(cd $(dirname $0) && pwd)
+src_dir=$(cd ${cur_dir}/../../src && pwd)
+python=${PYTHON:-python2}
+
+for test in ${cur_dir}/*_test.py; do
+    PYTHONPATH=${src_dir}:${cur_dir} ${python} ${test}
+done
+
+echo "[ Done ]"
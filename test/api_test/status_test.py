@@ -0,0 +1,60 @@
+"""
+Tests `status` with the stat index (see `stat_index.py`): files which `download` wrote or `upload`
+hashed are not re-hashed, while modified files are.
+"""
+
+import os
+import sys
+import time
+from StringIO import StringIO
+
+from external_data_bazel import download, stat_index, status, upload
+
+from test_project import TestProject, parse_args
+
+
+def run_status(project):
+    """ @returns (number of files hashed, output lines). """
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = StringIO(), StringIO()
+    try:
+        assert status.run(parse_args(status, ["--local_only"], verbose=True), project)
+        out, err = sys.stdout.getvalue(), sys.stderr.getvalue()
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+    hashed = int(err.split("Hashed ")[1].split(" ")[0])
+    return hashed, out.splitlines()
+
+
+# Files are written moments before the index is saved, which would leave them racily clean.
+stat_index.RACY_WINDOW = 0
+
+remotes = {"master": {"backend": "counting", "dir": "store/master"}}
+tp = TestProject(remotes)
+try:
+    downloaded = tp.add_file("data/downloaded.bin", b"Downloaded contents", ["master"])
+    uploaded = os.path.join(tp.root, "data", "uploaded.bin")
+    with open(uploaded, 'wb') as f:
+        f.write(b"Uploaded contents")
+    # Not modified just before hashing.
+    past = time.time() - 10
+    os.utime(uploaded, (past, past))
+    os.chdir(tp.root)
+
+    assert download.run(parse_args(download, [downloaded]), tp.load())
+    assert upload.run(parse_args(upload, ["--update_only", uploaded]), tp.load())
+    assert run_status(tp.load()) == (0, [])
+
+    # Modified files are re-hashed (only once).
+    with open(uploaded, 'wb') as f:
+        f.write(b"Modified contents")
+    assert run_status(tp.load()) == (1, ["modified:     data/uploaded.bin"])
+    assert run_status(tp.load()) == (0, ["modified:     data/uploaded.bin"])
+    # Re-downloaded files (here, as a symlink into the cache) are recorded again.
+    os.remove(downloaded[:-len(".sha512")])
+    assert download.run(parse_args(download, [downloaded, "--symlink"]), tp.load())
+    assert run_status(tp.load()) == (0, ["modified:     data/uploaded.bin"])
+finally:
+    tp.cleanup()
+
+print("[ Done ]")
@@ -0,0 +1,176 @@
+"""
+Throwaway projects for the tests in this directory, whose remotes use `CountingBackend` (a `mock`
+backend which records calls).
+
+    tp = TestProject({"master": {"backend": "counting", "dir": "store/master"}})
+    hash_file = tp.add_file("data/a.bin", b"contents", ["master"])
+    project = tp.load()
+"""
+
+import argparse
+import collections
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import yaml
+
+from external_data_bazel import core, config_helpers, util
+from external_data_bazel.backends import get_default_backends
+from external_data_bazel.backends.mock import MockBackend
+
+
+class CountingBackend(MockBackend):
+    """ `mock` backend which counts calls per method (in `calls`), and keeps the (offset, size) of
+    ranges read (in `ranges`) and the futures of `has_file_async` (in `probes`).
+    Extra config:
+        delay: Seconds that `has_file` takes (e.g. to order parallel probes).
+        download_delay: Seconds that downloads take (e.g. so that concurrent downloads overlap).
+        fail_downloads: If true, downloads fail (after `has_file` reports the file). """
+    def __init__(self, config, package):
+        config = dict(config)
+        config.setdefault('upload_dir', os.path.join('upload', os.path.basename(config['dir'])))
+        store_dir = os.path.join(package.project.root, config['dir'])
+        if not os.path.isdir(store_dir):
+            os.makedirs(store_dir)
+        MockBackend.__init__(self, config, package)
+        self._delay = config.get('delay', 0)
+        self._download_delay = config.get('download_delay', 0)
+        self._fail_downloads = config.get('fail_downloads', False)
+        self._lock = threading.Lock()
+        self.calls = collections.defaultdict(int)
+        self.ranges = []
+        self.probes = []
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def has_file(self, hash, project_relpath):
+        self._count('has_file')
+        time.sleep(self._delay)
+        return MockBackend.has_file(self, hash, project_relpath)
+
+    def has_file_async(self, hash, project_relpath):
+        future = MockBackend.has_file_async(self, hash, project_relpath)
+        with self._lock:
+            self.probes.append(future)
+        return future
+
+    def _download_started(self, hash):
+        self._count('download')
+        time.sleep(self._download_delay)
+        if self._fail_downloads:
+            raise util.DownloadError("Failing download (`fail_downloads`): {}".format(hash))
+
+    def download_file(self, hash, project_relpath, output_file):
+        self._download_started(hash)
+        MockBackend.download_file(self, hash, project_relpath, output_file)
+
+    def download_stream(self, hash, project_relpath, write):
+        self._download_started(hash)
+        MockBackend.download_stream(self, hash, project_relpath, write)
+
+    def get_size(self, hash, project_relpath):
+        self._count('get_size')
+        return MockBackend.get_size(self, hash, project_relpath)
+
+    def download_range(self, hash, project_relpath, offset, size):
+        self._count('download_range')
+        with self._lock:
+            self.ranges.append((offset, size))
+        return MockBackend.download_range(self, hash, project_relpath, offset, size)
+
+
+class UnsharedCountingBackend(CountingBackend):
+    """ `CountingBackend` with an instance per remote (as for backends which depend on their
+    package). """
+    shareable = False
+
+
+def get_backends():
+    backends = get_default_backends()
+    backends['counting'] = CountingBackend
+    backends['counting_unshared'] = UnsharedCountingBackend
+    return backends
+
+
+def parse_args(command, argv, jobs=2, keep_going=False, verbose=False):
+    """ @returns Arguments for `command.run` (a subcommand module), including `cli.py`'s global
+    options. """
+    parser = argparse.ArgumentParser()
+    command.add_arguments(parser)
+    args = parser.parse_args(argv)
+    args.jobs = jobs
+    args.keep_going = keep_going
+    args.verbose = verbose
+    return args
+
+
+def write_yaml(filepath, data):
+    with open(filepath, 'w') as f:
+        yaml.safe_dump(data, f, default_flow_style=False)
+
+
+class TestProject(object):
+    """ Project in a temporary directory (`root`), with its own user cache (`cache_dir`). """
+    def __init__(self, remotes, remote='master', user_config=None):
+        self.root = tempfile.mkdtemp(prefix='external_data_test_')
+        self.cache_dir = os.path.join(self.root, 'cache')
+        self.user_config = config_helpers.merge_config(
+            {'core': {'cache_dir': self.cache_dir}}, user_config or {})
+        self.user_config_file = os.path.join(self.root, 'user.yml')
+        write_yaml(self.user_config_file, self.user_config)
+        with open(os.path.join(self.root, 'setup_config.py'), 'w') as f:
+            f.write("import test_project\nget_backends = test_project.get_backends\n")
+        write_yaml(os.path.join(self.root, core.PROJECT_CONFIG_FILE), {
+            'name': 'api_test',
+            'setup_config': 'setup_config.py',
+        })
+        self.write_package('', remotes, remote)
+
+    def write_package(self, relpath, remotes, remote=None, file_overrides=None):
+        """ Writes the package config for directory `relpath`. """
+        package_dir = os.path.join(self.root, relpath)
+        if not os.path.isdir(package_dir):
+            os.makedirs(package_dir)
+        config = {'remotes': remotes}
+        if remote is not None:
+            config['remote'] = remote
+        if file_overrides is not None:
+            config['file_overrides'] = file_overrides
+        write_yaml(os.path.join(package_dir, core.PACKAGE_CONFIG_FILE), config)
+
+    def add_file(self, relpath, contents, stores=()):
+        """ Writes the hash file for `relpath` (as `sha512`), and places `contents` in the stores
+        (`store/{name}/`) named in `stores`.
+        @returns Absolute path of the hash file. """
+        value = hashlib.sha512(contents).hexdigest()
+        for store in stores:
+            store_dir = os.path.join(self.root, 'store', store)
+            if not os.path.isdir(store_dir):
+                os.makedirs(store_dir)
+            with open(os.path.join(store_dir, value), 'wb') as f:
+                f.write(contents)
+        hash_file = os.path.join(self.root, relpath + '.sha512')
+        if not os.path.isdir(os.path.dirname(hash_file)):
+            os.makedirs(os.path.dirname(hash_file))
+        with open(hash_file, 'w') as f:
+            f.write(value + "\n")
+        return hash_file
+
+    def load(self):
+        """ @returns A new `core.Project` (with new backends, which see the stores as they are
+        now). """
+        return core.load_project(self.root, user_config_in=self.user_config)
+
+    def get_cache_path(self, hash_file):
+        with open(hash_file) as f:
+            value = f.readline().strip()
+        return core.get_cas_path(self.cache_dir, 'sha512', value)
+
+    def cleanup(self):
+        shutil.rmtree(self.root)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Minimal stand-in for a Bazel HTTP remote cache (`cas/` only: GET, HEAD, PUT), for testing.
+
+Blobs are stored as `{store_dir}/cas/{sha256}`; uploads whose contents do not match their digest are
+rejected. `GET /stats` returns the number of requests per kind.
+
+Usage: cache_server.py PORT STORE_DIR [--token TOKEN]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+parser = argparse.ArgumentParser()
+parser.add_argument('port', type=int)
+parser.add_argument('store_dir', type=str)
+parser.add_argument('--token', type=str, default=None,
+                    help="If set, requests require 'Authorization: Bearer TOKEN'.")
+args = parser.parse_args()
+
+stats = {}
+stats_lock = threading.Lock()
+
+
+def count(kind):
+    with stats_lock:
+        stats[kind] = stats.get(kind, 0) + 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *_):
+        pass
+
+    def _send(self, code, body=b'', content_type='application/octet-stream', length=None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body) if length is None else length))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _blob_path(self):
+        # Returns the path for `/cas/{sha256}`, or None (after responding) if invalid.
+        match = re.match(r'^/cas/([0-9a-f]{64})$', self.path)
+        if match is None:
+            self._send(404)
+            return None
+        if args.token is not None and self.headers.get('Authorization') != 'Bearer ' + args.token:
+            self._send(401)
+            return None
+        return os.path.join(args.store_dir, 'cas', match.group(1))
+
+    def do_HEAD(self):
+        path = self._blob_path()
+        if path is None:
+            return
+        count('head')
+        if os.path.isfile(path):
+            self._send(200, length=os.path.getsize(path))
+        else:
+            self._send(404)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            with stats_lock:
+                self._send(200, json.dumps(stats), 'application/json')
+            return
+        path = self._blob_path()
+        if path is None:
+            return
+        count('get')
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                self._send(200, f.read())
+        else:
+            self._send(404)
+
+    def do_PUT(self):
+        path = self._blob_path()
+        if path is None:
+            return
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if hashlib.sha256(data).hexdigest() != os.path.basename(path):
+            self._send(400)
+            return
+        count('put')
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_file, path)
+        self._send(200)
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+if not os.path.isdir(os.path.join(args.store_dir, 'cas')):
+    os.makedirs(os.path.join(args.store_dir, 'cas'))
+Server(('127.0.0.1', args.port), Handler).serve_forever()
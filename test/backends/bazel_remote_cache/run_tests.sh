@@ -0,0 +1,93 @@
+#!/bin/bash
+set -e -u -x
+
+# Tests the `bazel_remote_cache` backend against a local stand-in server (`cache_server.py`).
+
+cur_dir=$(cd $(dirname $0) && pwd)
+src_dir=$(cd ${cur_dir}/../../../src && pwd)
+python=${PYTHON:-python2}
+port=${CACHE_PORT:-8796}
+token=test-token
+
+tmp_dir=$(mktemp -d)
+server_pid=
+cleanup() {
+    [[ -n ${server_pid} ]] && kill ${server_pid}
+    rm -rf ${tmp_dir}
+}
+trap cleanup EXIT
+
+${python} ${cur_dir}/cache_server.py ${port} ${tmp_dir}/store --token ${token} &
+server_pid=$!
+url=http://127.0.0.1:${port}
+stats() { curl -s ${url}/stats | ${python} -c "import json, sys; print(json.load(sys.stdin).get('${1}', 0))"; }
+
+# Set up a project.
+project_dir=${tmp_dir}/project
+mkdir -p ${project_dir}/data
+cd ${project_dir}
+cat > .external_data.project.yml <<EOF
+name: bazel_remote_cache_test
+EOF
+cat > .external_data.yml <<EOF
+remote: master
+remotes:
+    master:
+        backend: bazel_remote_cache
+        url: ${url}/
+EOF
+cat > user.yml <<EOF
+core:
+    cache_dir: ${tmp_dir}/cache
+bazel_remote_cache:
+    url:
+        "${url}":
+            headers:
+                Authorization: "Bearer ${token}"
+EOF
+cli() { PYTHONPATH=${src_dir} ${python} ${src_dir}/external_data_bazel/cli.py --user_config=${project_dir}/user.yml "$@"; }
+
+# Wait for the server.
+for i in $(seq 50); do curl -s ${url}/stats > /dev/null && break; sleep 0.1; done
+
+cd data
+files=
+for i in $(seq 5); do
+    echo "Contents ${i}" > file_${i}.bin
+    files="${files} file_${i}.bin"
+done
+
+# Upload (as SHA-256, i.e. the cache's digests).
+cli upload --hash_type=sha256 ${files}
+[[ $(stats put) -eq 5 ]]
+[[ -f ${tmp_dir}/store/cas/$(cat file_1.bin.sha256) ]]
+# Already present.
+cli upload file_1.bin | grep 'File already uploaded'
+cli upload --plan file_1.bin file_2.bin | grep '0 to upload'
+[[ $(stats put) -eq 5 ]]
+
+# Download into an empty cache (synchronously and concurrently).
+rm -rf ${tmp_dir}/cache ${files}
+cli download file_1.bin.sha256
+cli --jobs=4 download --force *.sha256
+[[ $(cat file_3.bin) == "Contents 3" ]]
+[[ $(stats get) -eq 5 ]]
+cli check *.sha256
+
+# Missing blobs fail.
+echo 0000000000000000000000000000000000000000000000000000000000000000 > missing.bin.sha256
+cli download missing.bin.sha256 && exit 1
+cli check missing.bin.sha256 && exit 1
+rm missing.bin.sha256
+
+# Other hash types are not supported.
+echo "Other" > other.bin
+cli upload other.bin && exit 1
+
+# Authentication is required.
+sed -i 's#Bearer .*#Bearer wrong"#' ${project_dir}/user.yml
+rm -rf ${tmp_dir}/cache file_1.bin
+cli download file_1.bin.sha256 && exit 1
+cli check file_1.bin.sha256 && exit 1
+
+echo "[ Done ]"
@@ -0,0 +1,189 @@
+#!/bin/bash
+set -e -u -x
+
+# Tests the `cas` backend (a content-addressed directory, e.g. on a shared mount).
+
+cur_dir=$(cd $(dirname $0) && pwd)
+src_dir=$(cd ${cur_dir}/../../../src && pwd)
+python=${PYTHON:-python2}
+
+tmp_dir=$(mktemp -d)
+trap "rm -rf ${tmp_dir}" EXIT
+
+store_dir=${tmp_dir}/store
+cache_dir=${tmp_dir}/cache
+# Paths of a hash value (and algorithm, defaulting to sha512).
+store_path() { echo ${store_dir}/${2:-sha512}/${1:0:2}/${1:2:2}/${1}; }
+cache_path() { echo ${cache_dir}/${2:-sha512}/${1:0:2}/${1:2:2}/${1}; }
+inode() { stat -c %i ${1}; }
+
+# Set up a project.
+project_dir=${tmp_dir}/project
+mkdir -p ${project_dir}/data
+cd ${project_dir}
+cat > .external_data.project.yml <<EOF
+name: cas_test
+EOF
+cat > .external_data.yml <<EOF
+remote: master
+remotes:
+    master:
+        backend: cas
+        dir: ${store_dir}
+EOF
+cat > user.yml <<EOF
+core:
+    cache_dir: ${cache_dir}
+EOF
+cli() { PYTHONPATH=${src_dir} ${python} ${src_dir}/external_data_bazel/cli.py --user_config=${project_dir}/user.yml "$@"; }
+
+cd data
+files=
+for i in $(seq 3); do
+    echo "Contents ${i}" > file_${i}.bin
+    files="${files} file_${i}.bin"
+done
+
+# Upload.
+cli upload ${files}
+[[ $(find ${store_dir}/sha512 -type f | wc -l) -eq 3 ]]
+stored=$(store_path $(cat file_1.bin.sha512))
+diff ${stored} file_1.bin
+# - Read-only, so that outputs linked to the store cannot modify it.
+[[ $(stat -c %a ${stored}) == 444 ]]
+# - No temporary files are left behind.
+[[ -z $(find ${store_dir}/tmp -type f) ]]
+
+# Deduplicated by hash.
+cp file_1.bin copy.bin
+cli upload copy.bin | grep 'File already uploaded'
+[[ $(find ${store_dir}/sha512 -type f | wc -l) -eq 3 ]]
+
+# Download.
+rm -rf ${cache_dir} ${files} copy.bin
+cli download *.sha512
+for i in $(seq 3); do
+    [[ $(cat file_${i}.bin) == "Contents ${i}" ]]
+done
+# - The cache is hardlinked to the store (`hardlink_cache`), but outputs are copies.
+value=$(cat file_1.bin.sha512)
+[[ $(inode $(cache_path ${value})) -eq $(inode ${stored}) ]]
+[[ $(inode file_1.bin) -ne $(inode ${stored}) ]]
+echo "Edited" > file_1.bin
+[[ $(cat ${stored}) == "Contents 1" ]]
+cli check *.sha512
+# - `--profile` writes a trace of the command.
+cli --profile=${tmp_dir}/profile.json check file_*.bin.sha512
+${python} - ${tmp_dir}/profile.json <<EOF
+import json, sys
+names = set(event["name"] for event in json.load(open(sys.argv[1]))["traceEvents"])
+assert {"load_project", "Remote.has_file"} <= names, names
+EOF
+
+# Without `hardlink_cache`, the cache holds copies.
+sed -i "s#dir: .*#&\n        hardlink_cache: false#" ${project_dir}/.external_data.yml
+rm -rf ${cache_dir}
+cli download --force file_1.bin.sha512
+[[ $(inode $(cache_path ${value})) -ne $(inode ${stored}) ]]
+diff $(cache_path ${value}) ${stored}
+
+# Missing blobs fail.
+echo "Missing" | sha512sum | cut -d' ' -f1 > missing.bin.sha512
+cli download missing.bin.sha512 && exit 1
+cli check missing.bin.sha512 && exit 1
+[[ ! -f missing.bin ]]
+
+# Tree hashes (`sha512_tree`, for multi-core hashing), over more than one chunk of 8 MiB. Once
+# uploaded, the hash type follows from the hash file's suffix.
+head -c 9M /dev/urandom > tree.bin
+cli upload --hash_type=sha512_tree tree.bin
+[[ -f tree.bin.sha512_tree && ! -f tree.bin.sha512 ]]
+[[ $(wc -l < tree.bin.sha512_tree) -eq 1 ]]
+tree_value=$(cat tree.bin.sha512_tree)
+[[ ${tree_value} != $(sha512sum tree.bin | cut -d' ' -f1) ]]
+diff $(store_path ${tree_value} sha512_tree) tree.bin
+cli upload tree.bin | grep 'File already uploaded'
+[[ $(cat tree.bin.sha512_tree) == ${tree_value} ]]
+cli upload --hash_type=sha512 tree.bin && exit 1
+# - Download (by the original path), into the cache under `sha512_tree/`.
+mv tree.bin tree.orig
+cli download tree.bin
+diff tree.bin tree.orig
+diff $(cache_path ${tree_value} sha512_tree) tree.orig
+cli check tree.bin.sha512_tree
+rm tree.bin tree.orig
+
+# Chunked storage: revising a file only transfers the chunks that changed.
+chunked_store_dir=${tmp_dir}/store_chunked
+mkdir -p ${project_dir}/chunked
+cat > ${project_dir}/chunked/.external_data.yml <<EOF
+remote: chunked
+remotes:
+    chunked:
+        backend: cas
+        dir: ${chunked_store_dir}
+        chunked: true
+EOF
+echo "    record_metrics: true" >> ${project_dir}/user.yml
+counter() {
+    cli stats --format=prometheus | \
+        awk -v name="external_data_${1}_total" \
+            '$1 == name || index($1, name "{") == 1 { n += $2 } END { print int(n) }'
+}
+cd ${project_dir}/chunked
+head -c 8M /dev/urandom > large.bin
+cli upload large.bin
+[[ -n $(find ${chunked_store_dir}/manifests -type f) ]]
+[[ ! -d ${chunked_store_dir}/sha512 ]]
+num_chunks=$(find ${chunked_store_dir}/chunks -type f | wc -l)
+[[ ${num_chunks} -ge 4 ]]
+cp large.bin.sha512 original.bin.sha512
+# - Revise the middle of the file.
+printf "Revised" | dd of=large.bin bs=1 seek=$((4 * 1024 * 1024)) conv=notrunc
+cp large.bin revised.bin
+cli stats --clear
+cli upload large.bin
+[[ $(counter chunks_uploaded) -le 2 ]]
+[[ $(counter chunks_reused) -ge $((num_chunks - 2)) ]]
+# - Download the original into an empty cache, then the revision.
+rm -rf ${cache_dir}/sha512 ${cache_dir}/chunks large.bin
+cli stats --clear
+cli download original.bin.sha512
+[[ $(counter chunks_fetched) -eq ${num_chunks} ]]
+cli stats --clear
+cli download large.bin.sha512
+diff large.bin revised.bin > /dev/null
+[[ $(counter chunks_fetched) -le 2 ]]
+[[ $(counter chunks_reused) -ge $((num_chunks - 2)) ]]
+# - No temporary files are left behind.
+[[ -z $(find ${chunked_store_dir} ${cache_dir} -name '*.tmp') ]]
+
+# Fetch by hash alone (as for CMake/ExternalData), from the root package's remote.
+cd ${project_dir}
+value_2=$(cat data/file_2.bin.sha512)
+value_3=$(cat data/file_3.bin.sha512)
+missing=$(cat data/missing.bin.sha512)
+rm -rf ${cache_dir}/sha512
+cli stats --clear
+# - Triples are read from arguments and stdin; algorithms are case-insensitive.
+printf "sha512 ${value_3} out/c.bin\nSHA512 ${value_2} out/copy.bin\n" | \
+    cli fetch SHA512 ${value_2} out/b.bin --input -
+[[ $(cat out/b.bin) == "Contents 2" ]]
+[[ $(cat out/copy.bin) == "Contents 2" ]]
+[[ $(cat out/c.bin) == "Contents 3" ]]
+# - Duplicate hashes are fetched once, and not hashed again when placed.
+[[ $(counter downloads) -eq 2 ]]
+[[ $(counter hash_checks) -eq 2 ]]
+# - Objects which were already cached are checked once.
+cli stats --clear
+cli fetch SHA512 ${value_2} out/b.bin SHA512 ${value_2} out/copy.bin
+[[ $(counter downloads) -eq 0 ]]
+[[ $(counter hash_checks) -eq 1 ]]
+# - Missing objects fail; with `--keep_going`, the others are still placed.
+rm -rf out
+cli fetch SHA512 ${missing} out/missing.bin SHA512 ${value_3} out/c.bin && exit 1
+cli --keep_going fetch SHA512 ${missing} out/missing.bin SHA512 ${value_3} out/c.bin && exit 1
+[[ $(cat out/c.bin) == "Contents 3" ]]
+[[ ! -e out/missing.bin ]]
+
+echo "[ Done ]"
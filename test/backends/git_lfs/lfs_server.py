@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+Minimal stand-in for a Git LFS server (batch API, basic transfers), for testing.
+
+Objects are stored as `{store_dir}/{oid}`. `GET /stats` returns the number of requests per kind
+(e.g. to check that queries are batched).
+
+Usage: lfs_server.py PORT STORE_DIR [--token TOKEN]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+MEDIA_TYPE = 'application/vnd.git-lfs+json'
+
+parser = argparse.ArgumentParser()
+parser.add_argument('port', type=int)
+parser.add_argument('store_dir', type=str)
+parser.add_argument('--token', type=str, default=None,
+                    help="If set, batch requests require 'Authorization: Bearer TOKEN'.")
+args = parser.parse_args()
+
+stats = {}
+stats_lock = threading.Lock()
+
+
+def count(kind, value=1):
+    with stats_lock:
+        stats[kind] = stats.get(kind, 0) + value
+
+
+def object_path(oid):
+    assert len(oid) == 64 and all(c in '0123456789abcdef' for c in oid), oid
+    return os.path.join(args.store_dir, oid)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *_):
+        pass
+
+    def _send(self, code, body=b'', content_type=MEDIA_TYPE):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _base_url(self):
+        return 'http://{}'.format(self.headers['Host'])
+
+    def do_GET(self):
+        if self.path == '/stats':
+            with stats_lock:
+                self._send(200, json.dumps(stats), 'application/json')
+            return
+        oid = self.path.split('/')[-1]
+        if not self.path.startswith('/objects/') or not os.path.isfile(object_path(oid)):
+            self._send(404)
+            return
+        count('download')
+        with open(object_path(oid), 'rb') as f:
+            self._send(200, f.read(), 'application/octet-stream')
+
+    def do_PUT(self):
+        oid = self.path.split('/')[-1]
+        data = self._read_body()
+        if hashlib.sha256(data).hexdigest() != oid:
+            self._send(422)
+            return
+        count('upload')
+        tmp_file = object_path(oid) + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_file, object_path(oid))
+        self._send(200)
+
+    def do_POST(self):
+        request = json.loads(self._read_body())
+        if self.path == '/verify':
+            count('verify')
+            path = object_path(request['oid'])
+            ok = os.path.isfile(path) and os.path.getsize(path) == request['size']
+            self._send(200 if ok else 422)
+            return
+        if self.path != '/objects/batch':
+            self._send(404)
+            return
+        if args.token is not None and self.headers.get('Authorization') != 'Bearer ' + args.token:
+            self._send(401, json.dumps({'message': 'Credentials needed'}))
+            return
+        count('batch')
+        count('batch_objects', len(request['objects']))
+        objects = []
+        for obj in request['objects']:
+            oid = obj['oid']
+            out = {'oid': oid, 'size': obj['size'], 'authenticated': True}
+            exists = os.path.isfile(object_path(oid))
+            if request['operation'] == 'download':
+                if exists:
+                    out['size'] = os.path.getsize(object_path(oid))
+                    out['actions'] = {'download': {
+                        'href': '{}/objects/{}'.format(self._base_url(), oid),
+                        'header': {'X-Transfer': 'download'}}}
+                else:
+                    out['error'] = {'code': 404, 'message': 'Object does not exist'}
+            elif not exists:
+                out['actions'] = {
+                    'upload': {'href': '{}/upload/{}'.format(self._base_url(), oid)},
+                    'verify': {'href': '{}/verify'.format(self._base_url())},
+                }
+            objects.append(out)
+        self._send(200, json.dumps({'transfer': 'basic', 'objects': objects}))
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+if not os.path.isdir(args.store_dir):
+    os.makedirs(args.store_dir)
+Server(('127.0.0.1', args.port), Handler).serve_forever()
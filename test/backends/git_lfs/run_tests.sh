@@ -0,0 +1,103 @@
+#!/bin/bash
+set -e -u -x
+
+# Tests the `git_lfs` backend against a local stand-in server (`lfs_server.py`).
+
+cur_dir=$(cd $(dirname $0) && pwd)
+src_dir=$(cd ${cur_dir}/../../../src && pwd)
+python=${PYTHON:-python2}
+port=${LFS_PORT:-8797}
+token=test-token
+
+tmp_dir=$(mktemp -d)
+server_pid=
+cleanup() {
+    [[ -n ${server_pid} ]] && kill ${server_pid}
+    rm -rf ${tmp_dir}
+}
+trap cleanup EXIT
+
+${python} ${cur_dir}/lfs_server.py ${port} ${tmp_dir}/store --token ${token} &
+server_pid=$!
+url=http://127.0.0.1:${port}
+stats() { curl -s ${url}/stats | ${python} -c "import json, sys; print(json.load(sys.stdin).get('${1}', 0))"; }
+
+# Set up a project.
+project_dir=${tmp_dir}/project
+mkdir -p ${project_dir}/data
+cd ${project_dir}
+cat > .external_data.project.yml <<EOF
+name: git_lfs_test
+EOF
+cat > .external_data.yml <<EOF
+remote: master
+remotes:
+    master:
+        backend: git_lfs
+        url: ${url}
+EOF
+cat > user.yml <<EOF
+core:
+    cache_dir: ${tmp_dir}/cache
+git_lfs:
+    url:
+        "${url}":
+            headers:
+                Authorization: "Bearer ${token}"
+EOF
+cli() { PYTHONPATH=${src_dir} ${python} ${src_dir}/external_data_bazel/cli.py --user_config=${project_dir}/user.yml "$@"; }
+
+# Wait for the server.
+for i in $(seq 50); do curl -s ${url}/stats > /dev/null && break; sleep 0.1; done
+
+cd data
+files=
+for i in $(seq 10); do
+    echo "Contents ${i}" > file_${i}.bin
+    files="${files} file_${i}.bin"
+done
+
+# Upload (as SHA-256, i.e. LFS object ids).
+cli upload --hash_type=sha256 ${files}
+[[ $(stats upload) -eq 10 && $(stats verify) -eq 10 ]]
+[[ $(cat file_1.bin.sha256) == $(sha256sum file_1.bin | cut -f1 -d' ') ]]
+# Already present.
+cli upload file_1.bin | grep 'File already uploaded'
+[[ $(stats upload) -eq 10 ]]
+# Planned uploads deduplicate, and skip objects the server already has.
+cp file_1.bin copy_1.bin
+echo "Contents new" > new_1.bin
+cp new_1.bin new_2.bin
+cli upload --plan --hash_type=sha256 copy_1.bin new_1.bin new_2.bin | grep '1 to upload'
+[[ $(stats upload) -eq 11 && -f new_2.bin.sha256 && -f copy_1.bin.sha256 ]]
+rm copy_1.bin* new_*.bin*
+
+# Download into an empty cache; queries are batched.
+rm -rf ${tmp_dir}/cache ${files}
+batch_before=$(stats batch)
+cli download *.sha256
+[[ $(cat file_3.bin) == "Contents 3" ]]
+[[ $(( $(stats batch) - batch_before )) -lt 10 ]]
+[[ $(stats download) -eq 10 ]]
+
+# Remote checks (bulk).
+batch_before=$(stats batch)
+cli check *.sha256
+[[ $(( $(stats batch) - batch_before )) -lt 10 ]]
+
+# Missing objects fail.
+echo 0000000000000000000000000000000000000000000000000000000000000000 > missing.bin.sha256
+cli download missing.bin.sha256 && exit 1
+cli check missing.bin.sha256 && exit 1
+rm missing.bin.sha256
+
+# Other hash types are not supported by LFS.
+echo "Other" > other.bin
+cli upload other.bin && exit 1
+
+# Authentication is required.
+sed -i 's#Bearer .*#Bearer wrong"#' ${project_dir}/user.yml
+rm -rf ${tmp_dir}/cache file_1.bin
+cli download file_1.bin.sha256 && exit 1
+
+echo "[ Done ]"
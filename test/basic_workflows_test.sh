@@ -148,6 +148,8 @@ diff new.bin ./expected.txt > /dev/null
 rm new.bin
 ../tools/external_data download ./new.bin
 diff new.bin ./expected.txt > /dev/null
+# - `status` should report nothing out of date.
+../tools/external_data status | grep -E '^(modified|missing|not uploaded):' && should_fail
 
 # Now we wish to actively modify the file.
 cat > expected.txt <<EOF
@@ -157,6 +159,8 @@ EOF
 diff new.bin expected.txt > /dev/null && should_fail
 # - Now update local workspace version.
 cp expected.txt new.bin
+# - `status` should report the local modification.
+../tools/external_data status --local_only | grep '^modified: *new.bin$'
 # Change to development mode.
 sed -i 's/# Normal is implicit./mode = "devel",/g' ./BUILD.bazel
 cat ./BUILD.bazel
@@ -215,9 +219,16 @@ find . -name '*.sha512' | xargs ../tools/external_data check
 # Test in `data/`
 cd ../data/
 
+# Record metrics from here on (this is opt-in, since it writes to the cache directory).
+echo "  record_metrics: true" >> ../tools/external_data.user.yml
+
 # Remove any *.bin files that may have been from the original folder.
 find . -name '*.bin' | xargs rm -f
 
+# `prefetch` should populate the cache without creating any outputs.
+../tools/external_data prefetch .
+[[ -z $(find . -name '*.bin') ]]
+
 # @note Cache `./basic.bin` so that `./package/basic.bin` is valid,
 # just in case `find` does not process `./basic.bin` before `./package/basic.bin`.
 ../tools/external_data download ./basic.bin
@@ -225,6 +236,11 @@ find . -name '*.bin' | xargs rm -f
 # Ensure that we can download all files here (without `check`).
 # Use `-f` to overwrite (since we just downloaded `basic.bin`).
 find . -name '*.sha512' | xargs ../tools/external_data download -f
+# Metrics should have been recorded for the above downloads.
+../tools/external_data stats | grep '^Cache:'
+../tools/external_data stats --format=prometheus | grep '^external_data_cache_hits_total{remote="master"}'
+# The cache should verify cleanly.
+../tools/external_data cache verify | grep ': 0 quarantined$'
 # Same for `direct.bin`, when not consumed in Bazel.
 ../tools/external_data check ./direct.bin.sha512
 
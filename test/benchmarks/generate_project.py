@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""
+Generates a synthetic `external_data_bazel` project for benchmarking.
+
+Layout of the generated directory:
+    project/                    Project root, with nested packages `pkg_0/pkg_1/...`.
+        .external_data.project.yml
+        .external_data.yml      Root package; remote `master`.
+        pkg_0/.external_data.yml
+                                Remote `devel_0`, overlaying the parent package's remote.
+        ...
+    store/{mock,http}/{master,devel}/
+                                Backing storage for the `mock` and `url_templates` (HTTP) remotes.
+                                Every file is in `master`; only a fraction is also in `devel`, so
+                                the rest exercises overlay fallback.
+    cache/                      User cache.
+    user.yml                    User configuration.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+
+import yaml
+
+DEFAULT_SIZES = "4K:0.7,256K:0.25,8M:0.05"
+
+
+def parse_sizes(text):
+    """ Parse a size distribution, e.g. '4K:0.7,1M:0.3', into [(size, weight)]. """
+    from external_data_bazel.util import parse_size
+    sizes = []
+    for item in text.split(','):
+        size, weight = item.split(':')
+        sizes.append((parse_size(size), float(weight)))
+    return sizes
+
+
+def _write_yaml(filepath, config):
+    with open(filepath, 'w') as f:
+        yaml.dump(config, f, default_flow_style=False)
+
+
+def _mkdir(path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+
+def _remote_config(backend, name, port, overlay=None):
+    if backend == 'mock':
+        config = {
+            'backend': 'mock',
+            'dir': '../store/mock/{}'.format(name),
+            'upload_dir': '../store/mock/upload',
+        }
+    elif backend == 'http':
+        config = {
+            'backend': 'url_templates',
+            'url_templates': ['http://127.0.0.1:{}/{}/{{algo}}/{{hash}}'.format(port, name)],
+            'check': 'trusted',
+        }
+    else:
+        raise RuntimeError("Unknown backend: {}".format(backend))
+    if overlay is not None:
+        config['overlay'] = overlay
+    return config
+
+
+def generate(out_dir, backend='mock', num_packages=3, num_files=100, sizes=DEFAULT_SIZES,
+             devel_fraction=0.5, port=8000, seed=0):
+    """ Generate a synthetic project in `out_dir` (which is removed first).
+    @returns Dictionary describing the project (see `project.json`). """
+    rng = random.Random(seed)
+    size_dist = parse_sizes(sizes)
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    project_dir = os.path.join(out_dir, 'project')
+    store_dir = os.path.join(out_dir, 'store')
+    cache_dir = os.path.join(out_dir, 'cache')
+    _mkdir(project_dir)
+
+    # Project and user configuration.
+    _write_yaml(os.path.join(project_dir, '.external_data.project.yml'), {'name': 'benchmark'})
+    user_file = os.path.join(out_dir, 'user.yml')
+    _write_yaml(user_file, {'core': {'cache_dir': cache_dir}})
+
+    # Nested packages.
+    package_dirs = [project_dir]
+    _write_yaml(os.path.join(project_dir, '.external_data.yml'), {
+        'remote': 'master',
+        'remotes': {'master': _remote_config(backend, 'master', port)},
+    })
+    for i in range(num_packages):
+        package_dir = os.path.join(package_dirs[-1], 'pkg_{}'.format(i))
+        _mkdir(package_dir)
+        name = 'devel_{}'.format(i)
+        _write_yaml(os.path.join(package_dir, '.external_data.yml'), {
+            'remote': name,
+            'remotes': {name: _remote_config(backend, 'devel', port, overlay='..')},
+        })
+        package_dirs.append(package_dir)
+
+    # Files, distributed round-robin across packages.
+    for remote_name in ['master', 'devel']:
+        _mkdir(os.path.join(store_dir, 'mock', remote_name))
+        _mkdir(os.path.join(store_dir, 'http', remote_name, 'sha512'))
+    weights = [weight for _, weight in size_dist]
+    files = []
+    total_bytes = 0
+    for i in range(num_files):
+        pick = rng.random() * sum(weights)
+        for size, weight in size_dist:
+            pick -= weight
+            if pick <= 0:
+                break
+        contents = os.urandom(size)
+        value = hashlib.sha512(contents).hexdigest()
+        package_dir = package_dirs[i % len(package_dirs)]
+        filepath = os.path.join(package_dir, 'file_{}.bin'.format(i))
+        with open(filepath + '.sha512', 'w') as f:
+            f.write(value + "\n")
+        remote_names = ['master']
+        if package_dir != project_dir and rng.random() < devel_fraction:
+            remote_names.append('devel')
+        for remote_name in remote_names:
+            mock_file = os.path.join(store_dir, 'mock', remote_name, value)
+            with open(mock_file, 'wb') as f:
+                f.write(contents)
+            os.link(mock_file, os.path.join(store_dir, 'http', remote_name, 'sha512', value))
+        files.append(os.path.relpath(filepath, project_dir))
+        total_bytes += size
+
+    info = {
+        'backend': backend,
+        'num_packages': num_packages,
+        'num_files': num_files,
+        'sizes': sizes,
+        'devel_fraction': devel_fraction,
+        'seed': seed,
+        'total_bytes': total_bytes,
+        'project_dir': project_dir,
+        'http_dir': os.path.join(store_dir, 'http'),
+        'cache_dir': cache_dir,
+        'user_config': user_file,
+        'files': files,
+    }
+    with open(os.path.join(out_dir, 'project.json'), 'w') as f:
+        json.dump(info, f, indent=2, sort_keys=True)
+    return info
+
+
+def add_arguments(parser):
+    parser.add_argument('--backend', choices=['mock', 'http'], default='mock')
+    parser.add_argument('--num_packages', type=int, default=3,
+                        help='Depth of nested packages, each overlaying its parent.')
+    parser.add_argument('--num_files', type=int, default=100)
+    parser.add_argument('--sizes', type=str, default=DEFAULT_SIZES,
+                        help='Size distribution, as comma-separated `size:weight` pairs.')
+    parser.add_argument('--devel_fraction', type=float, default=0.5,
+                        help='Fraction of files (in nested packages) also present in the overlaying remote.')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='Port of the local HTTP server (for `--backend=http`).')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('out_dir', type=str)
+    add_arguments(parser)
+    args = parser.parse_args()
+    info = generate(
+        os.path.abspath(args.out_dir), args.backend, args.num_packages, args.num_files,
+        args.sizes, args.devel_fraction, args.port, args.seed)
+    print("Generated {} files ({} bytes) in {}".format(
+        len(info['files']), info['total_bytes'], info['project_dir']))
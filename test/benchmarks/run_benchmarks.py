@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks the CLI against synthetic projects (see `generate_project.py`), for the `mock`
+backend and for a local HTTP server (via `url_templates`).
+
+Results are written as JSON (see `--output`), and may be compared against a previous run
+(e.g. from another commit) via `--compare`.
+
+Example:
+    ./test/benchmarks/run_benchmarks.py --num_files=200 --output=/tmp/bench.json
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(os.path.dirname(cur_dir))
+src_dir = os.path.join(repo_dir, 'src')
+sys.path.insert(0, src_dir)
+sys.path.insert(0, cur_dir)
+
+import generate_project
+
+cli_file = os.path.join(src_dir, 'external_data_bazel', 'cli.py')
+
+
+class Runner(object):
+    """ Runs CLI commands against a generated project, and accumulates timings. """
+    def __init__(self, info, python, jobs, repeat, verbose=False):
+        self.info = info
+        self.python = python
+        self.jobs = jobs
+        self.repeat = repeat
+        self.results = []
+        self.verbose = verbose
+        self._env = dict(os.environ)
+        self._env['PYTHONPATH'] = src_dir
+        self._env['PYTHONWARNINGS'] = 'ignore'
+
+    def cli(self, args, cwd=None):
+        cmd = [self.python, cli_file,
+               '--user_config={}'.format(self.info['user_config']),
+               '--jobs={}'.format(self.jobs)] + args
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(
+                cmd, cwd=cwd or self.info['project_dir'], env=self._env, stdout=devnull,
+                stderr=None if self.verbose else devnull)
+
+    def time(self, name, func, setup=None, files=None, size=None):
+        """ Time `func` (with `setup` run before each repetition, untimed). Records the median. """
+        samples = []
+        for i in range(self.repeat):
+            if setup:
+                setup()
+            start = time.time()
+            func()
+            samples.append(time.time() - start)
+        samples.sort()
+        seconds = samples[len(samples) // 2]
+        result = {
+            'name': name,
+            'backend': self.info['backend'],
+            'seconds': seconds,
+            'samples': samples,
+        }
+        if files is not None:
+            result['files'] = files
+            result['files_per_sec'] = float(files) / seconds
+        if size is not None:
+            result['bytes'] = size
+            result['mb_per_sec'] = float(size) / seconds / 1024**2
+        self.results.append(result)
+        print("  {:<20} {:8.3f}s".format(name, seconds))
+        return result
+
+
+def _clear_dir(path):
+    if os.path.exists(path):
+        # Cache files are read-only; `rmtree` can still remove them.
+        shutil.rmtree(path)
+
+
+def run_suite(runner, upload_files):
+    info = runner.info
+    project_dir = info['project_dir']
+    num_files = len(info['files'])
+    total_bytes = info['total_bytes']
+    hash_files = [file + '.sha512' for file in info['files']]
+    out_dir = os.path.join(os.path.dirname(project_dir), 'out')
+
+    def download_args(*extra):
+        args = ['download'] + list(extra) + ['--pairs']
+        for file, hash_file in zip(info['files'], hash_files):
+            args += [hash_file, os.path.join(out_dir, file)]
+        return args
+
+    def clear_outputs():
+        _clear_dir(out_dir)
+        for file in info['files']:
+            output_dir = os.path.dirname(os.path.join(out_dir, file))
+            if not os.path.isdir(output_dir):
+                os.makedirs(output_dir)
+
+    def clear_cache():
+        clear_outputs()
+        _clear_dir(info['cache_dir'])
+
+    runner.time('cli_startup', lambda: runner.cli(['--help']))
+
+    def load_project():
+        # Load the project and resolve every file (loading all packages and remotes).
+        env = dict(os.environ, PYTHONPATH=src_dir, PYTHONWARNINGS='ignore')
+        code = (
+            "import sys\n"
+            "from external_data_bazel import core, config_helpers\n"
+            "user = config_helpers.parse_config_file(sys.argv[1])\n"
+            "project = core.load_project(sys.argv[2], user_config_in=user)\n"
+            "for hash_file in sys.argv[3:]:\n"
+            "    project.get_file_info(hash_file)\n")
+        subprocess.check_call(
+            [runner.python, '-c', code, info['user_config'], project_dir] +
+            [os.path.join(project_dir, hash_file) for hash_file in hash_files], env=env)
+    runner.time('project_load', load_project, files=num_files)
+
+    runner.time('download_cold', lambda: runner.cli(download_args('--symlink')),
+                setup=clear_cache, files=num_files, size=total_bytes)
+    runner.time('download_warm', lambda: runner.cli(download_args('--symlink')),
+                setup=clear_outputs, files=num_files, size=total_bytes)
+    runner.time('download_no_cache', lambda: runner.cli(download_args('--no_cache')),
+                setup=clear_cache, files=num_files, size=total_bytes)
+    runner.time('check', lambda: runner.cli(['check'] + hash_files),
+                files=num_files)
+
+    if info['backend'] == 'mock' and upload_files > 0:
+        # Upload new files into the deepest package.
+        upload_dir = os.path.join(project_dir, os.path.dirname(info['files'][-1]), 'upload')
+        mock_upload_dir = os.path.join(os.path.dirname(project_dir), 'store', 'mock', 'upload')
+        def setup_upload():
+            _clear_dir(upload_dir)
+            _clear_dir(mock_upload_dir)
+            os.makedirs(upload_dir)
+            for i in range(upload_files):
+                with open(os.path.join(upload_dir, 'new_{}.bin'.format(i)), 'wb') as f:
+                    f.write(os.urandom(64 * 1024))
+        runner.time('upload',
+                    lambda: runner.cli(['upload'] + ['new_{}.bin'.format(i) for i in range(upload_files)],
+                                       cwd=upload_dir),
+                    setup=setup_upload, files=upload_files, size=upload_files * 64 * 1024)
+
+
+def start_http_server(root_dir, port):
+    """ Serve `root_dir` on localhost in a background thread. """
+    import SimpleHTTPServer
+    import SocketServer
+
+    class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+        def translate_path(self, path):
+            return os.path.join(root_dir, path.split('?')[0].lstrip('/'))
+
+        def log_message(self, *args):
+            pass
+
+    class Server(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+        allow_reuse_address = True
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=repo_dir).strip().decode('utf-8')
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def compare(results, baseline):
+    """ Print the ratio of each timing relative to a baseline run. """
+    baseline_map = dict(
+        ((r['backend'], r['name']), r['seconds']) for r in baseline['results'])
+    print("Comparison against {}:".format(baseline.get('commit')))
+    for result in results['results']:
+        key = (result['backend'], result['name'])
+        if key in baseline_map:
+            ratio = result['seconds'] / baseline_map[key]
+            print("  {:<6} {:<20} {:8.3f}s vs {:8.3f}s ({:.2f}x)".format(
+                key[0], key[1], result['seconds'], baseline_map[key], ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    generate_project.add_arguments(parser)
+    parser.add_argument('--backends', type=str, default='mock,http',
+                        help='Comma-separated backends to benchmark.')
+    parser.add_argument('--work_dir', type=str, default=None,
+                        help='Directory for generated projects (default: temporary).')
+    parser.add_argument('--python', type=str, default=sys.executable,
+                        help='Python interpreter to run the CLI.')
+    parser.add_argument('-j', '--jobs', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Repetitions per measurement; the median is reported.')
+    parser.add_argument('--upload_files', type=int, default=20)
+    parser.add_argument('--output', type=str, default=None,
+                        help='Write JSON results to this file.')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='JSON results of a previous run to compare against.')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Show output (stderr) of CLI commands.')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='external_data_bazel_bench_')
+    results = {
+        'commit': get_commit(),
+        'python': args.python,
+        'jobs': args.jobs,
+        'repeat': args.repeat,
+        'params': {},
+        'results': [],
+    }
+    for backend in args.backends.split(','):
+        print("[ {} ]".format(backend))
+        info = generate_project.generate(
+            os.path.join(os.path.abspath(work_dir), backend), backend, args.num_packages,
+            args.num_files, args.sizes, args.devel_fraction, args.port, args.seed)
+        results['params'] = dict((key, info[key]) for key in [
+            'num_packages', 'num_files', 'sizes', 'devel_fraction', 'seed', 'total_bytes'])
+        server = None
+        if backend == 'http':
+            server = start_http_server(info['http_dir'], args.port)
+        try:
+            runner = Runner(info, args.python, args.jobs, args.repeat, args.verbose)
+            run_suite(runner, args.upload_files)
+            results['results'] += runner.results
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+    if not args.work_dir:
+        shutil.rmtree(work_dir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
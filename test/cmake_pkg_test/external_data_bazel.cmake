@@ -1,9 +1,60 @@
-message(STATUS
-    "Custom fetch"
-    "${ExternalData_CUSTOM_LOCATION}"
-    "${ExternalData_CUSTOM_FILE}"
-)
+# CMake/ExternalData integration for `external_data_bazel`.
+#
+# Set `EXTERNAL_DATA_BAZEL_COMMAND` to the command-line of the CLI (e.g. `bazel-bin/cli`), then
+# include this file. It registers a custom fetch script for URL templates of the form
+# `ExternalDataCustomScript://bazel/%(algo)/%(hash)`, which calls `fetch` for one object.
+#
+# ExternalData runs that script in a separate process for each missing object. To fetch many objects
+# with one process instead, use `external_data_bazel_stage` (below).
 
-set(ExternalData_CUSTOM_ERROR "Custom failure")
+set(_external_data_bazel_dir ${CMAKE_CURRENT_LIST_DIR})
 
-error("I want this to fail")
+if(NOT EXTERNAL_DATA_BAZEL_COMMAND)
+    message(FATAL_ERROR "EXTERNAL_DATA_BAZEL_COMMAND must be set")
+endif()
+if(NOT EXTERNAL_DATA_BAZEL_ROOT)
+    set(EXTERNAL_DATA_BAZEL_ROOT ${CMAKE_CURRENT_SOURCE_DIR})
+endif()
+
+# ExternalData only passes its own settings to custom scripts, so configure the command into one.
+configure_file(
+    ${_external_data_bazel_dir}/external_data_bazel_fetch.cmake.in
+    ${CMAKE_BINARY_DIR}/external_data_bazel_fetch.cmake
+    @ONLY)
+set(ExternalData_CUSTOM_SCRIPT_bazel ${CMAKE_BINARY_DIR}/external_data_bazel_fetch.cmake)
+
+# external_data_bazel_stage(<target> <content_link>...)
+#
+# Adds `<target>`, which fetches the objects of all given content links (e.g. `direct.bin.sha512`)
+# with a single `fetch` call (concurrently, through the user cache) into the first of
+# `ExternalData_OBJECT_STORES`. ExternalData then finds them there rather than calling the custom
+# fetch script for each. Make the ExternalData target depend on `<target>`.
+function(external_data_bazel_stage target)
+    if(ExternalData_OBJECT_STORES)
+        list(GET ExternalData_OBJECT_STORES 0 store)
+    else()
+        # Same default as `ExternalData_Add_Target`.
+        set(store ${CMAKE_BINARY_DIR}/ExternalData/Objects)
+    endif()
+    set(items "")
+    foreach(link ${ARGN})
+        get_filename_component(link ${link} ABSOLUTE)
+        if(NOT link MATCHES "\\.(sha256|sha512)$")
+            message(FATAL_ERROR "Unsupported content link: ${link}")
+        endif()
+        string(TOUPPER ${CMAKE_MATCH_1} algo)
+        # Only the first line is the hash (any further line is a secondary digest).
+        file(STRINGS ${link} hash LIMIT_COUNT 1)
+        string(STRIP "${hash}" hash)
+        string(APPEND items "${algo} ${hash} ${store}/${algo}/${hash}\n")
+        # Re-stage if a content link changes.
+        set_property(DIRECTORY APPEND PROPERTY CMAKE_CONFIGURE_DEPENDS ${link})
+    endforeach()
+    set(input ${CMAKE_CURRENT_BINARY_DIR}/${target}.fetch.txt)
+    file(WRITE ${input} "${items}")
+    add_custom_target(${target}
+        COMMAND ${EXTERNAL_DATA_BAZEL_COMMAND} --project_root_guess=${EXTERNAL_DATA_BAZEL_ROOT}
+            fetch --input ${input}
+        COMMENT "Fetching external data for ${target}"
+        VERBATIM)
+endfunction()
@@ -32,6 +32,16 @@ echo "[ Edge Case Workflow ]"
     # _bazel test :basic_workflows_test
 )
 
+echo "[ Python API ]"
+(
+    ./api_test/run_tests.sh
+)
+
+echo "[ Cache Server ]"
+(
+    ./serve_test/run_tests.sh
+)
+
 echo "[ Backends ]"
 (
     cd backends
@@ -39,6 +49,18 @@ echo "[ Backends ]"
         cd girder
         ./run_tests.sh
     )
+    (
+        cd cas
+        ./run_tests.sh
+    )
+    (
+        cd git_lfs
+        ./run_tests.sh
+    )
+    (
+        cd bazel_remote_cache
+        ./run_tests.sh
+    )
 )
 
 # TODO: Not yet complete.
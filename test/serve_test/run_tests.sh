@@ -0,0 +1,85 @@
+#!/bin/bash
+set -e -u -x
+
+# Tests `serve` against a cache with a plain and a packed entry.
+
+cur_dir=$(cd $(dirname $0) && pwd)
+src_dir=$(cd ${cur_dir}/../../src && pwd)
+python=${PYTHON:-python2}
+port=${SERVE_PORT:-8795}
+
+tmp_dir=$(mktemp -d)
+server_pid=
+cleanup() {
+    [[ -n ${server_pid} ]] && kill ${server_pid}
+    rm -rf ${tmp_dir}
+}
+trap cleanup EXIT
+
+cache_dir=${tmp_dir}/cache
+cat > ${tmp_dir}/user.yml <<EOF
+core:
+    cache_dir: ${cache_dir}
+EOF
+cli() { PYTHONPATH=${src_dir} ${python} ${src_dir}/external_data_bazel/cli.py --user_config=${tmp_dir}/user.yml "$@"; }
+
+# A plain entry.
+echo "Plain contents" > ${tmp_dir}/plain.bin
+plain=$(sha512sum ${tmp_dir}/plain.bin | cut -d' ' -f1)
+mkdir -p ${cache_dir}/sha512/${plain:0:2}/${plain:2:2}
+cp ${tmp_dir}/plain.bin ${cache_dir}/sha512/${plain:0:2}/${plain:2:2}/${plain}
+# A packed entry (after another, so that it does not start the pack).
+echo "Packed contents" > ${tmp_dir}/packed.bin
+packed=$(sha512sum ${tmp_dir}/packed.bin | cut -d' ' -f1)
+PYTHONPATH=${src_dir} ${python} - ${cache_dir}/packs ${tmp_dir}/packed.bin <<EOF
+import hashlib, sys
+from external_data_bazel.packs import PackStore
+store = PackStore(sys.argv[1], threshold=1024)
+store.add('sha512', hashlib.sha512(b'Other').hexdigest(), b'Other')
+data = open(sys.argv[2], 'rb').read()
+store.add('sha512', hashlib.sha512(data).hexdigest(), data)
+EOF
+
+url=http://127.0.0.1:${port}
+# Fail fast if another server (e.g. from an interrupted run) has the port.
+if curl -s ${url}/ > /dev/null; then
+    echo "Port ${port} is already in use" >&2
+    exit 1
+fi
+# Start the server itself (not a subshell running `cli`), so that `cleanup` stops it.
+PYTHONPATH=${src_dir} ${python} ${src_dir}/external_data_bazel/cli.py \
+    --user_config=${tmp_dir}/user.yml serve --port ${port} 2> ${tmp_dir}/serve.log &
+server_pid=$!
+# Wait until it is listening (it prints once bound), or has exited.
+for i in $(seq 50); do
+    grep -q "^Serving " ${tmp_dir}/serve.log && break
+    kill -0 ${server_pid} || { cat ${tmp_dir}/serve.log >&2; exit 1; }
+    sleep 0.1
+done
+# Only localhost by default.
+grep "http://127.0.0.1:${port}/" ${tmp_dir}/serve.log
+
+status() { curl -s -o /dev/null --write-out "%{http_code}" "$@"; }
+
+# Whole files.
+curl -s --fail ${url}/sha512/${plain} | diff - ${tmp_dir}/plain.bin
+curl -s --fail ${url}/sha512/${packed} | diff - ${tmp_dir}/packed.bin
+curl -s -I ${url}/sha512/${plain} | grep "^Content-Length: 15"
+
+# Ranges.
+[[ $(status -H "Range: bytes=6-13" ${url}/sha512/${plain}) -eq 206 ]]
+[[ $(curl -s -H "Range: bytes=6-13" ${url}/sha512/${plain}) == "contents" ]]
+curl -s -D - -o /dev/null -H "Range: bytes=6-13" ${url}/sha512/${plain} | grep "^Content-Range: bytes 6-13/15"
+[[ $(curl -s -H "Range: bytes=0-5" ${url}/sha512/${packed}) == "Packed" ]]
+[[ $(curl -s -H "Range: bytes=-9" ${url}/sha512/${packed}) == "contents" ]]
+[[ $(status -H "Range: bytes=100-" ${url}/sha512/${plain}) -eq 416 ]]
+
+# Unknown entries or paths.
+[[ $(status ${url}/sha512/$(echo missing | sha512sum | cut -d' ' -f1)) -eq 404 ]]
+[[ $(status ${url}/md5/${plain}) -eq 404 ]]
+[[ $(status ${url}/sha512/${plain}/extra) -eq 404 ]]
+[[ $(status --path-as-is ${url}/../user.yml) -eq 404 ]]
+[[ $(status --path-as-is ${url}/sha512/../../user.yml) -eq 404 ]]
+[[ $(status ${url}/packs/pack-000000.pack) -eq 404 ]]
+
+echo "[ Done ]"
@@ -19,7 +19,9 @@ SETTINGS_DEFAULT = dict(
 )
 
 
-_HASH_SUFFIX = ".sha512"
+# @note Must be kept in sync with `hashes.hash_types`. The first suffix is the default.
+_HASH_SUFFIXES = [".sha512", ".sha512_tree", ".sha256"]
+_HASH_SUFFIX = _HASH_SUFFIXES[0]
 _RULE_SUFFIX = "__download"
 _RULE_TAG = "external_data"
 _TEST_SUFFIX = "__check_test"
@@ -78,27 +80,13 @@ def external_data(file, mode='normal', visibility=None,
         )
     elif mode in ['normal', 'no_cache']:
         name = file + _RULE_SUFFIX
-        hash_file = file + _HASH_SUFFIX
+        hash_file = _get_hash_file(file)
 
         # TODO(eric.cousineau): If we enable Git LFS as a frontend, then this should
         # conditionally add *.sha512 as a dependency. Otherwise, need to figure out another
         # source for the hash.
 
-        # Binary:
-        args = ["$(location {})".format(_TOOL)]
-        # General commands.
-        args += _get_cli_base_args(hash_file, settings)
-        # Subcommand: Download.
-        args.append("download")
-        # Argument: Caching.
-        if mode == 'no_cache':
-            args.append("--no_cache")
-        else:
-            # Use symlinking to avoid needing to copy data to sandboxes.
-            # The cache files are made read-only, so even if a test is run
-            # with `--spawn_strategy=standalone`, there should be a permission error
-            # when attempting to write to the file.
-            args.append("--symlink")
+        args = _get_download_args(hash_file, mode, settings)
         # Argument: Hash file.
         args.append("$(location {})".format(hash_file))
         # Argument: Output file.
@@ -140,9 +128,64 @@ def external_data(file, mode='normal', visibility=None,
         fail("Invalid mode: {}".format(mode))
 
 
+def _get_download_args(hash_file, mode, settings):
+    # Binary:
+    args = ["$(location {})".format(_TOOL)]
+    # General commands.
+    args += _get_cli_base_args(hash_file, settings)
+    # Subcommand: Download.
+    args.append("download")
+    # Argument: Caching.
+    if mode == 'no_cache':
+        args.append("--no_cache")
+    else:
+        # Use symlinking to avoid needing to copy data to sandboxes.
+        # The cache files are made read-only, so even if a test is run
+        # with `--spawn_strategy=standalone`, there should be a permission error
+        # when attempting to write to the file.
+        args.append("--symlink")
+    return args
+
+
+def _external_data_batch(name, files, mode, visibility, settings):
+    # Download all `files` in a single action (and a single CLI process).
+    hash_files = [_get_hash_file(file) for file in files]
+    args = _get_download_args(hash_files[0], mode, settings)
+    args.append("--pairs")
+    for file, hash_file in zip(files, hash_files):
+        args += ["$(location {})".format(hash_file), "$(location {})".format(file)]
+    cmd = " ".join(args)
+
+    if settings['verbose']:
+        print("\nexternal_data_group(name = '{}', mode = '{}', batch = True):".format(name, mode) +
+              "\n  cmd: {}".format(cmd))
+
+    native.genrule(
+        name = name + _RULE_SUFFIX,
+        srcs = hash_files + [settings['cli_sentinel']] + settings['cli_data'],
+        outs = files,
+        cmd = cmd,
+        tools = [_TOOL],
+        tags = [_RULE_TAG],
+        # @see external_data
+        local = 1,
+        visibility = visibility,
+    )
+
+    if settings['enable_check_test']:
+        for file in files:
+            _external_data_check_test(file, settings)
+
+
 def external_data_group(name, files, files_devel = [], mode='normal', visibility=None,
-                        settings=SETTINGS_DEFAULT):
-    """ @see external_data """
+                        settings=SETTINGS_DEFAULT, batch=False):
+    """ @see external_data
+
+    batch:
+        If True, all non-devel files are downloaded by a single action, which resolves
+        and fetches the files concurrently in one CLI process, rather than one action
+        per file. Useful for large groups.
+    """
 
     # Overlay.
     settings = SETTINGS_DEFAULT + settings
@@ -152,11 +195,17 @@ def external_data_group(name, files, files_devel = [], mode='normal', visibility
 
     kwargs = {'visibility': visibility, 'settings': settings}
 
+    files_batch = []
     for file in files:
         if file not in files_devel:
-            external_data(file, mode, **kwargs)
+            if batch and mode != "devel":
+                files_batch.append(file)
+            else:
+                external_data(file, mode, **kwargs)
         else:
             external_data(file, "devel", **kwargs)
+    if files_batch:
+        _external_data_batch(name, files_batch, mode, **kwargs)
 
     # Consume leftover `files_devel`.
     devel_only = []
@@ -180,7 +229,7 @@ def external_data_group(name, files, files_devel = [], mode='normal', visibility
 def _external_data_check_test(file, settings):
     # This test merely checks that this file is indeed available on the remote (ignoring cache).
     name = file + _TEST_SUFFIX
-    hash_file = file + _HASH_SUFFIX
+    hash_file = _get_hash_file(file)
 
     args = _get_cli_base_args(hash_file, settings)
     args += [
@@ -211,11 +260,23 @@ def _external_data_check_test(file, settings):
     return name
 
 
+def _get_hash_file(file):
+    # Use whichever hash file is present in this package, or the default.
+    for suffix in _HASH_SUFFIXES:
+        if native.glob([file + suffix]):
+            return file + suffix
+    return file + _HASH_SUFFIX
+
+
 def get_original_files(hash_files):
     files = []
     for hash_file in hash_files:
-        if not hash_file.endswith(_HASH_SUFFIX):
-            fail("Hash file does end with '{}': '{}'".format(_HASH_SUFFIX, hash_file))
-        file = hash_file[:-len(_HASH_SUFFIX)]
+        file = None
+        for suffix in _HASH_SUFFIXES:
+            if hash_file.endswith(suffix):
+                file = hash_file[:-len(suffix)]
+                break
+        if file == None:
+            fail("Hash file does end with one of {}: '{}'".format(_HASH_SUFFIXES, hash_file))
         files.append(file)
     return files